@@ -5,6 +5,8 @@ REM --- Configuration ---
 SET "USERNAME=user001"
 SET "LogFile=%~dp0ResourceTracker_%COMPUTERNAME%.log"
 SET "TargetURL=http://localhost:8000/admin/"
+SET "DeltaURL=%TargetURL%delta"
+SET "HwmFile=%~dp0ResourceTracker_%COMPUTERNAME%.hwm"
 SET "ScheduleName=ResourceTracker"
 SET "DEBUG=1"
 
@@ -96,8 +98,10 @@ set /p InternetStatus=<temp_internet.txt
 del temp_internet.txt
 
 if "%InternetStatus%"=="$true" (
-    call :Debug "Internet OK. Uploading..."
-    powershell -c "$uri='%TargetURL%'; $file='%LogFile%'; if (Test-Path $file) { try { Invoke-RestMethod -Uri $uri -Method POST -InFile $file -ContentType 'text/plain'; 'UPLOAD_SUCCESS' } catch { 'UPLOAD_FAILED' } } else { 'FILE_NOT_FOUND' }" > temp_upload.txt
+    call :Debug "Internet OK. Uploading records newer than the last high-water mark..."
+    REM Only blocks stamped after the saved high-water mark are sent (gzip); the
+    REM server skips any it already has and answers with the new mark to save.
+    powershell -c "$uri='%DeltaURL%'; $file='%LogFile%'; $hwmFile='%HwmFile%'; if (Test-Path $file) { $hwm=''; if (Test-Path $hwmFile) { $hwm=(Get-Content $hwmFile -Raw).Trim() }; $out=New-Object System.Collections.Generic.List[string]; $keep=$false; foreach ($line in Get-Content $file) { if ($line -match '^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - ') { $keep=($hwm -eq '') -or ($matches[1] -gt $hwm) }; if ($keep) { $out.Add($line) } }; if ($out.Count -eq 0) { 'NOTHING_NEW' } else { $body=[Text.Encoding]::UTF8.GetBytes([string]::Join([char]10, $out)); $ms=New-Object IO.MemoryStream; $gz=New-Object IO.Compression.GZipStream($ms, [IO.Compression.CompressionMode]::Compress); $gz.Write($body, 0, $body.Length); $gz.Close(); try { $r=Invoke-RestMethod -Uri $uri -Method POST -Body $ms.ToArray() -ContentType 'text/plain' -Headers @{'Content-Encoding'='gzip'}; if ($r.high_water_mark) { Set-Content -Path $hwmFile -Value $r.high_water_mark }; 'UPLOAD_SUCCESS' } catch { 'UPLOAD_FAILED' } } } else { 'FILE_NOT_FOUND' }" > temp_upload.txt
     set /p UploadResult=<temp_upload.txt
     del temp_upload.txt
     call :Debug "Upload result: %UploadResult%"
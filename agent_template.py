@@ -0,0 +1,127 @@
+import os
+import re
+import csv
+import io
+import zipfile
+import threading
+
+from export import ChunkSink
+
+# Agent script shipped with the server, personalised per user on download
+TEMPLATE_BAT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "ResourceTrackerGpsNotFounf.bat"
+)
+
+# The line replaced in the template, e.g.  SET "USERNAME=user001"
+USERNAME_LINE_RE = re.compile(r'SET\s+"USERNAME=.*?"')
+
+# Characters that would end the SET "..." string or be expanded by cmd.exe
+UNSAFE_USERNAME_RE = re.compile(r'["%!^&|<>\r\n]')
+
+# Most usernames accepted by one bulk download
+BULK_MAX_USERS = 5000
+
+
+def check_username(username):
+    """Trimmed username, or ValueError if it is empty or unsafe inside the BAT."""
+    username = (username or "").strip()
+    if not username:
+        raise ValueError("Username is required")
+    if UNSAFE_USERNAME_RE.search(username):
+        raise ValueError(f"Username contains characters not allowed in the agent script: {username!r}")
+    return username
+
+
+def agent_filename(username):
+    return f"ResourceTracker_{username}.bat"
+
+
+class AgentTemplate:
+    """
+    The agent BAT split into the bytes before and after its USERNAME line.
+    Loaded once and reloaded only when the file's mtime or size changes,
+    so rendering a personalised copy is a byte concatenation.
+    """
+
+    def __init__(self, path=TEMPLATE_BAT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._segments = None
+
+    def _load(self):
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return self._segments
+        with self._lock:
+            if stamp != self._stamp:
+                with open(self.path, "rb") as f:
+                    content = f.read().decode("utf-8")
+                match = USERNAME_LINE_RE.search(content)
+                if match:
+                    prefix, suffix = content[:match.start()], content[match.end():]
+                else:
+                    # No USERNAME line: prepend one
+                    prefix, suffix = "", "\n" + content
+                self._segments = (prefix.encode("utf-8"), suffix.encode("utf-8"))
+                self._stamp = stamp
+            return self._segments
+
+    def render(self, username):
+        """Personalised agent script (bytes); raises OSError if the template is missing."""
+        prefix, suffix = self._load()
+        return b"".join((prefix, f'SET "USERNAME={username}"'.encode("utf-8"), suffix))
+
+    def iter_zip(self, usernames):
+        """Stream a zip with one personalised agent per username."""
+        self._load()
+        sink = ChunkSink()
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+            for username in usernames:
+                archive.writestr(agent_filename(username), self.render(username))
+                data = sink.drain()
+                if data:
+                    yield data
+        yield sink.drain()
+
+
+def parse_username_csv(text):
+    """
+    Usernames from CSV text: the first column of each row, optional
+    "username" header, blanks and duplicates skipped. Raises ValueError
+    for unsafe names or more than BULK_MAX_USERS.
+    """
+    usernames = []
+    seen = set()
+    for row in csv.reader(io.StringIO(text)):
+        if not row or not row[0].strip():
+            continue
+        name = row[0].strip()
+        if not usernames and not seen and name.lower() == "username":
+            seen.add(name)
+            continue
+        name = check_username(name)
+        if name in seen:
+            continue
+        seen.add(name)
+        usernames.append(name)
+        if len(usernames) > BULK_MAX_USERS:
+            raise ValueError(f"At most {BULK_MAX_USERS} usernames per download")
+    if not usernames:
+        raise ValueError("No usernames found in CSV")
+    return usernames
+
+
+_template = None
+_template_lock = threading.Lock()
+
+
+def get_agent_template():
+    """Return the process-wide agent template."""
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = AgentTemplate()
+    return _template
@@ -0,0 +1,423 @@
+import os
+import time
+import threading
+from collections import deque
+
+from fleet import (
+    ALERT_RULES, RULE_OPS, build_alert, device_metrics, first_matching_rule,
+    rule_categories,
+)
+import serializer
+from locking import SHARED_PROCESSES
+from logs import get_logger
+from storage import DATA_DIR, ThreadLocalSQLite
+from store import get_store
+
+ALERT_DB_FILE = os.path.join(DATA_DIR, "alerts.db")
+
+# Written by earlier versions; imported once into the database
+ALERT_STATE_FILE = os.path.join(DATA_DIR, "alert_state.json")
+
+# An open alert only resolves once its metric is this many points back
+# on the safe side of the threshold (e.g. RAM > 85 resolves at <= 83)
+ALERT_HYSTERESIS = float(os.environ.get("RT_ALERT_HYSTERESIS", "2"))
+
+# An alert that opened FLAP_THRESHOLD times within FLAP_WINDOW seconds is flapping
+FLAP_WINDOW = int(os.environ.get("RT_ALERT_FLAP_WINDOW", "3600"))
+FLAP_THRESHOLD = int(os.environ.get("RT_ALERT_FLAP_THRESHOLD", "3"))
+
+# Recent alert events kept (in memory and in the database) for
+# /api/alerts/stream and long-poll clients
+EVENT_BACKLOG = 1000
+
+# With several server processes, how often a waiting stream re-checks the
+# database for events published by the other processes (seconds)
+SHARED_POLL_INTERVAL = 1.0
+
+log = get_logger("alerts")
+
+
+def _still_breached(rule, value, margin):
+    """True while `value` is within the hysteresis band of `rule`."""
+    threshold = rule["threshold"]
+    if rule["op"] in (">", ">="):
+        return RULE_OPS[rule["op"]](value, threshold - margin)
+    return RULE_OPS[rule["op"]](value, threshold + margin)
+
+
+def _copy_state(state):
+    return dict(state, opened=deque(state["opened"]))
+
+
+class AlertEngine:
+    """
+    Stateful alert evaluation run once per ingested record.
+
+    Keeps one state per (device, category): open alerts, the last
+    resolution and recent open times for flap detection. Reads cost
+    O(active alerts); every open/update/resolve is published as an event
+    for streaming clients.
+
+    States are rows of an embedded SQLite database keyed by (user_id,
+    category). Each state carries the sequence number of the event that
+    last changed it, and an evaluation writes only the states it changed
+    plus their events. Records that change nothing write nothing.
+
+    When several server processes share processed_data, each process
+    catches up by reading the states and events with a sequence number
+    above the last one it has seen. An evaluation that changes something
+    is re-run inside the database's write transaction, after catching up,
+    so it starts from the latest state of every process.
+    """
+
+    def __init__(self, rules=ALERT_RULES, path=ALERT_DB_FILE):
+        self.rules = rules
+        self.categories = rule_categories(rules)
+        self.path = path
+        self._conn = ThreadLocalSQLite(path)
+        self._states = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=EVENT_BACKLOG)
+        self._seq = 0
+        self._changed = threading.Condition(self._lock)
+        self._init_schema()
+
+    # ---------- persistence ----------
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS alert_states (
+                user_id  TEXT NOT NULL,
+                category TEXT NOT NULL,
+                seq      INTEGER NOT NULL,
+                state    TEXT NOT NULL,
+                PRIMARY KEY (user_id, category)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_alert_states_seq ON alert_states (seq)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS alert_events (seq INTEGER PRIMARY KEY, event TEXT NOT NULL)"
+        )
+
+        # The first process to start fills an empty database; the others
+        # wait on the write lock and then load what it wrote
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            empty = conn.execute("SELECT 1 FROM alert_states LIMIT 1").fetchone() is None
+            if empty and not self._import_legacy_json(conn, ALERT_STATE_FILE):
+                self.rebuild(get_store().iter_snapshots(), conn)
+            else:
+                self._catch_up(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _import_legacy_json(self, conn, path):
+        """One-time migration of an alert_state.json from earlier versions."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "rb") as f:
+                saved = serializer.loads(f.read())
+        except (OSError, ValueError) as e:
+            log.error("Error importing alert state %s: %s", path, e)
+            return False
+
+        seq = saved.get("seq", 0)
+        changes = []
+        for state in saved.get("states", []):
+            state["opened"] = deque(state.get("opened", []))
+            state.setdefault("seq", seq)
+            changes.append(((state["user_id"], state["category"]), state, None))
+        with self._lock:
+            self._apply(changes)
+            self._events.extend(saved.get("events", []))
+            self._seq = seq
+        self._write(conn, changes, list(self._events))
+        log.info("Imported %d alert states from %s", len(changes), path)
+        return True
+
+    def _catch_up(self, conn):
+        """
+        Load the states and events other processes (or an earlier run)
+        wrote after the last event this process has seen.
+        Runs inside a transaction, so both reads see the same data.
+        """
+        with self._lock:
+            seq = self._seq
+        rows = conn.execute("SELECT state FROM alert_states WHERE seq > ?", (seq,)).fetchall()
+        events = conn.execute(
+            "SELECT event FROM alert_events WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        if not rows and not events:
+            return
+
+        with self._lock:
+            for (doc,) in rows:
+                state = serializer.loads(doc)
+                state["opened"] = deque(state["opened"])
+                key = (state["user_id"], state["category"])
+                current = self._states.get(key)
+                if current is None or current.get("seq", 0) < state["seq"]:
+                    self._store_state(key, state)
+            for (doc,) in events:
+                event = serializer.loads(doc)
+                if event["seq"] > self._seq:
+                    self._events.append(event)
+                    self._seq = event["seq"]
+            self._changed.notify_all()
+
+    def _refresh(self):
+        """Catch up with what other processes wrote, if anything."""
+        conn = self._conn()
+        with self._lock:
+            seq = self._seq
+        if (conn.execute("SELECT MAX(seq) FROM alert_events").fetchone()[0] or 0) <= seq:
+            return
+        conn.execute("BEGIN")
+        try:
+            self._catch_up(conn)
+        finally:
+            conn.execute("COMMIT")
+
+    def _write(self, conn, changes, events):
+        """Upsert the changed states and append their events (inside a transaction)."""
+        conn.executemany(
+            """
+            INSERT INTO alert_states (user_id, category, seq, state) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, category) DO UPDATE
+                SET seq = excluded.seq, state = excluded.state
+                WHERE excluded.seq > alert_states.seq
+            """,
+            [
+                (key[0], key[1], state["seq"], serializer.dumps(dict(state, opened=list(state["opened"]))))
+                for key, state, _ in changes
+            ],
+        )
+        if events:
+            conn.executemany(
+                "INSERT OR IGNORE INTO alert_events (seq, event) VALUES (?, ?)",
+                [(event["seq"], serializer.dumps(event)) for event in events],
+            )
+            conn.execute(
+                "DELETE FROM alert_events WHERE seq <= ?", (events[-1]["seq"] - EVENT_BACKLOG,)
+            )
+
+    # ---------- evaluation ----------
+
+    def rebuild(self, snapshots, conn=None):
+        """Evaluate every DeviceSnapshot once (used when no saved state exists)."""
+        changes, events = [], []
+        for snapshot in snapshots:
+            device_changes = self._changes(snapshot.user_id, snapshot, time.time())
+            with self._lock:
+                events.extend(self._apply(device_changes))
+            changes.extend(c for c in device_changes if c[2] is not None)
+
+        if conn is not None:
+            self._write(conn, changes, events[-EVENT_BACKLOG:])
+        else:
+            self._commit(changes, events[-EVENT_BACKLOG:])
+
+    def evaluate(self, user_id, snapshot, now=None, persist=True):
+        """Run the rules for one DeviceSnapshot; returns the events it produced."""
+        now = now or time.time()
+        if SHARED_PROCESSES:
+            self._refresh()
+        if not SHARED_PROCESSES or not persist:
+            with self._lock:
+                changes = self._changes(user_id, snapshot, now)
+                events = self._apply(changes)
+            if events and persist:
+                self._commit(changes, events)
+            return events
+
+        with self._lock:
+            changes = self._changes(user_id, snapshot, now)
+            if not any(event for _, _, event in changes):
+                return self._apply(changes)
+
+        # Something changes: decide again under the write lock, from the
+        # latest state of every process
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._catch_up(conn)
+            with self._lock:
+                changes = self._changes(user_id, snapshot, now)
+                events = self._apply(changes)
+            self._write(conn, [c for c in changes if c[2] is not None], events)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return events
+
+    def _commit(self, changes, events):
+        """Write the states that have an event, in a transaction of their own."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write(conn, [c for c in changes if c[2] is not None], events)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _changes(self, user_id, snapshot, now):
+        """
+        (key, new state, event) for every category of the device whose
+        state this snapshot touches; event is None when nothing visible
+        changed. Works on copies: nothing is applied yet.
+        """
+        metrics = device_metrics(snapshot)
+        user = snapshot.username if snapshot.username is not None else user_id
+        changes = []
+        for category in self.categories:
+            key = (user_id, category)
+            state = self._states.get(key)
+            rule = first_matching_rule(self.rules, category, metrics)
+
+            if rule is None and state is not None and state["status"] == "open":
+                current = self._rule(state["rule"])
+                if current is not None and _still_breached(
+                    current, metrics[current["metric"]], ALERT_HYSTERESIS
+                ):
+                    rule = current
+
+            if rule is not None:
+                if state is None:
+                    state = {"user_id": user_id, "category": category, "opened": deque()}
+                else:
+                    state = _copy_state(state)
+                event = self._open_or_update(state, rule, user, metrics, now)
+            elif state is not None and state["status"] == "open":
+                state = _copy_state(state)
+                event = self._resolve(state, metrics, now)
+            else:
+                continue
+            changes.append((key, state, event))
+        return changes
+
+    def _apply(self, changes):
+        """
+        Make `changes` current and publish their events with the next
+        sequence numbers (called with the lock held).
+        """
+        events = []
+        for key, state, event in changes:
+            if event is not None:
+                self._seq += 1
+                event["seq"] = state["seq"] = self._seq
+                self._events.append(event)
+                events.append(event)
+            self._store_state(key, state)
+        if events:
+            self._changed.notify_all()
+        return events
+
+    def _store_state(self, key, state):
+        self._states[key] = state
+        if state["status"] == "open":
+            self._active[key] = state
+        else:
+            self._active.pop(key, None)
+
+    def _rule(self, index):
+        return self.rules[index] if 0 <= index < len(self.rules) else None
+
+    def _open_or_update(self, state, rule, user, metrics, now):
+        value = metrics[rule["metric"]]
+        alert = build_alert(rule, user, value)
+        rule_index = self.rules.index(rule)
+
+        if state.get("status") == "open":
+            changed = state["rule"] != rule_index or state["alert"]["value"] != value
+            state.update(rule=rule_index, alert=alert, updated_at=now)
+            event_type = "update" if changed else None
+        else:
+            state["opened"].append(now)
+            state.update(
+                status="open", rule=rule_index, alert=alert,
+                opened_at=now, updated_at=now, resolved_at=None,
+            )
+            event_type = "open"
+
+        while state["opened"] and state["opened"][0] < now - FLAP_WINDOW:
+            state["opened"].popleft()
+        state["flapping"] = len(state["opened"]) >= FLAP_THRESHOLD
+
+        if event_type is None:
+            return None
+        return {"event": event_type, "alert": self._view(state)}
+
+    def _resolve(self, state, metrics, now):
+        state.update(status="resolved", resolved_at=now, updated_at=now)
+        rule = self._rule(state["rule"])
+        if rule is not None:
+            state["alert"] = dict(state["alert"], value=metrics[rule["metric"]])
+        return {"event": "resolve", "alert": self._view(state)}
+
+    @staticmethod
+    def _view(state):
+        return dict(
+            state["alert"],
+            user_id=state["user_id"],
+            status=state["status"],
+            flapping=state.get("flapping", False),
+            opened_at=state.get("opened_at"),
+            resolved_at=state.get("resolved_at"),
+        )
+
+    # ---------- reads ----------
+
+    def active_alerts(self):
+        """Currently open alerts, oldest first."""
+        if SHARED_PROCESSES:
+            self._refresh()
+        with self._lock:
+            return [self._view(state) for state in self._active.values()]
+
+    def last_seq(self):
+        if SHARED_PROCESSES:
+            self._refresh()
+        with self._lock:
+            return self._seq
+
+    def events_since(self, seq, timeout=0):
+        """
+        Events with a sequence number above `seq`, waiting up to `timeout`
+        seconds for one to arrive.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if SHARED_PROCESSES:
+                self._refresh()
+            with self._lock:
+                if self._seq > seq:
+                    return [event for event in self._events if event["seq"] > seq]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                if SHARED_PROCESSES:
+                    remaining = min(remaining, SHARED_POLL_INTERVAL)
+                self._changed.wait(remaining)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_alert_engine():
+    """Return the process-wide alert engine."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AlertEngine()
+    return _engine
@@ -0,0 +1,95 @@
+"""
+Benchmark fleet-wide usage and alert evaluation.
+
+Usage:
+    python benchmarks/bench_fleet.py [--devices 50000] [--repeat 5]
+
+Builds a FleetSnapshot over synthetic DeviceSnapshots and times usage
+computation (numpy is used when installed) and the per-record alert-rule
+matching the alert engine runs on ingest.
+Also reports the memory held per device as a DeviceSnapshot versus the
+nested store document.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fleet  # noqa: E402
+from fleet import FleetSnapshot  # noqa: E402
+from device_snapshot import DeviceSnapshot  # noqa: E402
+
+
+def make_records(devices, seed=1):
+    rng = random.Random(seed)
+    for i in range(devices):
+        total_ram = rng.choice([4, 8, 15.78, 16, 32])
+        total_storage = rng.choice([128, 225.28, 256, 512])
+        yield DeviceSnapshot(
+            user_id=f"user{i:06d}",
+            username=f"user{i:06d}",
+            computer_name=f"DESKTOP-{i:06d}",
+            received_at="2025-12-05T05:21:21",
+            serial=f"SN{i:010d}",
+            cpu_cores=rng.choice([2, 4, 8]),
+            total_ram_gb=total_ram,
+            available_ram_mb=rng.uniform(0, total_ram * 1024),
+            total_storage_gb=total_storage,
+            available_storage_gb=rng.uniform(0, total_storage),
+        )
+
+
+def bytes_per_device(build, devices):
+    """Memory allocated per device by build() (the result is kept alive while measuring)."""
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / devices
+
+
+def best_ms(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    records = list(make_records(args.devices))
+    snapshot = FleetSnapshot(records)
+
+    print(f"devices: {args.devices}  numpy: {'yes' if fleet.np is not None else 'no'}")
+    print(f"build snapshot:   {best_ms(lambda: FleetSnapshot(records), args.repeat):8.1f} ms")
+    print(f"usage metrics:    {best_ms(lambda: FleetSnapshot._used_pct(snapshot.total_ram_gb, snapshot.available_ram_mb, 1024), args.repeat):8.1f} ms")
+    categories = fleet.rule_categories(fleet.ALERT_RULES)
+    print(f"alert rules:      {best_ms(lambda: [fleet.first_matching_rule(fleet.ALERT_RULES, c, fleet.device_metrics(r)) for r in records for c in categories], args.repeat):8.1f} ms")
+    print(f"usage rows:       {best_ms(snapshot.usage_rows, args.repeat):8.1f} ms")
+
+    # Both decoded from the stored JSON, as the record store reads them
+    stored = [(r.user_id, r.to_json()) for r in records]
+    as_snapshots = bytes_per_device(
+        lambda: [DeviceSnapshot.from_document(json.loads(doc), u) for u, doc in stored], args.devices
+    )
+    as_documents = bytes_per_device(
+        lambda: [(u, json.loads(doc)) for u, doc in stored], args.devices
+    )
+    print(f"memory per device: DeviceSnapshot {as_snapshots:6.0f} B  store document {as_documents:6.0f} B")
+
+
+if __name__ == "__main__":
+    main()
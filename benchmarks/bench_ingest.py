@@ -0,0 +1,509 @@
+"""
+End-to-end ingest benchmark for the Flask app.
+
+Usage:
+    python benchmarks/bench_ingest.py [--devices 200] [--records 20]
+                                      [--concurrency 8] [--endpoint admin|delta]
+                                      [--url http://127.0.0.1:8000] [--data-dir DIR]
+                                      [--db-repeat 50] [--no-db]
+
+Synthesizes agent uploads in the exact format the .bat agent writes for
+N devices x K boots and posts them to /admin (the whole accumulated log
+on every boot, like older agents) or /admin/delta (only the new block,
+gzip-compressed, like the current agent) from a thread pool. Requests go
+through Flask's test client, or over HTTP to a running server with --url.
+
+Reports ingest throughput, p50/p95/p99 request latency and how much
+processed_data/ and user_logs/ grew. Unless --no-db is given it then
+times the db_handler dashboard queries against a SQLite-backed stand-in
+for MySQL seeded with one user and assigned device per synthetic device,
+so they can be measured without a database server.
+"""
+import io
+import os
+import re
+import sys
+import gzip
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+import contextlib
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app creates its storage directories relative to the cwd on import
+os.chdir(tempfile.mkdtemp(prefix="rt_bench_"))
+
+BLOCK = """======================================================
+{timestamp} - {computer}
+======================================================
+Username: {username}
+GPS Location: GPS: {latitude:.7f} , {longitude:.7f}
+Manufacturer: {manufacturer}
+Model: {model}
+Serial: {serial}
+CPU Name: {cpu}
+CPU Cores: {cores}
+Max Clock Speed: {clock} MHz
+Total RAM: {total_ram} GB
+Available RAM: {available_ram} MB
+Total Storage C:: {total_storage} GB
+Available Storage C: {available_storage} GB
+
+"""
+
+MODELS = [
+    ("Acer", "Extensa 215-54", "11th Gen Intel(R) Core(TM) i3-1115G4 @ 3.00GHz", 2, 2995),
+    ("Dell", "Latitude 5420", "11th Gen Intel(R) Core(TM) i5-1145G7 @ 2.60GHz", 4, 2611),
+    ("HP", "ProBook 450 G8", "11th Gen Intel(R) Core(TM) i7-1165G7 @ 2.80GHz", 4, 2803),
+    ("Lenovo", "ThinkPad E14 Gen 2", "AMD Ryzen 5 4500U with Radeon Graphics", 6, 2375),
+]
+
+
+class Device:
+    """One synthetic agent: fixed hardware, RAM/storage that drift per boot."""
+
+    def __init__(self, index, rng):
+        self.index = index
+        self.rng = rng
+        self.username = f"user{index:05d}"
+        self.computer = f"DESKTOP-{index:07X}"
+        self.serial = f"NXBENCH{index:015d}"
+        self.manufacturer, self.model, self.cpu, self.cores, self.clock = rng.choice(MODELS)
+        self.latitude = 10.8 + rng.uniform(-0.5, 0.5)
+        self.longitude = 76.6 + rng.uniform(-0.5, 0.5)
+        self.total_ram = rng.choice([7.84, 15.78, 31.71])
+        self.total_storage = rng.choice([118.2, 225.28, 475.69])
+        self.used_storage = self.total_storage * rng.uniform(0.2, 0.6)
+        self.blocks = []
+
+    def boot(self, timestamp):
+        """Append the block this boot writes to the agent log and return it."""
+        self.used_storage = min(self.total_storage * 0.99, self.used_storage + self.rng.uniform(0, 0.5))
+        block = BLOCK.format(
+            timestamp=timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            computer=self.computer,
+            username=self.username,
+            latitude=self.latitude,
+            longitude=self.longitude,
+            manufacturer=self.manufacturer,
+            model=self.model,
+            serial=self.serial,
+            cpu=self.cpu,
+            cores=self.cores,
+            clock=self.clock,
+            total_ram=self.total_ram,
+            available_ram=round(self.total_ram * 1024 * self.rng.uniform(0.05, 0.8), 4),
+            total_storage=self.total_storage,
+            available_storage=round(self.total_storage - self.used_storage, 2),
+        )
+        self.blocks.append(block)
+        return block
+
+
+def make_uploads(devices, records, endpoint, seed=1):
+    """
+    (path, body, headers, blocks) for every upload, boot by boot across
+    the fleet. Boots are one hour apart and end now, so history samples
+    land inside the raw retention window.
+    """
+    rng = random.Random(seed)
+    fleet = [Device(i, rng) for i in range(devices)]
+    start = datetime.now().replace(microsecond=0) - timedelta(hours=records)
+    uploads = []
+    for boot in range(records):
+        for device in fleet:
+            block = device.boot(start + timedelta(hours=boot, seconds=device.index % 3600))
+            if endpoint == "delta":
+                uploads.append((
+                    "/admin/delta",
+                    gzip.compress(block.encode("utf-8")),
+                    {"Content-Type": "text/plain", "Content-Encoding": "gzip"},
+                    1,
+                ))
+            else:
+                uploads.append((
+                    "/admin",
+                    "".join(device.blocks).encode("utf-8"),
+                    {"Content-Type": "text/plain"},
+                    len(device.blocks),
+                ))
+    return fleet, uploads
+
+
+# ---------- transports ----------
+
+class TestClientTransport:
+    """Posts through Flask's test client; one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, body, headers):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, data=body, headers=headers)
+        return response.status_code
+
+
+class HttpTransport:
+    """Posts to a running server."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def post(self, path, body, headers):
+        req = urllib.request.Request(self.url + path, data=body, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+# ---------- measurement ----------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def dir_size(*paths):
+    total = 0
+    for path in paths:
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, name))
+                except OSError:
+                    pass
+    return total
+
+
+def run_ingest(transport, uploads, concurrency, drain=None):
+    """
+    Post every upload, then call drain() (waits for background work);
+    returns (elapsed seconds, latencies, status counts).
+    """
+    latencies = [0.0] * len(uploads)
+    statuses = [0] * len(uploads)
+
+    def send(i):
+        path, body, headers, _ = uploads[i]
+        started = time.perf_counter()
+        try:
+            statuses[i] = transport.post(path, body, headers)
+        except OSError:
+            statuses[i] = -1
+        latencies[i] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(len(uploads))))
+    if drain is not None:
+        drain()
+    elapsed = time.perf_counter() - started
+
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    return elapsed, latencies, counts
+
+
+# ---------- SQLite stand-in for MySQL ----------
+
+# MySQL schema reduced to the columns db_handler reads
+SHIM_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER PRIMARY KEY, name TEXT, email TEXT, role TEXT, created_at DATETIME
+);
+CREATE TABLE device (
+    id INTEGER PRIMARY KEY, name TEXT, serial TEXT, category TEXT, status TEXT,
+    condition TEXT, location TEXT, created_at DATETIME
+);
+CREATE TABLE assignment (
+    id INTEGER PRIMARY KEY, user_id INTEGER, device_id INTEGER, status TEXT,
+    assigned_at DATETIME, purpose TEXT, requested_at DATETIME
+);
+CREATE TABLE audit_log (
+    id INTEGER PRIMARY KEY, user_id INTEGER, action TEXT, timestamp DATETIME
+);
+CREATE TABLE user_activity_summary (
+    user_id INTEGER PRIMARY KEY, device_count INTEGER NOT NULL DEFAULT 0, last_activity DATETIME
+);
+CREATE TABLE device_count_summary (
+    dimension TEXT NOT NULL, value TEXT NOT NULL, count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, value)
+);
+CREATE INDEX idx_user_name_id ON user (name, id);
+CREATE INDEX idx_user_created_at_id ON user (created_at, id);
+CREATE INDEX idx_user_role_name_id ON user (role, name, id);
+CREATE INDEX idx_assignment_user_status ON assignment (user_id, status, device_id);
+CREATE INDEX idx_audit_log_user_timestamp ON audit_log (user_id, timestamp);
+CREATE INDEX idx_summary_device_count ON user_activity_summary (device_count);
+CREATE INDEX idx_summary_last_activity ON user_activity_summary (last_activity);
+"""
+
+# migrations/002_summary_tables.sql backfill, in SQLite syntax
+SHIM_BACKFILL = """
+INSERT OR REPLACE INTO user_activity_summary (user_id, device_count, last_activity)
+SELECT
+    u.id,
+    (SELECT COUNT(DISTINCT a.device_id) FROM assignment a
+     WHERE a.user_id = u.id AND a.status = 'approved'),
+    (SELECT MAX(al.timestamp) FROM audit_log al WHERE al.user_id = u.id)
+FROM user u;
+DELETE FROM device_count_summary;
+INSERT INTO device_count_summary (dimension, value, count)
+SELECT 'category', COALESCE(category, ''), COUNT(*) FROM device GROUP BY category;
+INSERT INTO device_count_summary (dimension, value, count)
+SELECT 'status', COALESCE(status, ''), COUNT(*) FROM device GROUP BY status;
+"""
+
+PLACEHOLDER_RE = re.compile(r"%s")
+
+sqlite3.register_converter(
+    "DATETIME", lambda value: datetime.fromisoformat(value.decode("utf-8"))
+)
+
+
+class ShimCursor:
+    """mysql.connector cursor API over sqlite3 (%s placeholders, dictionary rows)."""
+
+    def __init__(self, conn, dictionary=False):
+        self._cursor = conn.cursor()
+        self._dictionary = dictionary
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {d[0]: value for d, value in zip(self._cursor.description, row)}
+
+    def execute(self, query, params=()):
+        from db_handler import Error
+        try:
+            self._cursor.execute(PLACEHOLDER_RE.sub("?", query), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise Error(msg=f"{e} (SQLite stand-in)")
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class ShimConnection:
+    """The parts of a mysql.connector connection that db_handler and its pool use."""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(
+            path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+        )
+
+    def cursor(self, dictionary=False, **kwargs):
+        return ShimCursor(self._conn, dictionary=dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def ping(self, reconnect=False, **kwargs):
+        pass
+
+    def reconnect(self, **kwargs):
+        pass
+
+    def start_transaction(self):
+        pass
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def install_db_shim(fleet, path="bench_mysql.db"):
+    """
+    Seed a SQLite database with one user and one approved device per
+    synthetic device and point db_handler's connection pool at it.
+    """
+    import db_handler
+
+    now = datetime.now().replace(microsecond=0)
+    rng = random.Random(2)
+    conn = sqlite3.connect(path)
+    conn.executescript(SHIM_SCHEMA)
+    conn.executemany(
+        "INSERT INTO user VALUES (?, ?, ?, ?, ?)",
+        [
+            (d.index + 1, d.username, f"{d.username}@example.com",
+             "admin" if d.index % 50 == 0 else "user",
+             (now - timedelta(days=d.index % 365)).isoformat(" "))
+            for d in fleet
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO device VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (d.index + 1, f"{d.manufacturer} {d.model}", d.serial,
+             rng.choice(["laptop", "desktop"]), rng.choice(["assigned", "available", "repair"]),
+             "good", "HQ", (now - timedelta(days=400)).isoformat(" "))
+            for d in fleet
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO assignment VALUES (?, ?, ?, 'approved', ?, 'work', ?)",
+        [
+            (d.index + 1, d.index + 1, d.index + 1,
+             (now - timedelta(days=30)).isoformat(" "), (now - timedelta(days=31)).isoformat(" "))
+            for d in fleet
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO audit_log (user_id, action, timestamp) VALUES (?, 'login', ?)",
+        [
+            (d.index + 1, (now - timedelta(minutes=rng.randrange(60 * 24 * 30))).isoformat(" "))
+            for d in fleet for _ in range(3)
+        ],
+    )
+    conn.executescript(SHIM_BACKFILL)
+    conn.commit()
+    conn.close()
+
+    class ShimConnectionPool(db_handler.ConnectionPool):
+        def _create(self):
+            self._count("created")
+            return ShimConnection(path)
+
+    db_handler._pool = ShimConnectionPool(db_handler.DB_CONFIG)
+
+
+def time_db_queries(fleet, repeat):
+    """Median / p95 milliseconds of the uncached dashboard queries."""
+    import db_handler
+
+    rng = random.Random(3)
+    queries = [
+        ("get_users_page", lambda: db_handler.get_users_page.uncached()),
+        ("get_users_page(role, has_devices)", lambda: db_handler.get_users_page.uncached(
+            role="user", has_devices=True, sort="created_at", order="desc")),
+        ("get_user_count", lambda: db_handler.get_user_count.uncached()),
+        ("get_all_users_db", lambda: db_handler.get_all_users_db.uncached()),
+        ("get_user_overview", lambda: db_handler.get_user_overview.uncached(
+            rng.randrange(len(fleet)) + 1)),
+        ("get_usage_analytics", lambda: db_handler.get_usage_analytics.uncached()),
+    ]
+    results = []
+    for name, fn in queries:
+        fn()  # warm up the pool and the page cache
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        results.append((name, percentile(samples, 50), percentile(samples, 95)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--records", type=int, default=20, help="boots (log blocks) per device")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--endpoint", choices=["admin", "delta"], default="admin")
+    parser.add_argument("--url", help="post to a running server instead of the test client")
+    parser.add_argument("--data-dir",
+                        help="working directory of the --url server, to report storage growth")
+    parser.add_argument("--db-repeat", type=int, default=50, help="timed calls per db query")
+    parser.add_argument("--no-db", action="store_true", help="skip the db_handler queries")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's log output")
+    args = parser.parse_args()
+
+    fleet, uploads = make_uploads(args.devices, args.records, args.endpoint)
+    payload_bytes = sum(len(body) for _, body, _, _ in uploads)
+    blocks = sum(n for _, _, _, n in uploads)
+
+    if args.url:
+        transport = HttpTransport(args.url)
+        data_dir = args.data_dir
+    else:
+        if not args.verbose:
+            # Sampled per-upload log lines are noise here; keep warnings
+            os.environ.setdefault("RT_LOG_LEVEL", "WARNING")
+        from server2 import app
+        transport = TestClientTransport(app)
+        data_dir = os.getcwd()
+    storage = [os.path.join(data_dir, "processed_data"), os.path.join(data_dir, "user_logs")] \
+        if data_dir else []
+    size_before = dir_size(*storage)
+
+    drain = None
+    if not args.url:
+        from ingest_queue import close_ingest_queue
+        from file_writer import get_file_writer
+
+        def drain():
+            # Count queued (RT_INGEST_MODE=async) and write-behind work in the total
+            close_ingest_queue()
+            get_file_writer().flush()
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        elapsed, latencies, statuses = run_ingest(transport, uploads, args.concurrency, drain)
+    latencies.sort()
+
+    print(f"{len(uploads)} uploads to /{'admin/delta' if args.endpoint == 'delta' else 'admin'} "
+          f"({args.devices} devices x {args.records} boots, {payload_bytes / 1024 / 1024:.1f} MiB, "
+          f"concurrency {args.concurrency}, {'HTTP ' + args.url if args.url else 'test client'})")
+    print(f"  statuses:    {', '.join(f'{k}: {v}' for k, v in sorted(statuses.items()))}")
+    print(f"  throughput:  {len(uploads) / elapsed:10.1f} uploads/s  "
+          f"{blocks / elapsed:10.1f} blocks parsed/s  "
+          f"{args.devices * args.records / elapsed:10.1f} new records/s")
+    print(f"  latency:     p50 {percentile(latencies, 50) * 1000:8.2f} ms  "
+          f"p95 {percentile(latencies, 95) * 1000:8.2f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:8.2f} ms  "
+          f"max {latencies[-1] * 1000:8.2f} ms")
+    if storage:
+        growth = dir_size(*storage) - size_before
+        print(f"  storage:     +{growth / 1024 / 1024:.2f} MiB in processed_data/ and user_logs/ "
+              f"({growth / (args.devices * args.records):.0f} bytes per record)")
+    else:
+        print("  storage:     not measured (pass --data-dir with --url)")
+
+    if args.no_db:
+        return
+    install_db_shim(fleet)
+    print(f"db_handler queries, SQLite stand-in for MySQL ({args.devices} users), "
+          f"{args.db_repeat} uncached calls each:")
+    for name, p50, p95 in time_db_queries(fleet, args.db_repeat):
+        print(f"  {name:<36} p50 {p50:8.2f} ms  p95 {p95:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark JSON encode/decode of fleet payloads.
+
+Usage:
+    python benchmarks/bench_json.py [--devices 1000 10000 100000] [--repeat 3]
+
+For each fleet size, times encoding and decoding the whole fleet as one
+document ({user_id: store document}, as served by the analytics API and
+kept in analytics.json) and as one document per device (as written to
+the WAL and the per-user files). Compares the stdlib with the pre-change
+indent=2 files, the compact stdlib encoding and orjson when installed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from serializer import orjson  # noqa: E402
+from bench_fleet import make_records  # noqa: E402
+
+CODECS = {
+    "json indent=2": (lambda v: json.dumps(v, indent=2).encode("utf-8"), json.loads),
+    "json compact": (lambda v: json.dumps(v, separators=(",", ":")).encode("utf-8"), json.loads),
+}
+if orjson is not None:
+    CODECS["orjson"] = (orjson.dumps, orjson.loads)
+
+
+def best_ms(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'':>8} {'codec':<14} {'fleet encode':>13} {'decode':>9} {'size':>9}   "
+          f"{'per-device encode':>18} {'decode':>9}")
+    for devices in args.devices:
+        documents = {r.user_id: r.to_document() for r in make_records(devices)}
+        for name, (encode, decode) in CODECS.items():
+            body = encode(documents)
+            lines = [encode(doc) for doc in documents.values()]
+            print(
+                f"{devices:>8} {name:<14} "
+                f"{best_ms(lambda: encode(documents), args.repeat):10.1f} ms "
+                f"{best_ms(lambda: decode(body), args.repeat):6.1f} ms "
+                f"{len(body) / 1e6:6.1f} MB   "
+                f"{best_ms(lambda: [encode(d) for d in documents.values()], args.repeat):15.1f} ms "
+                f"{best_ms(lambda: [decode(line) for line in lines], args.repeat):6.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
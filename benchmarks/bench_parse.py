@@ -0,0 +1,76 @@
+"""
+Micro-benchmark for the agent log parser.
+
+Usage:
+    python benchmarks/bench_parse.py [--records 1000] [--repeat 5]
+
+Reports the per-record cost of parse_log_data() and of the streaming
+iter_log_records() path over an accumulated multi-boot upload.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# processData creates its storage directories relative to the cwd on import
+os.chdir(tempfile.mkdtemp(prefix="rt_bench_"))
+
+from processData import parse_log_data, iter_log_records  # noqa: E402
+
+BLOCK = """======================================================
+2025-12-05 05:{minute:02d}:{second:02d} - DESKTOP-GO2C520
+======================================================
+Username: user001
+GPS Location: GPS: 10.8406773 , 76.6276741
+Manufacturer: Acer
+Model: Extensa 215-54
+Serial: NXEGJSI00T233047613400
+CPU Name: 11th Gen Intel(R) Core(TM) i3-1115G4 @ 3.00GHz
+CPU Cores: 2
+Max Clock Speed: 2995 MHz
+Total RAM: 15.7844772338867 GB
+Available RAM: 10.7930946350098 MB
+Total Storage C:: 225.28 GB
+Available Storage C: 117.07 GB
+
+"""
+
+
+def make_upload(records):
+    return "".join(
+        BLOCK.format(minute=(i // 60) % 60, second=i % 60) for i in range(records)
+    )
+
+
+def best_per_record(stmt, number, repeat, records_per_call):
+    best = min(timeit.repeat(stmt, number=number, repeat=repeat))
+    return best / (number * records_per_call) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000,
+                        help="blocks in the accumulated upload")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    block = BLOCK.format(minute=0, second=0)
+    upload = make_upload(args.records)
+    chunks = [upload[i:i + 64 * 1024] for i in range(0, len(upload), 64 * 1024)]
+
+    single = best_per_record(lambda: parse_log_data(block), 2000, args.repeat, 1)
+    stream = best_per_record(
+        lambda: sum(1 for _ in iter_log_records(chunks)), 5, args.repeat, args.records
+    )
+
+    print(f"parse_log_data (one block):         {single:8.2f} us/record")
+    print(f"iter_log_records ({args.records} blocks, "
+          f"{len(upload) / 1024:.0f} KiB): {stream:8.2f} us/record")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark restart time and read cost of the in-memory fleet store.
+
+Usage:
+    python benchmarks/bench_restart.py [--devices 50000] [--updates 5]
+                                       [--wal-max-bytes 33554432] [--repeat 3]
+
+Fills a MemoryRecordStore in a temp directory and times a cold start
+(load snapshot + replay WAL) from three states: WAL only, snapshot only,
+and snapshot plus a full WAL of --wal-max-bytes (the most a restart has
+to replay with that RT_FLEET_WAL_MAX_BYTES). Then compares the read
+paths with the SQLite backend holding the same fleet.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("RT_LOG_LEVEL", "WARNING")
+os.chdir(tempfile.mkdtemp(prefix="bench_restart_"))
+
+import store  # noqa: E402
+from device_snapshot import DeviceSnapshot  # noqa: E402
+
+
+def make_snapshot(device, update):
+    return DeviceSnapshot(
+        user_id=f"user{device:06d}",
+        username=f"user{device:06d}",
+        computer_name=f"DESKTOP-{device:06d}",
+        timestamp=f"2025-12-05 05:{update // 60 % 60:02d}:{update % 60:02d}",
+        received_at=f"2025-12-05T05:{update // 60 % 60:02d}:{update % 60:02d}",
+        client_ip="10.0.0.1",
+        gps_location="Not Available",
+        manufacturer="Dell Inc.",
+        model="Latitude 5420",
+        serial=f"SN{device:010d}",
+        cpu_name="11th Gen Intel(R) Core(TM) i5-1145G7 @ 2.60GHz",
+        cpu_cores=4,
+        max_clock_speed=2611,
+        total_ram_gb=15.78,
+        available_ram_mb=4096.0 + update,
+        total_storage_gb=237.0,
+        available_storage_gb=80.5,
+    )
+
+
+def open_memory_store():
+    return store.MemoryRecordStore(wal_max_bytes=float("inf"), snapshot_interval=0)
+
+
+def best(fn, repeat):
+    best_time, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best_time = min(best_time, time.perf_counter() - started)
+    return best_time, result
+
+
+def file_mb(path):
+    return os.path.getsize(path) / 1e6 if os.path.exists(path) else 0.0
+
+
+def report_restart(label, repeat):
+    elapsed, records = best(open_memory_store, repeat)
+    print(
+        f"restart, {label:<26} {elapsed * 1000:8.1f} ms  "
+        f"({records.count()} devices, {records.stats['replayed_wal_records']} WAL records; "
+        f"snapshot {file_mb(store.FLEET_SNAPSHOT_FILE):.1f} MB, WAL {file_mb(store.FLEET_WAL_FILE):.1f} MB)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--devices", type=int, default=50000)
+    parser.add_argument("--updates", type=int, default=5, help="WAL records per device")
+    parser.add_argument("--wal-max-bytes", type=int, default=store.FLEET_WAL_MAX_BYTES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = open_memory_store()
+    started = time.perf_counter()
+    for update in range(args.updates):
+        for device in range(args.devices):
+            records.upsert(f"user{device:06d}", make_snapshot(device, update))
+    elapsed = time.perf_counter() - started
+    print(f"devices: {args.devices}  upserts: {args.devices * args.updates / elapsed:.0f}/s")
+
+    report_restart(f"WAL only (x{args.updates})", args.repeat)
+
+    records.compact()
+    report_restart("snapshot only", args.repeat)
+
+    update = args.updates
+    while records.stats["wal_bytes"] < args.wal_max_bytes:
+        for device in range(args.devices):
+            records.upsert(f"user{device:06d}", make_snapshot(device, update))
+            if records.stats["wal_bytes"] >= args.wal_max_bytes:
+                break
+        update += 1
+    report_restart(f"snapshot + {args.wal_max_bytes / 2**20:.0f} MiB WAL", args.repeat)
+
+    sqlite = store.SQLiteRecordStore()
+    for snapshot in records.iter_snapshots():
+        sqlite.upsert(snapshot.user_id, snapshot)
+    sample = [f"user{device:06d}" for device in range(0, args.devices, max(1, args.devices // 1000))]
+    serials = [f"SN{device:010d}" for device in range(0, args.devices, max(1, args.devices // 1000))]
+    for name, backend in (("memory", records), ("sqlite", sqlite)):
+        all_time, _ = best(backend.all, args.repeat)
+        iter_time, _ = best(lambda: sum(1 for _ in backend.iter_snapshots()), args.repeat)
+        get_time, _ = best(lambda: [backend.get(u) for u in sample], args.repeat)
+        find_time, _ = best(lambda: backend.find_many_by_serial(serials), args.repeat)
+        print(
+            f"{name:<7} all() {all_time * 1000:8.1f} ms  iter_snapshots {iter_time * 1000:8.1f} ms  "
+            f"get {get_time / len(sample) * 1e6:6.1f} us  "
+            f"find_many_by_serial({len(serials)}) {find_time * 1000:6.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
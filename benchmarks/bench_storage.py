@@ -0,0 +1,164 @@
+"""
+Concurrency stress test for the analytics record store.
+
+Usage:
+    python benchmarks/bench_storage.py [--writers 8] [--updates 100]
+                                       [--backend memory json sqlite unlocked-json]
+
+Starts N writer processes that each upsert their own devices into one
+store while a reader process keeps loading it, then checks that every
+device's final record is present (no lost updates) and that the reader
+never saw a partially written document. `unlocked-json` replays the old
+unlocked read-modify-write of analytics.json for comparison. The
+memory backend runs with a small RT_FLEET_WAL_MAX_BYTES so that writers
+compact the shared WAL into snapshots while the others keep appending.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Compact every 64 KiB of WAL, and let each process see the others' writes
+os.environ.setdefault("RT_FLEET_WAL_MAX_BYTES", "65536")
+os.environ.setdefault("RT_SERVER_WORKERS", "2")
+os.environ.setdefault("RT_LOG_LEVEL", "WARNING")
+
+
+def make_record(writer, device, update):
+    return {
+        "username": f"w{writer}-d{device}",
+        "computer_name": f"DESKTOP-{writer:03d}{device:04d}",
+        "last_updated": f"2025-12-05T05:{update // 60 % 60:02d}:{update % 60:02d}",
+        "hardware": {"serial": f"SN{writer:03d}{device:04d}"},
+        "timestamp": update,
+    }
+
+
+def open_store(backend):
+    import store
+
+    if backend == "unlocked-json":
+        class UnlockedJsonStore(store.JsonRecordStore):
+            """The pre-locking JsonRecordStore: read, modify, rewrite in place."""
+
+            def _load(self, locked=False):
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        return json.load(f)
+                return {}
+
+            def upsert(self, user_id, record):
+                analytics = self._load()
+                analytics[user_id] = record
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(analytics, f, indent=2)
+
+        return UnlockedJsonStore()
+    return store.BACKENDS[backend]()
+
+
+def writer(workdir, backend, index, devices, updates, start):
+    os.chdir(workdir)
+    records = open_store(backend)
+    start.wait()
+    for update in range(updates):
+        device = update % devices
+        try:
+            records.upsert(f"w{index}-d{device}", make_record(index, device, update))
+        except ValueError:
+            # Only the unlocked store gets here: it read a torn analytics.json
+            # (the ingest request would have failed with a 500)
+            pass
+
+
+def reader(workdir, backend, stop, errors):
+    os.chdir(workdir)
+    path = os.path.join("processed_data", "analytics.json")
+    records = open_store(backend)
+    while not stop.is_set():
+        if backend in ("memory", "sqlite"):
+            records.count()
+            continue
+        # Read the file directly, as dashboards that bypass the store do
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            errors.value += 1
+
+
+def run(backend, writers, devices, updates):
+    workdir = tempfile.mkdtemp(prefix=f"bench_storage_{backend}_")
+    os.makedirs(os.path.join(workdir, "processed_data"))
+    ctx = mp.get_context("fork" if hasattr(os, "fork") else "spawn")
+    start, stop = ctx.Event(), ctx.Event()
+    errors = ctx.Value("i", 0)
+
+    procs = [
+        ctx.Process(target=writer, args=(workdir, backend, i, devices, updates, start))
+        for i in range(writers)
+    ]
+    watcher = ctx.Process(target=reader, args=(workdir, backend, stop, errors))
+    for p in procs:
+        p.start()
+    watcher.start()
+
+    started = time.perf_counter()
+    start.set()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    watcher.join()
+
+    os.chdir(workdir)
+    try:
+        final = dict(open_store(backend).iter_records())
+    except ValueError:
+        final = {}
+    expected = {}
+    for i in range(writers):
+        for update in range(updates):
+            device = update % devices
+            expected[f"w{i}-d{device}"] = update
+    lost = sum(
+        1 for user_id, update in expected.items()
+        if (final.get(user_id) or {}).get("timestamp") != update
+    )
+
+    total = writers * updates
+    print(
+        f"{backend:<14} {writers} writers x {updates} upserts: "
+        f"{total / elapsed:10.0f} upserts/s  "
+        f"lost {lost}/{len(expected)} devices  torn reads {errors.value}"
+    )
+    return lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--devices", type=int, default=20, help="devices per writer")
+    parser.add_argument("--updates", type=int, default=100, help="upserts per writer")
+    parser.add_argument("--backend", nargs="+", default=["memory", "json", "sqlite", "unlocked-json"])
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    failed = False
+    for backend in args.backend:
+        lost = run(backend, args.writers, args.devices, args.updates)
+        os.chdir(cwd)
+        failed = failed or (lost and backend != "unlocked-json")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import time
+import hashlib
+import threading
+import functools
+
+import serializer
+from locking import SHARED_PROCESSES, file_stamp
+from logs import get_logger
+from storage import DATA_DIR
+
+# Seconds a cached dashboard result stays fresh
+CACHE_TTL = float(os.environ.get("RT_CACHE_TTL", "30"))
+
+# Entries kept per cached function (oldest dropped first)
+CACHE_MAX_ENTRIES = 256
+
+# Bumped by invalidate_all(); entries filled under an older generation are stale
+_generation = 0
+_generation_lock = threading.Lock()
+
+# Touched by invalidate_all() so that other server processes see the invalidation
+GENERATION_FILE = os.path.join(DATA_DIR, "cache_generation")
+
+# Set by skip_caching() while a cached function computes its value
+_uncacheable = threading.local()
+
+log = get_logger("cache")
+
+
+def _current_generation():
+    if SHARED_PROCESSES:
+        return _generation, file_stamp(GENERATION_FILE)
+    return _generation
+
+
+def invalidate_all():
+    """Mark every ttl_cache entry stale (called when new telemetry is ingested)."""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+    if SHARED_PROCESSES:
+        try:
+            with open(GENERATION_FILE, "a"):
+                os.utime(GENERATION_FILE, None)
+        except OSError as e:
+            log.error("Error touching %s, other processes keep serving cached results: %s", GENERATION_FILE, e)
+
+
+def skip_caching():
+    """
+    Keep the ttl_cache call being computed on this thread (and any cached
+    call that includes it) from storing its result, e.g. the fallback a
+    query returns after a database error.
+    """
+    _uncacheable.flag = True
+
+
+def make_etag(value):
+    """Stable content hash of a JSON-serializable value."""
+    body = serializer.dumps_bytes(value, sort_keys=True, default=str)
+    return hashlib.sha1(body).hexdigest()
+
+
+def ttl_cache(ttl=None):
+    """
+    Cache a function's result per argument set for `ttl` seconds
+    (CACHE_TTL by default) or until invalidate_all() is called.
+
+    The wrapped function gains:
+      .cached(*args, **kwargs) -> (value, etag)   value plus a content ETag
+      .cached_body(encode, *args, **kwargs) -> (body, etag)
+                                        encode(value), serialized once per
+                                        entry (pass the same encode each time)
+      .invalidate()                     drop this function's entries
+    Concurrent misses for the same arguments compute the value once;
+    misses for different arguments compute in parallel.
+    """
+    def decorator(fn):
+        # key -> [expires, generation, value, etag, body or None]
+        entries = {}
+        # key -> lock held while that key's value is computed
+        key_locks = {}
+        lock = threading.Lock()
+
+        def lookup(key):
+            entry = entries.get(key)
+            if entry is not None:
+                if entry[1] == _current_generation() and time.monotonic() < entry[0]:
+                    return entry
+            return None
+
+        def entry_for(args, kwargs, encode=None):
+            key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            hit = lookup(key)
+            if hit is not None:
+                return hit
+            with lock:
+                key_lock = key_locks.get(key)
+                if key_lock is None:
+                    key_lock = key_locks[key] = threading.Lock()
+            with key_lock:
+                hit = lookup(key)
+                if hit is not None:
+                    return hit
+                generation = _current_generation()
+                outer = getattr(_uncacheable, "flag", False)
+                _uncacheable.flag = False
+                try:
+                    value = fn(*args, **kwargs)
+                finally:
+                    skip = _uncacheable.flag
+                    _uncacheable.flag = outer or skip
+                if encode is None:
+                    body, etag = None, make_etag(value)
+                else:
+                    # Hash the body we will send instead of serializing twice
+                    body = encode(value)
+                    etag = hashlib.sha1(body).hexdigest()
+                lifetime = CACHE_TTL if ttl is None else ttl
+                entry = [time.monotonic() + lifetime, generation, value, etag, body]
+                with lock:
+                    if not skip:
+                        entries.pop(key, None)
+                        while len(entries) >= CACHE_MAX_ENTRIES:
+                            del entries[next(iter(entries))]
+                        entries[key] = entry
+                    key_locks.pop(key, None)
+                return entry
+
+        def cached(*args, **kwargs):
+            entry = entry_for(args, kwargs)
+            return entry[2], entry[3]
+
+        def cached_body(encode, *args, **kwargs):
+            entry = entry_for(args, kwargs, encode)
+            if entry[4] is None:
+                entry[4] = encode(entry[2])
+            return entry[4], entry[3]
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return cached(*args, **kwargs)[0]
+
+        def invalidate():
+            with lock:
+                entries.clear()
+
+        wrapper.cached = cached
+        wrapper.cached_body = cached_body
+        wrapper.invalidate = invalidate
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
@@ -2,8 +2,18 @@ import mysql.connector
 from mysql.connector import Error
 import json
 import os
+import base64
+import queue
+import threading
+import time
 from datetime import datetime, timedelta
 
+from store import get_store
+from cache import ttl_cache, invalidate_all, skip_caching
+from fleet import FleetSnapshot
+from alert_engine import get_alert_engine
+from metrics import gauge, histogram, timed
+
 # Database configuration - UPDATE THESE!
 DB_CONFIG = {
     "host": "localhost",
@@ -15,11 +25,192 @@ DB_CONFIG = {
 DATA_DIR = "processed_data"
 
 
+# Connection pool settings
+DB_POOL_SIZE = int(os.environ.get("RT_DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = float(os.environ.get("RT_DB_POOL_TIMEOUT", "5"))
+
+DB_QUERY_SECONDS = histogram(
+    "rt_db_query_seconds", "Duration of db_handler queries (cache misses only).", ("query",)
+)
+DB_CONNECT_SECONDS = histogram(
+    "rt_db_connect_seconds", "Time to open a new MySQL connection."
+)
+DB_CHECKOUT_SECONDS = histogram(
+    "rt_db_checkout_seconds", "Time to check a healthy connection out of the pool."
+)
+
+
+def db_query(fn):
+    """Record each call of a DB-backed function in rt_db_query_seconds."""
+    return timed(DB_QUERY_SECONDS, query=fn.__name__)(fn)
+
+
+class PooledConnection:
+    """
+    Proxy for a pooled MySQL connection: close() hands the connection
+    back to the pool instead of closing the socket.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    """
+    Thread-safe MySQL connection pool.
+
+    Connections are created lazily up to `size`, health-checked (ping with
+    one reconnect attempt) on every checkout, and callers wait up to
+    `timeout` seconds when all of them are in use.
+    """
+
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self.metrics = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+            "created": 0,
+            "reconnects": 0,
+            "discarded": 0,
+            "connect_errors": 0,
+        }
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.metrics[key] += n
+
+    def _create(self):
+        try:
+            with DB_CONNECT_SECONDS.time():
+                conn = mysql.connector.connect(**self.config)
+        except Error:
+            with self._lock:
+                self._open -= 1
+                self.metrics["connect_errors"] += 1
+            raise
+        self._count("created")
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Error:
+            pass
+        try:
+            conn.reconnect(attempts=1, delay=0)
+            self._count("reconnects")
+            return True
+        except Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+        with self._lock:
+            self._open -= 1
+            self.metrics["discarded"] += 1
+
+    def acquire(self):
+        """Check out a healthy connection (raises Error on timeout)."""
+        with DB_CHECKOUT_SECONDS.time():
+            return self._acquire()
+
+    def _acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._open < self.size
+                    if can_create:
+                        self._open += 1
+                if can_create:
+                    conn = self._create()
+                    self._count("checkouts")
+                    return PooledConnection(self, conn)
+
+                self._count("waits")
+                started = time.monotonic()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    self._count("timeouts")
+                    raise Error(msg=f"Timed out after {self.timeout}s waiting for a DB connection")
+                finally:
+                    self._count("wait_seconds", time.monotonic() - started)
+
+            if self._healthy(conn):
+                self._count("checkouts")
+                return PooledConnection(self, conn)
+            self._discard(conn)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats.update({"size": self.size, "open": self._open})
+        stats["idle"] = self._idle.qsize()
+        stats["in_use"] = stats["open"] - stats["idle"]
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_CONFIG)
+    return _pool
+
+
+def get_pool_metrics():
+    return get_pool().stats()
+
+
+gauge("rt_db_pool", "Connection pool state and counters (see ConnectionPool.stats).",
+      ("stat",), callback=get_pool_metrics)
+
+
 def get_db_connection():
+    """Check out a pooled connection; conn.close() returns it to the pool."""
     try:
-        return mysql.connector.connect(**DB_CONFIG)
+        return get_pool().acquire()
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
+        # The caller's fallback result must not be served from the cache
+        skip_caching()
         return None
 
 
@@ -30,6 +221,8 @@ def _format_dt(row: dict, keys):
             row[k] = row[k].strftime("%Y-%m-%d %H:%M:%S")
 
 
+@ttl_cache()
+@db_query
 def get_all_users_db():
     """All users for cards (with device count & last activity)."""
     conn = get_db_connection()
@@ -45,15 +238,11 @@ def get_all_users_db():
                 u.email,
                 u.role,
                 u.created_at,
-                COUNT(DISTINCT a.device_id)     AS device_count,
-                MAX(al.timestamp)               AS last_activity
+                COALESCE(s.device_count, 0)     AS device_count,
+                s.last_activity
             FROM user u
-            LEFT JOIN assignment a
-                ON u.id = a.user_id AND a.status = 'approved'
-            LEFT JOIN audit_log al
-                ON u.id = al.user_id
-            GROUP BY
-                u.id, u.name, u.email, u.role, u.created_at
+            LEFT JOIN user_activity_summary s
+                ON s.user_id = u.id
             ORDER BY u.name
         """
         cursor.execute(query)
@@ -65,11 +254,163 @@ def get_all_users_db():
 
     except Error as e:
         print(f"Error fetching users: {e}")
+        skip_caching()
         return []
     finally:
         conn.close()
 
 
+# Keyset pagination for the users dashboard
+USERS_PAGE_SIZE = 24
+USERS_PAGE_MAX = 200
+USER_SORT_KEYS = {
+    "name": "u.name",
+    "created_at": "u.created_at",
+    "id": "u.id",
+}
+
+
+def encode_cursor(sort_value, user_id):
+    """Opaque keyset cursor for the row after which the next page starts."""
+    raw = json.dumps([sort_value, user_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return sort_value, int(user_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def _keyset_condition(column, order, after_value, after_id):
+    """
+    WHERE condition and params selecting the rows after (after_value,
+    after_id) in ORDER BY column, u.id. MySQL sorts NULLs first ascending
+    and last descending, so rows with a NULL sort value form their own
+    segment, ordered by id alone.
+    """
+    compare = ">" if order == "asc" else "<"
+    null_segment = f"({column} IS NULL AND u.id {compare} %s)"
+    if after_value is None:
+        if order == "asc":
+            return f"({null_segment} OR {column} IS NOT NULL)", [after_id]
+        return null_segment, [after_id]
+
+    condition = f"{column} {compare} %s OR ({column} = %s AND u.id {compare} %s)"
+    params = [after_value, after_value, after_id]
+    if order == "desc":
+        return f"({condition} OR {column} IS NULL)", params
+    return f"({condition})", params
+
+
+@ttl_cache()
+@db_query
+def get_users_page(limit=USERS_PAGE_SIZE, after=None, sort="name", order="asc",
+                   role=None, has_devices=None, active_since=None):
+    """
+    One keyset-paginated page of users for the dashboard cards.
+
+    after: next_cursor of the previous page.
+    Filters: role, has_devices (bool), active_since ('YYYY-MM-DD[ HH:MM:SS]').
+    Sort: one of USER_SORT_KEYS, asc/desc, ties broken by id; rows with
+    no name / created_at come first ascending, last descending. Device count
+    and last activity come from user_activity_summary
+    (see migrations/002_summary_tables.sql).
+
+    Returns {"users": [...], "next_cursor": str|None}.
+    """
+    if sort not in USER_SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort}")
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Unknown sort order: {order}")
+    limit = max(1, min(int(limit), USERS_PAGE_MAX))
+
+    column = USER_SORT_KEYS[sort]
+    direction = "ASC" if order == "asc" else "DESC"
+
+    where, params = [], []
+    if role:
+        where.append("u.role = %s")
+        params.append(role)
+    if has_devices is not None:
+        where.append("COALESCE(s.device_count, 0) " + ("> 0" if has_devices else "= 0"))
+    if active_since:
+        where.append("s.last_activity >= %s")
+        params.append(active_since)
+    if after:
+        condition, condition_params = _keyset_condition(column, order, *decode_cursor(after))
+        where.append(condition)
+        params.extend(condition_params)
+
+    query = f"""
+        SELECT
+            u.id,
+            u.name,
+            u.email,
+            u.role,
+            u.created_at,
+            COALESCE(s.device_count, 0) AS device_count,
+            s.last_activity
+        FROM user u
+        LEFT JOIN user_activity_summary s ON s.user_id = u.id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {column} {direction}, u.id {direction}
+        LIMIT %s
+    """
+    params.append(limit + 1)
+
+    page = {"users": [], "next_cursor": None}
+    conn = get_db_connection()
+    if not conn:
+        return page
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, tuple(params))
+        users = cursor.fetchall()
+
+        for user in users:
+            _format_dt(user, ["created_at", "last_activity"])
+
+        if len(users) > limit:
+            users = users[:limit]
+            last = users[-1]
+            page["next_cursor"] = encode_cursor(last[sort], last["id"])
+        page["users"] = users
+        return page
+
+    except Error as e:
+        print(f"Error fetching users page: {e}")
+        skip_caching()
+        return page
+    finally:
+        conn.close()
+
+
+@ttl_cache()
+@db_query
+def get_user_count():
+    """Total number of users (dashboard stats card)."""
+    conn = get_db_connection()
+    if not conn:
+        return 0
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM user")
+        return cursor.fetchone()[0]
+
+    except Error as e:
+        print(f"Error counting users: {e}")
+        skip_caching()
+        return 0
+    finally:
+        conn.close()
+
+
+@db_query
 def get_user_details(user_id: int):
     conn = get_db_connection()
     if not conn:
@@ -94,6 +435,7 @@ def get_user_details(user_id: int):
         conn.close()
 
 
+@db_query
 def get_user_devices(user_id: int):
     conn = get_db_connection()
     if not conn:
@@ -136,6 +478,96 @@ def get_user_devices(user_id: int):
         conn.close()
 
 
+# Columns of the overview query that belong to the user, not the device
+_OVERVIEW_USER_COLUMNS = ("user_id", "user_name", "email", "role", "user_created_at")
+
+
+@ttl_cache()
+@db_query
+def get_user_overview(user_id: int):
+    """
+    A user, their approved/pending devices and each device's latest
+    telemetry record ("log_data"), for the dashboard detail modal.
+
+    One query fetches the user and devices together; telemetry is read
+    with a single bulk serial lookup against the record store.
+    Returns {"user": dict|None, "devices": [...]}.
+    """
+    overview = {"user": None, "devices": []}
+    conn = get_db_connection()
+    if not conn:
+        return overview
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        query = """
+            SELECT
+                u.id           AS user_id,
+                u.name         AS user_name,
+                u.email,
+                u.role,
+                u.created_at   AS user_created_at,
+                d.id,
+                d.name,
+                d.serial,
+                d.category,
+                d.status,
+                d.condition,
+                d.location,
+                d.created_at,
+                a.status       AS assignment_status,
+                a.assigned_at,
+                a.purpose,
+                a.requested_at
+            FROM user u
+            LEFT JOIN assignment a
+                ON a.user_id = u.id
+               AND a.status IN ('approved', 'pending')
+            LEFT JOIN device d
+                ON d.id = a.device_id
+            WHERE u.id = %s
+            ORDER BY a.assigned_at DESC
+        """
+        cursor.execute(query, (user_id,))
+        rows = cursor.fetchall()
+
+    except Error as e:
+        print(f"Error fetching user overview: {e}")
+        skip_caching()
+        return overview
+    finally:
+        conn.close()
+
+    if not rows:
+        return overview
+
+    first = rows[0]
+    user = {
+        "id": first["user_id"],
+        "name": first["user_name"],
+        "email": first["email"],
+        "role": first["role"],
+        "created_at": first["user_created_at"],
+    }
+    _format_dt(user, ["created_at"])
+
+    devices = []
+    for row in rows:
+        if row["id"] is None:
+            continue
+        device = {k: v for k, v in row.items() if k not in _OVERVIEW_USER_COLUMNS}
+        _format_dt(device, ["created_at", "assigned_at", "requested_at"])
+        devices.append(device)
+
+    telemetry = get_store().find_many_by_serial(d["serial"] for d in devices if d["serial"])
+    for device in devices:
+        device["log_data"] = telemetry.get(device["serial"])
+
+    overview.update(user=user, devices=devices)
+    return overview
+
+
+@db_query
 def get_device_details(device_id: int):
     conn = get_db_connection()
     if not conn:
@@ -161,6 +593,8 @@ def get_device_details(device_id: int):
         conn.close()
 
 
+@ttl_cache()
+@db_query
 def get_usage_analytics():
     """High‑level analytics for charts (DB + logs)."""
     analytics = {
@@ -182,29 +616,22 @@ def get_usage_analytics():
             """
             SELECT
                 u.name,
-                COUNT(a.device_id) AS device_count
-            FROM user u
-            LEFT JOIN assignment a
-                ON u.id = a.user_id AND a.status = 'approved'
-            GROUP BY u.id, u.name
-            HAVING device_count > 0
+                s.device_count
+            FROM user_activity_summary s
+            JOIN user u ON u.id = s.user_id
+            WHERE s.device_count > 0
         """
         )
         analytics["user_device_count"] = cursor.fetchall()
 
-        # Device categories
-        cursor.execute(
-            "SELECT category, COUNT(*) AS count "
-            "FROM device GROUP BY category"
-        )
-        analytics["category_distribution"] = cursor.fetchall()
-
-        # Device status distribution
+        # Device categories and status distribution
         cursor.execute(
-            "SELECT status, COUNT(*) AS count "
-            "FROM device GROUP BY status"
+            "SELECT dimension, NULLIF(value, '') AS value, count "
+            "FROM device_count_summary WHERE count > 0"
         )
-        analytics["status_distribution"] = cursor.fetchall()
+        for row in cursor.fetchall():
+            key = "category_distribution" if row["dimension"] == "category" else "status_distribution"
+            analytics[key].append({row["dimension"]: row["value"], "count": row["count"]})
 
         # Resource usage from logs
         analytics["resource_usage"] = get_resource_usage_from_logs()
@@ -213,128 +640,207 @@ def get_usage_analytics():
 
     except Error as e:
         print(f"Error fetching analytics: {e}")
+        skip_caching()
         return analytics
     finally:
         conn.close()
 
 
-def get_resource_usage_from_logs():
-    """Read processed_data/analytics.json and compute usage %."""
-    usage_data = []
-    analytics_file = os.path.join(DATA_DIR, "analytics.json")
+@ttl_cache()
+def get_fleet_snapshot():
+    """Columnar snapshot of every device's latest record (shared by analytics and alerts)."""
+    return FleetSnapshot(get_store().iter_snapshots())
 
-    if not os.path.exists(analytics_file):
-        return usage_data
 
-    with open(analytics_file, "r", encoding="utf-8") as f:
-        all_data = json.load(f)
+@ttl_cache()
+def get_resource_usage_from_logs():
+    """Usage % for every device in the analytics store."""
+    return get_fleet_snapshot().usage_rows()
 
-    for user_id, data in all_data.items():
-        memory = data.get("memory", {})
-        storage = data.get("storage", {})
 
-        total_ram = memory.get("total_ram_gb", 0) or 0
-        available_ram = memory.get("available_ram_mb", 0) or 0
-        total_storage = storage.get("total_gb", 0) or 0
-        available_storage = storage.get("available_gb", 0) or 0
+@ttl_cache()
+def get_resource_alerts():
+    """Active over/under‑usage alerts, maintained at ingest time by the alert engine."""
+    return get_alert_engine().active_alerts()
+
+
+# ---------- summary tables (migrations/002_summary_tables.sql) ----------
+
+_USER_SUMMARY_SELECT = """
+    SELECT
+        u.id,
+        (SELECT COUNT(DISTINCT a.device_id) FROM assignment a
+         WHERE a.user_id = u.id AND a.status = 'approved') AS device_count,
+        (SELECT MAX(al.timestamp) FROM audit_log al
+         WHERE al.user_id = u.id)                          AS last_activity
+    FROM user u
+"""
+
+
+@db_query
+def refresh_user_summary(user_ids=None):
+    """
+    Recompute user_activity_summary rows from assignment and audit_log.
+    Only the given users are touched; None refreshes every user.
+    Returns the number of users refreshed.
+    """
+    query = _USER_SUMMARY_SELECT
+    params = ()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return 0
+        query += " WHERE u.id IN (" + ", ".join(["%s"] * len(user_ids)) + ")"
+        params = tuple(user_ids)
 
-        ram_used_pct = (
-            (total_ram * 1024 - available_ram) / (total_ram * 1024) * 100
-            if total_ram > 0
-            else 0
-        )
-        storage_used_pct = (
-            (total_storage - available_storage) / total_storage * 100
-            if total_storage > 0
-            else 0
-        )
+    conn = get_db_connection()
+    if not conn:
+        return 0
 
-        usage_data.append(
-            {
-                "user_id": user_id,
-                "username": data.get("username", user_id),
-                "computer_name": data.get("computer_name", "Unknown"),
-                "ram_total_gb": round(total_ram, 2),
-                "ram_used_pct": round(ram_used_pct, 1),
-                "storage_total_gb": round(total_storage, 2),
-                "storage_used_pct": round(storage_used_pct, 1),
-                "last_updated": data.get("last_updated", ""),
-            }
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO user_activity_summary (user_id, device_count, last_activity) "
+            + query
+            + " ON DUPLICATE KEY UPDATE"
+            " device_count = VALUES(device_count),"
+            " last_activity = VALUES(last_activity)",
+            params,
         )
+        conn.commit()
+        return len(user_ids) if user_ids is not None else cursor.rowcount
 
-    return usage_data
+    except Error as e:
+        print(f"Error refreshing user summary: {e}")
+        return 0
+    finally:
+        conn.close()
 
 
-def get_resource_alerts():
-    """Generate over/under‑usage alerts from log analytics."""
-    alerts = []
-    usage_data = get_resource_usage_from_logs()
-
-    for data in usage_data:
-        user = data["username"]
-
-        ram_pct = data["ram_used_pct"]
-        if ram_pct > 85:
-            alerts.append(
-                {
-                    "type": "danger",
-                    "category": "RAM",
-                    "user": user,
-                    "message": f"High RAM usage: {ram_pct}%",
-                    "value": ram_pct,
-                    "threshold": 85,
-                    "recommendation": "Consider closing unused applications or upgrading RAM",
-                }
-            )
-        elif ram_pct < 20:
-            alerts.append(
-                {
-                    "type": "warning",
-                    "category": "RAM",
-                    "user": user,
-                    "message": f"Low RAM utilization: {ram_pct}%",
-                    "value": ram_pct,
-                    "threshold": 20,
-                    "recommendation": "Device may be over-provisioned for user needs",
-                }
-            )
+@db_query
+def refresh_device_counts():
+    """Rebuild device_count_summary from the device table."""
+    conn = get_db_connection()
+    if not conn:
+        return False
 
-        storage_pct = data["storage_used_pct"]
-        if storage_pct > 90:
-            alerts.append(
-                {
-                    "type": "danger",
-                    "category": "Storage",
-                    "user": user,
-                    "message": f"Critical storage usage: {storage_pct}%",
-                    "value": storage_pct,
-                    "threshold": 90,
-                    "recommendation": "Immediate cleanup or storage expansion needed",
-                }
+    try:
+        cursor = conn.cursor()
+        conn.start_transaction()
+        cursor.execute("DELETE FROM device_count_summary")
+        for dimension in ("category", "status"):
+            cursor.execute(
+                "INSERT INTO device_count_summary (dimension, value, count) "
+                f"SELECT %s, COALESCE({dimension}, ''), COUNT(*) FROM device GROUP BY {dimension}",
+                (dimension,),
             )
-        elif storage_pct > 75:
-            alerts.append(
-                {
-                    "type": "warning",
-                    "category": "Storage",
-                    "user": user,
-                    "message": f"High storage usage: {storage_pct}%",
-                    "value": storage_pct,
-                    "threshold": 75,
-                    "recommendation": "Plan for storage cleanup soon",
-                }
+        conn.commit()
+        return True
+
+    except Error as e:
+        print(f"Error refreshing device counts: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+@db_query
+def check_summary_consistency(repair=False):
+    """
+    Compare the summary tables with the live aggregates.
+
+    Returns {"users": [user ids whose row is missing or stale],
+             "orphans": [summary user ids with no user row],
+             "device_counts": [{"dimension", "value", "summary", "live"}],
+             "repaired": bool}.
+    With repair=True the drifted rows are recomputed (the dashboard
+    caches are invalidated afterwards).
+    """
+    report = {"users": [], "orphans": [], "device_counts": [], "repaired": False}
+    conn = get_db_connection()
+    if not conn:
+        return report
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            f"""
+            SELECT live.id, live.device_count, live.last_activity,
+                   s.device_count AS summary_device_count,
+                   s.last_activity AS summary_last_activity
+            FROM ({_USER_SUMMARY_SELECT}) live
+            LEFT JOIN user_activity_summary s ON s.user_id = live.id
+            WHERE s.user_id IS NULL
+               OR s.device_count <> live.device_count
+               OR NOT (s.last_activity <=> live.last_activity)
+            """
+        )
+        report["users"] = [row["id"] for row in cursor.fetchall()]
+
+        cursor.execute(
+            "SELECT s.user_id FROM user_activity_summary s "
+            "LEFT JOIN user u ON u.id = s.user_id WHERE u.id IS NULL"
+        )
+        report["orphans"] = [row["user_id"] for row in cursor.fetchall()]
+
+        cursor.execute("SELECT dimension, value, count FROM device_count_summary")
+        summary = {(row["dimension"], row["value"]): row["count"] for row in cursor.fetchall()}
+        live = {}
+        for dimension in ("category", "status"):
+            cursor.execute(
+                f"SELECT COALESCE({dimension}, '') AS value, COUNT(*) AS count "
+                f"FROM device GROUP BY {dimension}"
             )
-        elif storage_pct < 15:
-            alerts.append(
-                {
-                    "type": "info",
-                    "category": "Storage",
-                    "user": user,
-                    "message": f"Low storage utilization: {storage_pct}%",
-                    "value": storage_pct,
-                    "threshold": 15,
-                    "recommendation": "Device storage may be over-provisioned",
-                }
+            for row in cursor.fetchall():
+                live[(dimension, row["value"])] = row["count"]
+        for key in sorted(set(summary) | set(live)):
+            if summary.get(key, 0) != live.get(key, 0):
+                report["device_counts"].append({
+                    "dimension": key[0], "value": key[1],
+                    "summary": summary.get(key, 0), "live": live.get(key, 0),
+                })
+
+        if repair and report["orphans"]:
+            cursor.execute(
+                "DELETE FROM user_activity_summary WHERE user_id IN ("
+                + ", ".join(["%s"] * len(report["orphans"])) + ")",
+                tuple(report["orphans"]),
             )
+            conn.commit()
+
+    except Error as e:
+        print(f"Error checking summary tables: {e}")
+        return report
+    finally:
+        conn.close()
 
-    return alerts
+    if repair and (report["users"] or report["orphans"] or report["device_counts"]):
+        refresh_user_summary(report["users"])
+        if report["device_counts"]:
+            refresh_device_counts()
+        invalidate_all()
+        report["repaired"] = True
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dashboard summary table maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check-summary", help="Compare summary tables with live aggregates")
+    check.add_argument("--repair", action="store_true", help="Recompute drifted rows")
+    commands.add_parser("refresh-summary", help="Recompute every summary row")
+    args = parser.parse_args()
+
+    if args.command == "refresh-summary":
+        print(f"Refreshed {refresh_user_summary()} user rows")
+        print("Device counts refreshed" if refresh_device_counts() else "Device counts not refreshed")
+        invalidate_all()
+    else:
+        report = check_summary_consistency(repair=args.repair)
+        print(json.dumps(report, indent=2, default=str))
+        drifted = report["users"] or report["orphans"] or report["device_counts"]
+        sys.exit(1 if drifted and not report["repaired"] else 0)
@@ -0,0 +1,234 @@
+import re
+from operator import attrgetter
+
+import serializer
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_GPS_RE = re.compile(r"([\d.-]+)\s*,\s*([\d.-]+)")
+
+# Units a value may carry, as (dimension, scale); a number sent in another
+# unit of the field's dimension is converted ("2.6 GHz" -> 2600 MHz)
+UNIT_SCALES = {
+    "kb": ("bytes", 2 ** 10), "mb": ("bytes", 2 ** 20),
+    "gb": ("bytes", 2 ** 30), "tb": ("bytes", 2 ** 40),
+    "mhz": ("hz", 10 ** 6), "ghz": ("hz", 10 ** 9),
+}
+
+
+def to_number(value, kind=float, unit=None):
+    """
+    `value` as a `kind` (int or float) in `unit`: numbers are converted,
+    strings give their first number ("2995 MHz" -> 2995), scaled when
+    followed by another unit of the same dimension; anything else None.
+    """
+    if type(value) is kind:
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return kind(value)
+    if not isinstance(value, str):
+        return None
+    match = _NUMBER_RE.search(value)
+    if not match:
+        return None
+    number = float(match.group())
+    if unit is not None:
+        sent = UNIT_SCALES.get(value[match.end():].strip().lower())
+        wanted = UNIT_SCALES.get(unit.lower())
+        if sent and wanted and sent[0] == wanted[0]:
+            number = number * sent[1] / wanted[1]
+    return round(number) if kind is int else number
+
+
+# ---------- field registry ----------
+# Converters store the value of one agent line: (snapshot, field, text, unit)
+
+def _set_text(parsed, name, value, unit):
+    setattr(parsed, name, value)
+
+def _set_int(parsed, name, value, unit):
+    setattr(parsed, name, to_number(value, int, unit))
+
+def _set_number(parsed, name, value, unit):
+    setattr(parsed, name, to_number(value, float, unit))
+
+def _set_gps(parsed, name, value, unit):
+    setattr(parsed, name, value)
+    match = _GPS_RE.search(value)
+    if match:
+        try:
+            parsed.latitude = float(match.group(1))
+            parsed.longitude = float(match.group(2))
+        except ValueError:
+            pass
+
+# One row per agent field, in match priority order:
+#   (field name, converter, unit, key substrings, document path, CSV column)
+# A log line "Key: value" goes to the first row whose substring occurs in
+# the lower-cased key; rows without substrings are filled by another
+# row's converter. The document path places the field in the nested
+# store/API document. RECORD_FIELDS, NUMBER_FIELDS, FIELD_UNITS,
+# DOCUMENT_LAYOUT and CSV_FIELDS are derived from this table, so a new
+# agent field is declared here only.
+FIELD_REGISTRY = (
+    ("username",             _set_text,   None,  ("username",),           ("username",),                  True),
+    ("gps_location",         _set_gps,    None,  ("gps", "location"),     ("location", "gps"),            False),
+    ("latitude",             _set_number, None,  (),                      ("location", "latitude"),       True),
+    ("longitude",            _set_number, None,  (),                      ("location", "longitude"),      True),
+    ("manufacturer",         _set_text,   None,  ("manufacturer",),       ("hardware", "manufacturer"),   True),
+    ("model",                _set_text,   None,  ("model",),              ("hardware", "model"),          True),
+    ("serial",               _set_text,   None,  ("serial",),             ("hardware", "serial"),         True),
+    ("cpu_name",             _set_text,   None,  ("cpu name",),           ("cpu", "name"),                True),
+    ("cpu_cores",            _set_int,    None,  ("cpu cores", "cores"),  ("cpu", "cores"),               True),
+    ("max_clock_speed",      _set_int,    "MHz", ("clock speed",),        ("cpu", "max_clock_speed"),     True),
+    ("total_ram_gb",         _set_number, "GB",  ("total ram",),          ("memory", "total_ram_gb"),     True),
+    ("available_ram_mb",     _set_number, "MB",  ("available ram",),      ("memory", "available_ram_mb"), True),
+    ("total_storage_gb",     _set_number, "GB",  ("total storage",),      ("storage", "total_gb"),        True),
+    ("available_storage_gb", _set_number, "GB",  ("available storage",),  ("storage", "available_gb"),    True),
+)
+
+_NUMBER_KINDS = {_set_int: int, _set_number: float}
+
+# Fields parsed from one agent log block (header, then registry), in output order
+RECORD_FIELDS = ("timestamp", "computer_name") + tuple(row[0] for row in FIELD_REGISTRY)
+
+# Numeric fields and their type; they hold a number or None, never text
+NUMBER_FIELDS = {row[0]: _NUMBER_KINDS[row[1]] for row in FIELD_REGISTRY if row[1] in _NUMBER_KINDS}
+
+# Unit of each numeric field that has one
+FIELD_UNITS = {row[0]: row[2] for row in FIELD_REGISTRY if row[2]}
+
+# Every field of a DeviceSnapshot: the parsed fields plus ingest metadata
+SNAPSHOT_FIELDS = RECORD_FIELDS + ("client_ip", "received_at", "user_id")
+
+_CSV_LEADING = ("user_id", "username", "computer_name", "timestamp", "received_at", "client_ip")
+
+# Columns of the all-users CSV and the snapshot export
+CSV_FIELDS = _CSV_LEADING + tuple(
+    row[0] for row in FIELD_REGISTRY if row[5] and row[0] not in _CSV_LEADING
+)
+
+
+def _document_layout():
+    layout = [("last_updated", "received_at"), ("timestamp", "timestamp"), ("computer_name", "computer_name")]
+    groups = {}
+    for name, _, _, _, path, _ in FIELD_REGISTRY:
+        if len(path) == 1:
+            layout.append((path[0], name))
+        elif path[0] in groups:
+            groups[path[0]].append((path[1], name))
+        else:
+            groups[path[0]] = [(path[1], name)]
+            layout.append((path[0], groups[path[0]]))
+    layout.append(("client_ip", "client_ip"))
+    return tuple((key, target if isinstance(target, str) else tuple(target)) for key, target in layout)
+
+
+# Nested document kept in the record store and served by the API:
+#   (document key, snapshot field) or (document key, ((sub key, snapshot field), ...))
+DOCUMENT_LAYOUT = _document_layout()
+
+
+def coerce_numbers(snapshot):
+    """Convert the NUMBER_FIELDS of a snapshot read from an older file in place."""
+    for field, kind in NUMBER_FIELDS.items():
+        setattr(snapshot, field, to_number(getattr(snapshot, field), kind, FIELD_UNITS.get(field)))
+    return snapshot
+
+
+# ---------- serializers, generated once from the layouts above ----------
+
+def _compile(name, lines, namespace=None):
+    namespace = dict(namespace or {})
+    exec("\n".join(lines), namespace)
+    return namespace[name]
+
+
+def _init_source():
+    lines = [f"def __init__(self, {', '.join(f'{f}=None' for f in SNAPSHOT_FIELDS)}):"]
+    lines += [f"    self.{f} = {f}" for f in SNAPSHOT_FIELDS]
+    return lines
+
+
+def _as_dict_source():
+    items = ", ".join(f"{f!r}: s.{f}" for f in SNAPSHOT_FIELDS)
+    return ["def as_dict(s):", f"    return {{{items}}}"]
+
+
+def _to_document_source():
+    items = []
+    for key, target in DOCUMENT_LAYOUT:
+        if isinstance(target, str):
+            items.append(f"{key!r}: s.{target}")
+        else:
+            nested = ", ".join(f"{sub!r}: s.{field}" for sub, field in target)
+            items.append(f"{key!r}: {{{nested}}}")
+    return ["def to_document(s):", f"    return {{{', '.join(items)}}}"]
+
+
+def _from_document_source():
+    lines = [
+        "def from_document(cls, doc, user_id=None):",
+        "    s = _new(cls)",
+        "    s.user_id = user_id",
+        "    get = doc.get",
+    ]
+
+    def value(source, key, field):
+        # Documents stored by earlier versions may hold numbers as text
+        if field in NUMBER_FIELDS:
+            unit = FIELD_UNITS.get(field)
+            return f"_number({source}({key!r}), {NUMBER_FIELDS[field].__name__}, {unit!r})"
+        return f"{source}({key!r})"
+
+    for key, target in DOCUMENT_LAYOUT:
+        if isinstance(target, str):
+            lines.append(f"    s.{target} = {value('get', key, target)}")
+        else:
+            lines.append(f"    sub = get({key!r}) or _EMPTY")
+            lines += [f"    s.{field} = {value('sub.get', sub, field)}" for sub, field in target]
+    lines.append("    return s")
+    return lines
+
+
+class DeviceSnapshot:
+    """
+    One device report: the fields parsed from an agent log block plus
+    the ingest metadata. NUMBER_FIELDS hold an int/float in the unit
+    named by the field (max_clock_speed in MHz), or None when the agent
+    sent nothing parsable, so consumers never re-check their type. This is the single record passed between
+    parsing, history, the record store, alerts and the exports.
+
+    Serializers for the flat JSON file, the nested store/API document and
+    the CSV row are generated from the field layouts when this module is
+    imported.
+    """
+
+    __slots__ = SNAPSHOT_FIELDS
+
+    __init__ = _compile("__init__", _init_source())
+
+    as_dict = _compile("as_dict", _as_dict_source())
+    as_dict.__doc__ = "Flat {field: value} dict (the per-user processed_data/<id>.json)."
+
+    to_document = _compile("to_document", _to_document_source())
+    to_document.__doc__ = "Nested document stored by the record store and returned by the API."
+
+    def to_row(self, _get=attrgetter(*CSV_FIELDS)):
+        """Values in CSV_FIELDS order."""
+        return _get(self)
+
+    from_document = classmethod(_compile(
+        "from_document", _from_document_source(),
+        {"_new": object.__new__, "_EMPTY": {}, "_number": to_number},
+    ))
+
+    def to_json(self):
+        return serializer.dumps(self.to_document())
+
+    def __eq__(self, other):
+        if not isinstance(other, DeviceSnapshot):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f"DeviceSnapshot(user_id={self.user_id!r}, timestamp={self.timestamp!r})"
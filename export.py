@@ -0,0 +1,232 @@
+import io
+import csv
+import zlib
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional; parquet/arrow exports are then unavailable
+    pa = None
+
+from store import get_store
+from serializer import dumps_bytes
+from history import (
+    ROLLUP_COLUMNS, SAMPLE_COLUMNS, get_history_store, parse_time,
+)
+from device_snapshot import CSV_FIELDS, NUMBER_FIELDS
+
+# Rows per Arrow record batch / Parquet row group
+ARROW_BATCH_ROWS = 10000
+
+# Flushed to the client (before compression) once this much text is buffered
+TEXT_CHUNK_BYTES = 64 * 1024
+
+TEXT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+ARROW_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+
+def _iter_snapshot(since, until):
+    since_iso = datetime.fromtimestamp(since).isoformat() if since is not None else None
+    until_iso = datetime.fromtimestamp(until).isoformat() if until is not None else None
+    for snapshot in get_store().iter_snapshots(since_iso):
+        if until_iso is not None and (snapshot.received_at or "") >= until_iso:
+            continue
+        yield snapshot.to_row()
+
+
+def _iter_history(since, until):
+    return get_history_store().iter_samples(since, until)
+
+
+def _iter_rollups(since, until):
+    return get_history_store().iter_rollups(since, until)
+
+
+# name -> (columns, {column: "int"|"float"} (others are text), row iterator(since, until))
+DATASETS = {
+    "snapshot": (
+        CSV_FIELDS,
+        {name: kind.__name__ for name, kind in NUMBER_FIELDS.items()},
+        _iter_snapshot,
+    ),
+    "history": (
+        SAMPLE_COLUMNS,
+        dict({name: "float" for name in SAMPLE_COLUMNS[2:]}, ts="int"),
+        _iter_history,
+    ),
+    "rollups": (
+        ROLLUP_COLUMNS,
+        dict({name: "float" for name in ROLLUP_COLUMNS[4:]}, bucket="int", n="int"),
+        _iter_rollups,
+    ),
+}
+
+
+def export_formats():
+    """Formats available in this installation."""
+    return list(TEXT_FORMATS) + (list(ARROW_FORMATS) if pa is not None else [])
+
+
+def plan_export(dataset="snapshot", fmt="ndjson", fields=None, since=None, until=None):
+    """
+    Validate an export request. Returns (columns, row iterator) where rows
+    are tuples projected to `columns`; raises ValueError for bad arguments.
+    since/until: ISO date/time or epoch seconds (snapshot: last_updated,
+    history/rollups: sample time).
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset} (expected one of {', '.join(DATASETS)})")
+    if fmt not in export_formats():
+        if fmt in ARROW_FORMATS:
+            raise ValueError(f"{fmt} export needs pyarrow, which is not installed")
+        raise ValueError(f"Unknown format: {fmt} (expected one of {', '.join(export_formats())})")
+
+    columns, _, iter_rows = DATASETS[dataset]
+    if fields:
+        wanted = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in wanted if f not in columns]
+        if unknown:
+            raise ValueError(f"Unknown field(s) for {dataset}: {', '.join(unknown)}")
+        indices = [columns.index(f) for f in wanted]
+    else:
+        wanted, indices = list(columns), None
+
+    since_epoch = parse_time(since, "since")
+    until_epoch = parse_time(until, "until")
+
+    def rows():
+        for row in iter_rows(since_epoch, until_epoch):
+            yield tuple(row[i] for i in indices) if indices is not None else tuple(row)
+
+    return wanted, rows()
+
+
+# ---------- encoders (all yield bytes) ----------
+
+def iter_ndjson(columns, rows):
+    buffer = []
+    size = 0
+    for row in rows:
+        line = dumps_bytes(dict(zip(columns, row)), default=str) + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= TEXT_CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_csv(columns, rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(["" if v is None else v for v in row])
+        if text.tell() >= TEXT_CHUNK_BYTES:
+            yield text.getvalue().encode("utf-8")
+            text.seek(0)
+            text.truncate()
+    yield text.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks, level=6):
+    """gzip-compress a byte stream incrementally."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file object whose written bytes are drained by the caller."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema(dataset, columns):
+    types = DATASETS[dataset][1]
+    arrow_types = {"int": pa.int64(), "float": pa.float64()}
+    return pa.schema([(c, arrow_types.get(types.get(c), pa.string())) for c in columns])
+
+
+def _arrow_value(kind, value):
+    if value is None or kind is not None:
+        return value
+    return str(value)
+
+
+def iter_arrow(dataset, columns, rows, fmt):
+    """Parquet or Arrow IPC stream, one row group / record batch per ARROW_BATCH_ROWS rows."""
+    schema = _arrow_schema(dataset, columns)
+    types = DATASETS[dataset][1]
+    kinds = [types.get(c) for c in columns]
+    sink = ChunkSink()
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    def write(batch_rows):
+        arrays = [
+            pa.array([_arrow_value(kind, row[i]) for row in batch_rows], type=schema.field(i).type)
+            for i, kind in enumerate(kinds)
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+        if fmt == "parquet":
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+
+    batch_rows = []
+    for row in rows:
+        batch_rows.append(row)
+        if len(batch_rows) >= ARROW_BATCH_ROWS:
+            write(batch_rows)
+            batch_rows = []
+            data = sink.drain()
+            if data:
+                yield data
+    if batch_rows:
+        write(batch_rows)
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(dataset, fmt, columns, rows, compress=False):
+    """Encoded export body as byte chunks (text formats optionally gzipped)."""
+    if fmt in ARROW_FORMATS:
+        return iter_arrow(dataset, columns, rows, fmt)
+    chunks = iter_ndjson(columns, rows) if fmt == "ndjson" else iter_csv(columns, rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def content_type(fmt):
+    return TEXT_FORMATS.get(fmt) or ARROW_FORMATS[fmt]
@@ -0,0 +1,244 @@
+import os
+import re
+import atexit
+import threading
+import time
+
+from logs import get_logger
+from metrics import SIZE_BUCKETS, gauge, histogram
+
+# Coalescing window for per-user file writes (seconds)
+WRITE_WINDOW = float(os.environ.get("RT_WRITE_WINDOW_MS", "200")) / 1000
+
+# "buffered":  coalesce within WRITE_WINDOW, atomic rename, no fsync (default)
+# "fsync":     coalesce within WRITE_WINDOW, fsync files and directories per batch
+# "immediate": no coalescing; every write is fsynced before submit() returns
+DURABILITY = os.environ.get("RT_WRITE_DURABILITY", "buffered")
+DURABILITY_LEVELS = ("buffered", "fsync", "immediate")
+
+# Temp files of atomic_write: .<name>.<pid>.<thread id>.tmp
+TEMP_FILE_RE = re.compile(r"^\..+\.(\d+)\.\d+\.tmp$")
+
+log = get_logger("files")
+
+# Temp files older than this are removed even if their writer's pid is alive (seconds)
+STALE_TEMP_AGE = 3600
+
+FILE_WRITE_SECONDS = histogram(
+    "rt_file_write_seconds", "Duration of atomic file writes, by file extension.", ("kind",)
+)
+FILE_WRITE_BYTES = histogram(
+    "rt_file_write_bytes", "Size of atomically written files, by file extension.", ("kind",),
+    buckets=SIZE_BUCKETS,
+)
+
+
+def _fsync_dir(path):
+    """Persist a rename by fsyncing its directory (no-op where unsupported)."""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, content, fsync=False):
+    """
+    Replace `path` with `content` (str, bytes or an iterable of bytes
+    chunks) via a temp file and os.replace, so readers never see a
+    partially written file.
+    """
+    directory = os.path.dirname(path)
+    tmp_path = os.path.join(
+        directory,
+        f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp",
+    )
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    kind = os.path.splitext(path)[1].lstrip(".") or "none"
+
+    started = time.perf_counter()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            if isinstance(content, bytes):
+                size = f.write(content)
+            else:
+                for chunk in content:
+                    size += f.write(chunk)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    FILE_WRITE_SECONDS.observe(time.perf_counter() - started, kind=kind)
+    FILE_WRITE_BYTES.observe(size, kind=kind)
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name != "posix":
+        # os.kill(pid, 0) would terminate the process on Windows; rely on age there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def remove_stale_temp_files(directory, max_age=STALE_TEMP_AGE):
+    """
+    Crash recovery: delete atomic_write temp files left in `directory` by
+    a process that died mid-write. The target files themselves are always
+    either the old or the new version. Returns the number removed.
+    """
+    removed = 0
+    now = time.time()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        match = TEMP_FILE_RE.match(name)
+        if not match:
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if _pid_alive(int(match.group(1))) and now - os.path.getmtime(path) < max_age:
+                continue
+            os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    if removed:
+        log.info("Removed %d stale temp file(s) from %s", removed, directory)
+    return removed
+
+
+class WriteBehind:
+    """
+    Group-commit writer for small per-device files.
+
+    submit() records the latest content for a path; a background thread
+    flushes everything pending once per window, so a device that reports
+    several times in a window costs a single write. Content may be a
+    callable, in which case it is only rendered if it is actually flushed.
+    """
+
+    def __init__(self, window=WRITE_WINDOW, durability=DURABILITY):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown write durability: {durability}")
+        self.window = window
+        self.durability = durability
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.stats = {"submitted": 0, "written": 0, "coalesced": 0, "batches": 0}
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="file-writer", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def submit(self, path, content):
+        if self.durability == "immediate":
+            self._write(path, content, fsync=True)
+            _fsync_dir(os.path.dirname(path))
+            with self._lock:
+                self.stats["submitted"] += 1
+                self.stats["written"] += 1
+            return
+
+        self._ensure_started()
+        with self._lock:
+            if path in self._pending:
+                self.stats["coalesced"] += 1
+            self._pending[path] = content
+            self.stats["submitted"] += 1
+        self._wakeup.set()
+
+    def _write(self, path, content, fsync):
+        if callable(content):
+            content = content()
+        atomic_write(path, content, fsync=fsync)
+
+    def flush(self):
+        """Write everything pending now; returns the number of files written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            fsync = self.durability == "fsync"
+            directories = set()
+            written = 0
+            for path, content in batch.items():
+                try:
+                    self._write(path, content, fsync)
+                    directories.add(os.path.dirname(path))
+                    written += 1
+                except Exception as e:
+                    log.error("Error writing %s: %s", path, e)
+            if fsync:
+                for directory in directories:
+                    _fsync_dir(directory)
+
+            with self._lock:
+                self.stats["written"] += written
+                self.stats["batches"] += 1
+            return written
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # Let further updates for the same files arrive before writing
+            time.sleep(self.window)
+            self._wakeup.clear()
+            self.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_file_writer():
+    """Return the process-wide write-behind writer."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehind()
+    return _writer
+
+
+gauge("rt_file_writer_pending", "Files waiting in the write-behind buffer.",
+      callback=lambda: _writer.pending() if _writer is not None else 0)
+gauge("rt_file_writer", "Write-behind counters (submitted, written, coalesced, batches).",
+      ("stat",), callback=lambda: dict(_writer.stats) if _writer is not None else {})
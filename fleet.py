@@ -0,0 +1,200 @@
+import os
+import json
+import operator
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; fall back to plain Python columns
+    np = None
+
+# Alert rules, evaluated per category in order: a device gets at most one
+# alert per category, from the first rule it matches. Override with a JSON
+# list of the same shape via RT_ALERT_RULES_FILE.
+DEFAULT_ALERT_RULES = [
+    {
+        "category": "RAM", "metric": "ram_used_pct", "op": ">", "threshold": 85,
+        "type": "danger", "message": "High RAM usage: {value}%",
+        "recommendation": "Consider closing unused applications or upgrading RAM",
+    },
+    {
+        "category": "RAM", "metric": "ram_used_pct", "op": "<", "threshold": 20,
+        "type": "warning", "message": "Low RAM utilization: {value}%",
+        "recommendation": "Device may be over-provisioned for user needs",
+    },
+    {
+        "category": "Storage", "metric": "storage_used_pct", "op": ">", "threshold": 90,
+        "type": "danger", "message": "Critical storage usage: {value}%",
+        "recommendation": "Immediate cleanup or storage expansion needed",
+    },
+    {
+        "category": "Storage", "metric": "storage_used_pct", "op": ">", "threshold": 75,
+        "type": "warning", "message": "High storage usage: {value}%",
+        "recommendation": "Plan for storage cleanup soon",
+    },
+    {
+        "category": "Storage", "metric": "storage_used_pct", "op": "<", "threshold": 15,
+        "type": "info", "message": "Low storage utilization: {value}%",
+        "recommendation": "Device storage may be over-provisioned",
+    },
+]
+
+RULE_OPS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+
+def load_alert_rules(path=None):
+    """Alert rules from RT_ALERT_RULES_FILE, or the defaults."""
+    path = path or os.environ.get("RT_ALERT_RULES_FILE")
+    if not path:
+        return DEFAULT_ALERT_RULES
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    for rule in rules:
+        if rule.get("op") not in RULE_OPS:
+            raise ValueError(f"Unsupported alert rule op: {rule.get('op')}")
+    return rules
+
+
+ALERT_RULES = load_alert_rules()
+
+
+def _number(value):
+    return 0.0 if value is None else value
+
+
+def _column(values):
+    """Float column: numpy array when available, array('d') otherwise."""
+    if np is not None:
+        return np.fromiter(values, dtype=np.float64)
+    return array("d", values)
+
+
+def used_pct(total, available, scale=1):
+    """Used percentage of one device resource, 0 when the total is unknown."""
+    total, available = _number(total) * scale, _number(available)
+    return round((total - available) / total * 100, 1) if total > 0 else 0.0
+
+
+def device_metrics(snapshot):
+    """Alert metrics for a single DeviceSnapshot."""
+    return {
+        "ram_used_pct": used_pct(snapshot.total_ram_gb, snapshot.available_ram_mb, 1024),
+        "storage_used_pct": used_pct(snapshot.total_storage_gb, snapshot.available_storage_gb),
+    }
+
+
+def rule_categories(rules):
+    """Alert categories in first-seen rule order."""
+    categories = []
+    for rule in rules:
+        if rule["category"] not in categories:
+            categories.append(rule["category"])
+    return categories
+
+
+def first_matching_rule(rules, category, metrics):
+    """The first rule of `category` that `metrics` triggers, or None."""
+    for rule in rules:
+        if rule["category"] == category and RULE_OPS[rule["op"]](
+            metrics[rule["metric"]], rule["threshold"]
+        ):
+            return rule
+    return None
+
+
+def build_alert(rule, user, value):
+    """Alert dict in the shape served by /api/alerts."""
+    return {
+        "type": rule["type"],
+        "category": rule["category"],
+        "user": user,
+        "message": rule["message"].format(value=value),
+        "value": value,
+        "threshold": rule["threshold"],
+        "recommendation": rule["recommendation"],
+    }
+
+
+class FleetSnapshot:
+    """
+    Column-oriented view of the latest record of every device.
+
+    Built once from the record store's DeviceSnapshots; usage percentages
+    are computed over whole columns instead of per device.
+    """
+
+    def __init__(self, snapshots):
+        user_ids, usernames, computer_names, last_updated = [], [], [], []
+        total_ram, available_ram, total_storage, available_storage = [], [], [], []
+
+        for s in snapshots:
+            user_ids.append(s.user_id)
+            usernames.append(s.username if s.username is not None else s.user_id)
+            computer_names.append(s.computer_name if s.computer_name is not None else "Unknown")
+            last_updated.append(s.received_at or "")
+            total_ram.append(_number(s.total_ram_gb))
+            available_ram.append(_number(s.available_ram_mb))
+            total_storage.append(_number(s.total_storage_gb))
+            available_storage.append(_number(s.available_storage_gb))
+
+        self.user_ids = user_ids
+        self.usernames = usernames
+        self.computer_names = computer_names
+        self.last_updated = last_updated
+        self.total_ram_gb = _column(total_ram)
+        self.available_ram_mb = _column(available_ram)
+        self.total_storage_gb = _column(total_storage)
+        self.available_storage_gb = _column(available_storage)
+
+        self.metrics = {
+            "ram_used_pct": self._used_pct(self.total_ram_gb, self.available_ram_mb, 1024),
+            "storage_used_pct": self._used_pct(self.total_storage_gb, self.available_storage_gb, 1),
+        }
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    @staticmethod
+    def _used_pct(total, available, scale):
+        """(total*scale - available) / (total*scale) * 100, 0 where total <= 0, 1 dp."""
+        if np is not None:
+            capacity = total * scale
+            safe = np.where(capacity > 0, capacity, 1.0)
+            pct = np.where(capacity > 0, (capacity - available) / safe * 100, 0.0)
+            return np.round(pct, 1)
+        return array("d", (
+            round((t * scale - a) / (t * scale) * 100, 1) if t > 0 else 0.0
+            for t, a in zip(total, available)
+        ))
+
+    def usage_rows(self):
+        """Per-device usage dicts (the /api/analytics resource_usage shape)."""
+        ram_pct = self.metrics["ram_used_pct"]
+        storage_pct = self.metrics["storage_used_pct"]
+        if np is not None:
+            ram_total = np.round(self.total_ram_gb, 2).tolist()
+            storage_total = np.round(self.total_storage_gb, 2).tolist()
+            ram_pct = ram_pct.tolist()
+            storage_pct = storage_pct.tolist()
+        else:
+            ram_total = [round(v, 2) for v in self.total_ram_gb]
+            storage_total = [round(v, 2) for v in self.total_storage_gb]
+
+        return [
+            {
+                "user_id": self.user_ids[i],
+                "username": self.usernames[i],
+                "computer_name": self.computer_names[i],
+                "ram_total_gb": ram_total[i],
+                "ram_used_pct": ram_pct[i],
+                "storage_total_gb": storage_total[i],
+                "storage_used_pct": storage_pct[i],
+                "last_updated": self.last_updated[i],
+            }
+            for i in range(len(self))
+        ]
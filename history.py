@@ -0,0 +1,431 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from storage import DATA_DIR, ThreadLocalSQLite
+
+HISTORY_FILE = os.path.join(DATA_DIR, "history.db")
+
+DAY = 24 * 3600
+
+# Retention policy: raw samples -> hourly rollups -> daily rollups -> dropped
+RAW_RETENTION = int(os.environ.get("RT_HISTORY_RAW_DAYS", "7")) * DAY
+HOURLY_RETENTION = int(os.environ.get("RT_HISTORY_HOURLY_DAYS", "90")) * DAY
+DAILY_RETENTION = int(os.environ.get("RT_HISTORY_DAILY_DAYS", "730")) * DAY
+
+# How often ingest triggers a compaction pass (seconds)
+COMPACT_INTERVAL = 3600
+
+RESOLUTIONS = {"hour": 3600, "day": DAY}
+
+# Metrics kept per sample and rolled up as min/avg/max
+METRICS = ("ram_used_pct", "storage_used_pct", "available_ram_mb", "available_storage_gb")
+
+# Column order of iter_samples() / iter_rollups() rows (bulk export)
+SAMPLE_COLUMNS = (
+    "device_id", "ts", "total_ram_gb", "available_ram_mb", "ram_used_pct",
+    "total_storage_gb", "available_storage_gb", "storage_used_pct",
+)
+ROLLUP_COLUMNS = ("device_id", "resolution", "bucket", "n") + tuple(
+    f"{m}_{stat}" for m in METRICS for stat in ("min", "avg", "max")
+)
+
+
+def _to_epoch(value):
+    """Parse an agent timestamp / ISO string / epoch into epoch seconds."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(value.strip()).timestamp())
+    except ValueError:
+        return None
+
+
+def parse_time(value, name):
+    """Epoch seconds of a since/until argument; None when empty, ValueError when unparsable."""
+    if value is None or value == "":
+        return None
+    epoch = _to_epoch(value)
+    if epoch is None:
+        raise ValueError(f"Invalid {name}: {value}")
+    return epoch
+
+
+def _time_range(since, until):
+    since = parse_time(since, "since")
+    until = parse_time(until, "until")
+    return (0 if since is None else since), (2 ** 62 if until is None else until)
+
+
+def _usage_pct(total, available):
+    if total is None or available is None or total <= 0:
+        return None
+    return (total - available) / total * 100
+
+
+def sample_from_record(user_id, parsed_data):
+    """Build a history sample tuple from a parsed DeviceSnapshot (or None)."""
+    ts = _to_epoch(parsed_data.timestamp) or _to_epoch(parsed_data.received_at)
+    if ts is None:
+        return None
+
+    total_ram = parsed_data.total_ram_gb
+    available_ram = parsed_data.available_ram_mb
+    total_storage = parsed_data.total_storage_gb
+    available_storage = parsed_data.available_storage_gb
+
+    ram_total_mb = total_ram * 1024 if total_ram is not None else None
+
+    return (
+        user_id,
+        ts,
+        total_ram,
+        available_ram,
+        _usage_pct(ram_total_mb, available_ram),
+        total_storage,
+        available_storage,
+        _usage_pct(total_storage, available_storage),
+    )
+
+
+class HistoryStore:
+    """
+    Per-device RAM/storage time series in SQLite.
+
+    Recent data is kept as one row per sample; compact() folds samples
+    older than RAW_RETENTION into hourly min/avg/max rollups, hourly rollups
+    older than HOURLY_RETENTION into daily ones, and drops daily rollups
+    older than DAILY_RETENTION.
+
+    rollup_marks holds, per device, the newest sample timestamp folded
+    into rollups, so a sample that arrives after its raw window has passed
+    is rolled up once and ignored when re-sent.
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self._conn = ThreadLocalSQLite(path)
+        self._compact_lock = threading.Lock()
+        self._last_compact = 0
+        self._init_schema()
+
+    def _init_schema(self):
+        rollup_cols = ",\n".join(
+            f"{m}_min REAL, {m}_max REAL, {m}_sum REAL" for m in METRICS
+        )
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS samples (
+                device_id            TEXT    NOT NULL,
+                ts                   INTEGER NOT NULL,
+                total_ram_gb         REAL,
+                available_ram_mb     REAL,
+                ram_used_pct         REAL,
+                total_storage_gb     REAL,
+                available_storage_gb REAL,
+                storage_used_pct     REAL,
+                PRIMARY KEY (device_id, ts)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS rollups (
+                device_id  TEXT    NOT NULL,
+                resolution TEXT    NOT NULL,
+                bucket     INTEGER NOT NULL,
+                n          INTEGER NOT NULL,
+                {rollup_cols},
+                PRIMARY KEY (device_id, resolution, bucket)
+            ) WITHOUT ROWID
+            """
+        )
+        has_marks = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_marks'"
+        ).fetchone()
+        if not has_marks:
+            width = " ".join(f"WHEN '{r}' THEN {w}" for r, w in RESOLUTIONS.items())
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS rollup_marks "
+                    "(device_id TEXT PRIMARY KEY, ts INTEGER NOT NULL) WITHOUT ROWID"
+                )
+                # Databases from before the marks existed: everything up to
+                # the end of each device's newest bucket has been rolled up
+                conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO rollup_marks
+                    SELECT device_id, MAX(bucket + CASE resolution {width} END - 1)
+                    FROM rollups GROUP BY device_id
+                    """
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # ---------- writes ----------
+
+    def record_samples(self, samples, now=None):
+        """
+        Insert sample tuples from sample_from_record().
+        Re-sent samples (same device and timestamp) are ignored. Samples
+        older than the raw retention window go straight into the hourly
+        or daily rollups, unless they are no newer than what the device
+        already has rolled up (they were counted before). Samples older
+        than the daily retention are dropped.
+        """
+        now = int(now or time.time())
+        raw_cutoff, _, daily_cutoff = self._cutoffs(now)
+        rows = [s for s in samples if s is not None and s[1] >= daily_cutoff]
+        if not rows:
+            return 0
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            late = {s[0] for s in rows if s[1] < raw_cutoff}
+            if late:
+                marks = {}
+                for device_id in late:
+                    mark = conn.execute(
+                        "SELECT ts FROM rollup_marks WHERE device_id = ?", (device_id,)
+                    ).fetchone()
+                    marks[device_id] = mark[0] if mark else None
+                rows = [
+                    s for s in rows
+                    if s[1] >= raw_cutoff or marks[s[0]] is None or s[1] > marks[s[0]]
+                ]
+                late = any(s[1] < raw_cutoff for s in rows)
+
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            inserted = conn.total_changes - before
+            if late:
+                # Fold them into the rollups now, as compaction would
+                self._compact(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.maybe_compact(now)
+        return inserted
+
+    def maybe_compact(self, now=None):
+        """Run compact() at most once per COMPACT_INTERVAL."""
+        now = now or time.time()
+        if now - self._last_compact < COMPACT_INTERVAL:
+            return
+        if not self._compact_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_compact = now
+            self.compact(now)
+        finally:
+            self._compact_lock.release()
+
+    def _merge_into(self, conn, resolution, source_sql, params):
+        """Upsert aggregated rows produced by source_sql into rollups."""
+        cols = ", ".join(f"{m}_min, {m}_max, {m}_sum" for m in METRICS)
+        merge = ",\n".join(
+            f"{m}_min = MIN(COALESCE({m}_min, excluded.{m}_min), COALESCE(excluded.{m}_min, {m}_min)), "
+            f"{m}_max = MAX(COALESCE({m}_max, excluded.{m}_max), COALESCE(excluded.{m}_max, {m}_max)), "
+            f"{m}_sum = COALESCE({m}_sum, 0) + COALESCE(excluded.{m}_sum, 0)"
+            for m in METRICS
+        )
+        conn.execute(
+            f"""
+            INSERT INTO rollups (device_id, resolution, bucket, n, {cols})
+            SELECT device_id, '{resolution}', bucket, n, {cols}
+            FROM ({source_sql}) WHERE true
+            ON CONFLICT(device_id, resolution, bucket) DO UPDATE SET
+                n = n + excluded.n,
+                {merge}
+            """,
+            params,
+        )
+
+    @staticmethod
+    def _cutoffs(now):
+        """(raw, hourly, daily) retention cutoffs at `now`, aligned as compact() uses them."""
+        hour, day = RESOLUTIONS["hour"], RESOLUTIONS["day"]
+        return (
+            (now - RAW_RETENTION) // hour * hour,
+            (now - HOURLY_RETENTION) // day * day,
+            now - DAILY_RETENTION,
+        )
+
+    def compact(self, now=None):
+        """Downsample old data and enforce the retention policy."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = self._compact(conn, int(now or time.time()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def _compact(self, conn, now):
+        hour, day = RESOLUTIONS["hour"], RESOLUTIONS["day"]
+        raw_cutoff, hourly_cutoff, daily_cutoff = self._cutoffs(now)
+
+        from_samples = ", ".join(
+            f"MIN({m}) AS {m}_min, MAX({m}) AS {m}_max, SUM({m}) AS {m}_sum" for m in METRICS
+        )
+        from_hourly = ", ".join(
+            f"MIN({m}_min) AS {m}_min, MAX({m}_max) AS {m}_max, SUM({m}_sum) AS {m}_sum"
+            for m in METRICS
+        )
+
+        self._merge_into(
+            conn, "hour",
+            f"SELECT device_id, ts - ts % {hour} AS bucket, COUNT(*) AS n, {from_samples} "
+            "FROM samples WHERE ts < ? GROUP BY device_id, bucket",
+            (raw_cutoff,),
+        )
+        conn.execute(
+            """
+            INSERT INTO rollup_marks (device_id, ts)
+            SELECT device_id, MAX(ts) FROM samples WHERE ts < ? GROUP BY device_id
+            ON CONFLICT(device_id) DO UPDATE SET ts = MAX(ts, excluded.ts)
+            """,
+            (raw_cutoff,),
+        )
+        samples = conn.execute("DELETE FROM samples WHERE ts < ?", (raw_cutoff,)).rowcount
+
+        self._merge_into(
+            conn, "day",
+            f"SELECT device_id, bucket - bucket % {day} AS bucket, SUM(n) AS n, {from_hourly} "
+            "FROM rollups WHERE resolution = 'hour' AND bucket < ? "
+            "GROUP BY device_id, bucket - bucket % " + str(day),
+            (hourly_cutoff,),
+        )
+        hourly = conn.execute(
+            "DELETE FROM rollups WHERE resolution = 'hour' AND bucket < ?",
+            (hourly_cutoff,),
+        ).rowcount
+
+        daily = conn.execute(
+            "DELETE FROM rollups WHERE resolution = 'day' AND bucket < ?",
+            (daily_cutoff,),
+        ).rowcount
+
+        return {"samples_rolled_up": samples, "hourly_rolled_up": hourly, "daily_dropped": daily}
+
+    # ---------- reads ----------
+
+    def iter_samples(self, since=None, until=None):
+        """Raw samples of every device with since <= ts < until, as SAMPLE_COLUMNS tuples."""
+        since, until = _time_range(since, until)
+        yield from self._conn().execute(
+            f"SELECT {', '.join(SAMPLE_COLUMNS)} FROM samples "
+            "WHERE ts >= ? AND ts < ? ORDER BY device_id, ts",
+            (since, until),
+        )
+
+    def iter_rollups(self, since=None, until=None):
+        """Hourly and daily rollups of every device in range, as ROLLUP_COLUMNS tuples."""
+        since, until = _time_range(since, until)
+        stats = ", ".join(f"{m}_min, {m}_sum * 1.0 / n, {m}_max" for m in METRICS)
+        yield from self._conn().execute(
+            f"SELECT device_id, resolution, bucket, n, {stats} FROM rollups "
+            "WHERE bucket >= ? AND bucket < ? ORDER BY device_id, resolution, bucket",
+            (since, until),
+        )
+
+    def get_history(self, device_id, since=None, until=None, resolution="raw"):
+        """
+        Time series for one device, oldest first.
+
+        resolution="raw" returns the retained samples; "hour"/"day" return
+        min/avg/max buckets built from rollups plus any finer data in range.
+        """
+        since, until = _time_range(since, until)
+        conn = self._conn()
+
+        if resolution == "raw":
+            cursor = conn.execute(
+                "SELECT ts, total_ram_gb, available_ram_mb, ram_used_pct, "
+                "total_storage_gb, available_storage_gb, storage_used_pct "
+                "FROM samples WHERE device_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (device_id, since, until),
+            )
+            names = [c[0] for c in cursor.description]
+            return [dict(zip(names, row)) for row in cursor]
+
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+
+        width = RESOLUTIONS[resolution]
+        from_samples = ", ".join(
+            f"MIN({m}) AS {m}_min, MAX({m}) AS {m}_max, SUM({m}) AS {m}_sum" for m in METRICS
+        )
+        from_rollups = ", ".join(
+            f"MIN({m}_min), MAX({m}_max), SUM({m}_sum)" for m in METRICS
+        )
+        outer = ", ".join(
+            f"MIN({m}_min), MAX({m}_max), SUM({m}_sum)" for m in METRICS
+        )
+        rows = conn.execute(
+            f"""
+            SELECT bucket, SUM(n), {outer} FROM (
+                SELECT ts - ts % {width} AS bucket, COUNT(*) AS n, {from_samples}
+                FROM samples WHERE device_id = ? AND ts >= ? AND ts < ?
+                GROUP BY bucket
+                UNION ALL
+                SELECT bucket - bucket % {width}, SUM(n), {from_rollups}
+                FROM rollups WHERE device_id = ? AND bucket >= ? AND bucket < ?
+                  AND resolution IN ({", ".join("?" * len(RESOLUTIONS))})
+                GROUP BY bucket - bucket % {width}
+            ) AS parts
+            GROUP BY bucket ORDER BY bucket
+            """,
+            (device_id, since, until, device_id, since, until, *RESOLUTIONS),
+        ).fetchall()
+
+        points = []
+        for row in rows:
+            bucket, n, values = row[0], row[1], row[2:]
+            point = {"bucket": bucket, "samples": n}
+            for i, m in enumerate(METRICS):
+                lo, hi, total = values[3 * i: 3 * i + 3]
+                point[m] = {
+                    "min": lo,
+                    "avg": round(total / n, 2) if total is not None and n else None,
+                    "max": hi,
+                }
+            points.append(point)
+        return points
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history_store():
+    """Return the process-wide history store."""
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = HistoryStore()
+    return _history
+
+
+if __name__ == "__main__":
+    print(get_history_store().compact())
@@ -0,0 +1,126 @@
+import os
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+from storage import DATA_DIR, ThreadLocalSQLite
+
+LEDGER_FILE = os.path.join(DATA_DIR, "ingest_ledger.db")
+
+# Blocks more than this many days older than their device's high-water
+# mark are pruned from the ledger and treated as already ingested
+LEDGER_WINDOW = timedelta(days=int(os.environ.get("RT_LEDGER_WINDOW_DAYS", "30")))
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def block_key(device, timestamp):
+    """Dedup key of one log block: hash of device identity and header timestamp."""
+    return hashlib.sha1(f"{device}\x00{timestamp}".encode("utf-8")).hexdigest()
+
+
+class IngestLedger:
+    """
+    Every (device, timestamp) log block already ingested through the
+    delta endpoint, so re-sent blocks can be skipped, and the newest
+    timestamp per device (the high-water mark returned to agents).
+    Timestamps are the agent's "YYYY-MM-DD HH:MM:SS" header values,
+    which order correctly as text.
+
+    Only the LEDGER_WINDOW before each device's high-water mark is kept:
+    older blocks are pruned as new ones are marked, and blocks re-sent
+    from before that horizon count as already ingested.
+    """
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self._conn = ThreadLocalSQLite(path)
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blocks (
+                key         TEXT NOT NULL PRIMARY KEY,
+                device      TEXT NOT NULL,
+                ts          TEXT NOT NULL,
+                received_at TEXT
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_blocks_device_ts ON blocks (device, ts)")
+
+    def horizon(self, device):
+        """Oldest timestamp of `device` still tracked in the ledger, or None."""
+        high_water = self.high_water_mark(device)
+        if high_water is None:
+            return None
+        try:
+            return (datetime.strptime(high_water, TIMESTAMP_FORMAT) - LEDGER_WINDOW).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            return None
+
+    def unseen(self, entries):
+        """Keys of the (device, timestamp) entries not ingested yet."""
+        entries = set(entries)
+        horizons = {device: self.horizon(device) for device in {device for device, _ in entries}}
+        keys = {
+            block_key(device, ts) for device, ts in entries
+            if horizons[device] is None or ts >= horizons[device]
+        }
+        if not keys:
+            return set()
+        conn = self._conn()
+        seen = set()
+        batch = list(keys)
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(batch), 500):
+            chunk = batch[start:start + 500]
+            seen.update(row[0] for row in conn.execute(
+                f"SELECT key FROM blocks WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return keys - seen
+
+    def mark(self, entries, received_at=None):
+        """Record (device, timestamp) entries as ingested and prune what fell out of the window."""
+        received_at = received_at or datetime.now().isoformat()
+        rows = [(block_key(device, ts), device, ts, received_at) for device, ts in set(entries)]
+        if not rows:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO blocks VALUES (?, ?, ?, ?)", rows)
+            for device in {row[1] for row in rows}:
+                horizon = self.horizon(device)
+                if horizon is not None:
+                    conn.execute(
+                        "DELETE FROM blocks WHERE device = ? AND ts < ?", (device, horizon)
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def high_water_mark(self, device):
+        """Newest ingested timestamp of `device`, or None."""
+        row = self._conn().execute(
+            "SELECT MAX(ts) FROM blocks WHERE device = ?", (device,)
+        ).fetchone()
+        return row[0] if row else None
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ingest_ledger():
+    """Return the process-wide ingest ledger."""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = IngestLedger()
+    return _ledger
@@ -0,0 +1,163 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from processData import process_log_batch
+from metrics import gauge
+from logs import get_logger
+
+log = get_logger("ingest")
+
+# "sync": /admin parses and persists inside the request (default)
+# "async": /admin validates, enqueues and returns 202; workers persist
+INGEST_MODE = os.environ.get("RT_INGEST_MODE", "sync")
+
+QUEUE_SIZE = int(os.environ.get("RT_INGEST_QUEUE_SIZE", "1000"))
+WORKERS = int(os.environ.get("RT_INGEST_WORKERS", "2"))
+BATCH_SIZE = int(os.environ.get("RT_INGEST_BATCH_SIZE", "50"))
+
+# Largest upload accepted into the queue (bytes)
+MAX_PAYLOAD_BYTES = int(os.environ.get("RT_INGEST_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+class QueueFull(Exception):
+    """Raised by IngestQueue.submit when the queue is at capacity."""
+
+
+class IngestQueue:
+    """
+    Bounded in-memory queue of raw uploads, drained by background
+    worker threads that parse and persist them in batches through
+    processData.process_log_batch.
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.worker_count = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._workers = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        self.stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0, "batches": 0}
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        with self._start_lock:
+            if self._workers:
+                return
+            for i in range(self.worker_count):
+                worker = threading.Thread(
+                    target=self._run, name=f"ingest-worker-{i}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def submit(self, payload, client_ip=None):
+        """Enqueue a raw upload; raises QueueFull instead of blocking."""
+        if self._closed:
+            self._count("rejected")
+            raise QueueFull("Ingest queue is shutting down")
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((payload, client_ip, datetime.now().isoformat()))
+        except queue.Full:
+            self._count("rejected")
+            raise QueueFull(f"Ingest queue is full ({self.maxsize} uploads pending)")
+        self._count("accepted")
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def status(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            "mode": INGEST_MODE,
+            "depth": self.depth(),
+            "capacity": self.maxsize,
+            "workers": self.worker_count,
+        })
+        return stats
+
+    def close(self, timeout=None):
+        """
+        Stop accepting uploads and wait up to `timeout` seconds (forever
+        if None) for everything already queued to be persisted.
+        Returns True when the queue drained completely.
+        """
+        self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = self._queue.all_tasks_done
+        with done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                done.wait(remaining)
+        return True
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = process_log_batch(batch)
+                failed = sum(1 for r in results if r.get("status") != "success")
+                self._count("processed", len(batch) - failed)
+                self._count("failed", failed)
+                self._count("batches")
+            except Exception as e:
+                log.error("❌ Error processing ingest batch: %s", e)
+                self._count("failed", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_ingest_queue = None
+_ingest_queue_lock = threading.Lock()
+
+
+def get_ingest_queue():
+    """Return the process-wide ingest queue."""
+    global _ingest_queue
+    if _ingest_queue is None:
+        with _ingest_queue_lock:
+            if _ingest_queue is None:
+                _ingest_queue = IngestQueue()
+    return _ingest_queue
+
+
+def _queue_status():
+    if _ingest_queue is None:
+        return {"depth": 0}
+    status = _ingest_queue.status()
+    return {k: v for k, v in status.items() if isinstance(v, (int, float))}
+
+
+gauge("rt_ingest_queue", "Async ingest queue depth, capacity and counters (see IngestQueue.status).",
+      ("stat",), callback=_queue_status)
+
+
+def close_ingest_queue(timeout=None):
+    """Drain the process-wide ingest queue if it was ever started."""
+    if _ingest_queue is None:
+        return True
+    return _ingest_queue.close(timeout)
@@ -0,0 +1,60 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; locks are then per process only
+    fcntl = None
+
+# Number of server processes sharing processed_data (set by wsgi.py).
+# Above 1, in-process state that other processes also write is re-read
+# from disk when it changes instead of being trusted as authoritative.
+SERVER_PROCESSES = int(os.environ.get("RT_SERVER_WORKERS", "1"))
+SHARED_PROCESSES = SERVER_PROCESSES > 1
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        lock = _thread_locks.get(path)
+        if lock is None:
+            lock = _thread_locks[path] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    Lock `path` against other threads and processes for the duration of
+    the block, using flock() on a `<path>.lock` sidecar file.
+
+    shared=True takes a read lock that only excludes writers. Without
+    fcntl (Windows) the lock is exclusive and only covers this process.
+    """
+    lock_path = path + ".lock"
+    if fcntl is None:
+        with _thread_lock(lock_path):
+            yield
+        return
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def file_stamp(path):
+    """(mtime_ns, size, inode) of `path`, or None when it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
@@ -0,0 +1,76 @@
+import os
+import sys
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+# DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = os.environ.get("RT_LOG_LEVEL", "INFO").upper()
+
+# Fraction of per-upload messages (see sampled()) that are logged
+LOG_SAMPLE_RATE = float(os.environ.get("RT_LOG_SAMPLE_RATE", "0.01"))
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"
+
+_root = logging.getLogger("rt")
+
+
+_listener = None
+
+
+def _start_listener():
+    """
+    Route the "rt" loggers through a queue drained by a background
+    thread, so request threads never wait on stdout.
+    """
+    global _listener
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+    for old in [h for h in _root.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        _root.removeHandler(old)
+    _root.addHandler(logging.handlers.QueueHandler(records))
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _configure():
+    _start_listener()
+    atexit.register(_stop_listener)
+    _root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    _root.propagate = False
+    # A forked child (e.g. a gunicorn worker forked after the app was
+    # imported) does not inherit the listener thread: start its own
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_start_listener)
+
+
+_configure()
+
+
+def get_logger(name):
+    """Logger under the "rt" hierarchy, e.g. get_logger("ingest")."""
+    return _root.getChild(name)
+
+
+def sampled(logger, level, msg, *args, rate=None):
+    """
+    Log a high-volume message (one per upload or record) for a random
+    `rate` fraction of calls (default LOG_SAMPLE_RATE). With RT_LOG_LEVEL
+    at DEBUG every call is logged.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if not logger.isEnabledFor(logging.DEBUG):
+        rate = LOG_SAMPLE_RATE if rate is None else rate
+        if rate < 1 and random.random() >= rate:
+            return
+    logger.log(level, msg, *args)
@@ -0,0 +1,23 @@
+-- Indexes for the paginated users dashboard (/admin/showUsers, /api/users).
+--
+-- Run once against the device_management database:
+--     mysql -u root -p device_management < migrations/001_dashboard_indexes.sql
+--
+-- db_handler.get_users_page reads one page of `user` rows in keyset order,
+-- so each page costs O(page size) index lookups instead of sorting every
+-- user. device_count / last_activity are joined from user_activity_summary
+-- (migrations/002_summary_tables.sql), whose refresh uses the assignment
+-- and audit_log indexes below.
+
+-- Keyset order for each sort key (sort column, then id as tie-breaker)
+CREATE INDEX idx_user_name_id       ON user (name, id);
+CREATE INDEX idx_user_created_at_id ON user (created_at, id);
+
+-- role filter combined with the default name ordering
+CREATE INDEX idx_user_role_name_id  ON user (role, name, id);
+
+-- Summary refresh of device_count: approved assignments of one user
+CREATE INDEX idx_assignment_user_status ON assignment (user_id, status, device_id);
+
+-- Summary refresh of last_activity: MAX(timestamp) for one user
+CREATE INDEX idx_audit_log_user_timestamp ON audit_log (user_id, timestamp);
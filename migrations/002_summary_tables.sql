@@ -0,0 +1,154 @@
+-- Precomputed dashboard rollups (replaces per-request aggregate joins).
+--
+-- Run once against the device_management database:
+--     mysql -u root -p device_management < migrations/002_summary_tables.sql
+--
+-- user_activity_summary   one row per user: approved device count and the
+--                         latest audit_log timestamp
+-- device_count_summary    device counts per category and per status
+--
+-- The triggers below keep both tables current as assignment, audit_log,
+-- device and user rows change; each trigger touches one summary row using
+-- the indexes from 001_dashboard_indexes.sql. Drift (e.g. bulk loads with
+-- triggers disabled, audit_log purges) is detected and repaired with:
+--     python db_handler.py check-summary --repair
+
+CREATE TABLE IF NOT EXISTS user_activity_summary (
+    user_id       INT      NOT NULL PRIMARY KEY,
+    device_count  INT      NOT NULL DEFAULT 0,
+    last_activity DATETIME NULL,
+    KEY idx_summary_device_count (device_count),
+    KEY idx_summary_last_activity (last_activity)
+);
+
+CREATE TABLE IF NOT EXISTS device_count_summary (
+    dimension VARCHAR(16)  NOT NULL,   -- 'category' or 'status'
+    value     VARCHAR(191) NOT NULL,
+    count     INT          NOT NULL DEFAULT 0,
+    PRIMARY KEY (dimension, value)
+);
+
+-- ---------- initial backfill ----------
+
+INSERT INTO user_activity_summary (user_id, device_count, last_activity)
+SELECT
+    u.id,
+    (SELECT COUNT(DISTINCT a.device_id) FROM assignment a
+     WHERE a.user_id = u.id AND a.status = 'approved'),
+    (SELECT MAX(al.timestamp) FROM audit_log al WHERE al.user_id = u.id)
+FROM user u
+ON DUPLICATE KEY UPDATE
+    device_count  = VALUES(device_count),
+    last_activity = VALUES(last_activity);
+
+DELETE FROM device_count_summary;
+INSERT INTO device_count_summary (dimension, value, count)
+SELECT 'category', COALESCE(category, ''), COUNT(*) FROM device GROUP BY category;
+INSERT INTO device_count_summary (dimension, value, count)
+SELECT 'status', COALESCE(status, ''), COUNT(*) FROM device GROUP BY status;
+
+-- ---------- incremental maintenance ----------
+
+DELIMITER //
+
+DROP TRIGGER IF EXISTS trg_user_summary_insert //
+CREATE TRIGGER trg_user_summary_insert AFTER INSERT ON user
+FOR EACH ROW
+BEGIN
+    INSERT IGNORE INTO user_activity_summary (user_id) VALUES (NEW.id);
+END //
+
+DROP TRIGGER IF EXISTS trg_user_summary_delete //
+CREATE TRIGGER trg_user_summary_delete AFTER DELETE ON user
+FOR EACH ROW
+BEGIN
+    DELETE FROM user_activity_summary WHERE user_id = OLD.id;
+END //
+
+-- Recount one user's approved devices (index range on assignment(user_id, status))
+DROP TRIGGER IF EXISTS trg_assignment_summary_insert //
+CREATE TRIGGER trg_assignment_summary_insert AFTER INSERT ON assignment
+FOR EACH ROW
+BEGIN
+    INSERT INTO user_activity_summary (user_id, device_count)
+    VALUES (NEW.user_id, (SELECT COUNT(DISTINCT device_id) FROM assignment
+                          WHERE user_id = NEW.user_id AND status = 'approved'))
+    ON DUPLICATE KEY UPDATE device_count = VALUES(device_count);
+END //
+
+DROP TRIGGER IF EXISTS trg_assignment_summary_update //
+CREATE TRIGGER trg_assignment_summary_update AFTER UPDATE ON assignment
+FOR EACH ROW
+BEGIN
+    INSERT INTO user_activity_summary (user_id, device_count)
+    VALUES (NEW.user_id, (SELECT COUNT(DISTINCT device_id) FROM assignment
+                          WHERE user_id = NEW.user_id AND status = 'approved'))
+    ON DUPLICATE KEY UPDATE device_count = VALUES(device_count);
+    IF OLD.user_id <> NEW.user_id THEN
+        UPDATE user_activity_summary
+        SET device_count = (SELECT COUNT(DISTINCT device_id) FROM assignment
+                            WHERE user_id = OLD.user_id AND status = 'approved')
+        WHERE user_id = OLD.user_id;
+    END IF;
+END //
+
+DROP TRIGGER IF EXISTS trg_assignment_summary_delete //
+CREATE TRIGGER trg_assignment_summary_delete AFTER DELETE ON assignment
+FOR EACH ROW
+BEGIN
+    UPDATE user_activity_summary
+    SET device_count = (SELECT COUNT(DISTINCT device_id) FROM assignment
+                        WHERE user_id = OLD.user_id AND status = 'approved')
+    WHERE user_id = OLD.user_id;
+END //
+
+-- Last activity only moves forward on insert; purges are left to check-summary
+DROP TRIGGER IF EXISTS trg_audit_log_summary_insert //
+CREATE TRIGGER trg_audit_log_summary_insert AFTER INSERT ON audit_log
+FOR EACH ROW
+BEGIN
+    INSERT INTO user_activity_summary (user_id, last_activity)
+    VALUES (NEW.user_id, NEW.timestamp)
+    ON DUPLICATE KEY UPDATE
+        last_activity = GREATEST(COALESCE(last_activity, NEW.timestamp), NEW.timestamp);
+END //
+
+DROP TRIGGER IF EXISTS trg_device_summary_insert //
+CREATE TRIGGER trg_device_summary_insert AFTER INSERT ON device
+FOR EACH ROW
+BEGIN
+    INSERT INTO device_count_summary (dimension, value, count)
+    VALUES ('category', COALESCE(NEW.category, ''), 1), ('status', COALESCE(NEW.status, ''), 1)
+    ON DUPLICATE KEY UPDATE count = count + 1;
+END //
+
+DROP TRIGGER IF EXISTS trg_device_summary_update //
+CREATE TRIGGER trg_device_summary_update AFTER UPDATE ON device
+FOR EACH ROW
+BEGIN
+    IF NOT (OLD.category <=> NEW.category) THEN
+        UPDATE device_count_summary SET count = count - 1
+        WHERE dimension = 'category' AND value = COALESCE(OLD.category, '');
+        INSERT INTO device_count_summary (dimension, value, count)
+        VALUES ('category', COALESCE(NEW.category, ''), 1)
+        ON DUPLICATE KEY UPDATE count = count + 1;
+    END IF;
+    IF NOT (OLD.status <=> NEW.status) THEN
+        UPDATE device_count_summary SET count = count - 1
+        WHERE dimension = 'status' AND value = COALESCE(OLD.status, '');
+        INSERT INTO device_count_summary (dimension, value, count)
+        VALUES ('status', COALESCE(NEW.status, ''), 1)
+        ON DUPLICATE KEY UPDATE count = count + 1;
+    END IF;
+END //
+
+DROP TRIGGER IF EXISTS trg_device_summary_delete //
+CREATE TRIGGER trg_device_summary_delete AFTER DELETE ON device
+FOR EACH ROW
+BEGIN
+    UPDATE device_count_summary SET count = count - 1
+    WHERE (dimension = 'category' AND value = COALESCE(OLD.category, ''))
+       OR (dimension = 'status' AND value = COALESCE(OLD.status, ''));
+END //
+
+DELIMITER ;
@@ -1,105 +1,158 @@
 import os
 import re
-import json
 import csv
+import io
+import codecs
+import time
+import logging
 from datetime import datetime
 
+import serializer
+from store import get_store
+from history import get_history_store, sample_from_record
+from file_writer import get_file_writer, remove_stale_temp_files
+from cache import invalidate_all
+from alert_engine import get_alert_engine
+from ingest_ledger import block_key, get_ingest_ledger
+from device_snapshot import CSV_FIELDS, FIELD_REGISTRY, DeviceSnapshot
+from metrics import counter, histogram
+from logs import get_logger, sampled
+
 # Directories for storage
 LOG_DIR = "user_logs"
 DATA_DIR = "processed_data"
 ANALYTICS_FILE = os.path.join(DATA_DIR, "analytics.json")
 
+log = get_logger("ingest")
+
+INGEST_STAGE_SECONDS = histogram(
+    "rt_ingest_stage_seconds",
+    "Time per ingest stage: parse (per block), history (per batch), "
+    "update_analytics and alerts (per device).",
+    ("stage",),
+)
+INGESTED_RECORDS = counter("rt_ingested_records_total", "Log blocks parsed and stored.")
+DUPLICATE_RECORDS = counter(
+    "rt_duplicate_records_total", "Log blocks skipped by the delta endpoint as already stored."
+)
+CSV_EXPORT_SECONDS = histogram(
+    "rt_csv_export_seconds", "Time spent generating the all-users CSV (excluding client waits)."
+)
+
+# Header line that opens every block the agent appends, e.g.
+# "2025-12-05 05:21:21 - DESKTOP-GO2C520"
+HEADER_RE = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (.+)')
+
 # Ensure directories exist
 os.makedirs(LOG_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Drop temp files of writes interrupted by a crash
+remove_stale_temp_files(LOG_DIR)
+remove_stale_temp_files(DATA_DIR)
+
+# ---------- Key dispatch ----------
+# Agent fields are declared in device_snapshot.FIELD_REGISTRY
+
+# Normalized key -> (field name, converter, unit), or None for unknown keys.
+# Seeded with the registry substrings; other keys (e.g. "total storage c")
+# are resolved once by substring scan and memoized.
+_KEY_DISPATCH = {}
+_KEY_DISPATCH_LIMIT = 1024
+
+def _resolve_key(key):
+    for name, setter, unit, substrings, _, _ in FIELD_REGISTRY:
+        for sub in substrings:
+            if sub in key:
+                return (name, setter, unit)
+    return None
+
+for _row in FIELD_REGISTRY:
+    for _sub in _row[3]:
+        _KEY_DISPATCH.setdefault(_sub, _resolve_key(_sub))
+
+def _dispatch(key):
+    try:
+        return _KEY_DISPATCH[key]
+    except KeyError:
+        target = _resolve_key(key)
+        if len(_KEY_DISPATCH) < _KEY_DISPATCH_LIMIT:
+            _KEY_DISPATCH[key] = target
+        return target
+
 def parse_log_data(raw_data):
     """
-    Parse the raw log data and extract structured information
+    Parse the raw log data of one block into a DeviceSnapshot
     """
-    parsed = {
-        "timestamp": None,
-        "computer_name": None,
-        "username": None,
-        "gps_location": None,
-        "latitude": None,
-        "longitude": None,
-        "manufacturer": None,
-        "model": None,
-        "serial": None,
-        "cpu_name": None,
-        "cpu_cores": None,
-        "max_clock_speed": None,
-        "total_ram_gb": None,
-        "available_ram_mb": None,
-        "total_storage_gb": None,
-        "available_storage_gb": None
-    }
-
-    lines = raw_data.strip().split('\n')
+    parsed = DeviceSnapshot()
+    header_match = HEADER_RE.match
 
-    for line in lines:
+    for line in raw_data.strip().split('\n'):
         line = line.strip()
 
         # Extract timestamp and computer name from header
-        timestamp_match = re.match(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (.+)', line)
+        timestamp_match = header_match(line)
         if timestamp_match:
-            parsed["timestamp"] = timestamp_match.group(1)
-            parsed["computer_name"] = timestamp_match.group(2).strip()
+            parsed.timestamp = timestamp_match.group(1)
+            parsed.computer_name = timestamp_match.group(2).strip()
             continue
 
         # Key-value parsing
         if ':' in line and not line.startswith('='):
             key, value = line.split(':', 1)
-            key = key.strip().lower()
-            value = value.strip()
-
-            if 'username' in key:
-                parsed["username"] = value
-            elif 'gps' in key or 'location' in key:
-                parsed["gps_location"] = value
-                gps_match = re.search(r'([\d.-]+)\s*,\s*([\d.-]+)', value)
-                if gps_match:
-                    parsed["latitude"] = float(gps_match.group(1))
-                    parsed["longitude"] = float(gps_match.group(2))
-            elif 'manufacturer' in key:
-                parsed["manufacturer"] = value
-            elif 'model' in key:
-                parsed["model"] = value
-            elif 'serial' in key:
-                parsed["serial"] = value
-            elif 'cpu name' in key:
-                parsed["cpu_name"] = value
-            elif 'cpu cores' in key or 'cores' in key:
-                try:
-                    parsed["cpu_cores"] = int(value)
-                except:
-                    parsed["cpu_cores"] = value
-            elif 'clock speed' in key:
-                parsed["max_clock_speed"] = value
-            elif 'total ram' in key:
-                try:
-                    parsed["total_ram_gb"] = float(re.search(r'[\d.]+', value).group())
-                except:
-                    parsed["total_ram_gb"] = value
-            elif 'available ram' in key:
-                try:
-                    parsed["available_ram_mb"] = float(re.search(r'[\d.]+', value).group())
-                except:
-                    parsed["available_ram_mb"] = value
-            elif 'total storage' in key:
-                try:
-                    parsed["total_storage_gb"] = float(re.search(r'[\d.]+', value).group())
-                except:
-                    parsed["total_storage_gb"] = value
-            elif 'available storage' in key:
-                try:
-                    parsed["available_storage_gb"] = float(re.search(r'[\d.]+', value).group())
-                except:
-                    parsed["available_storage_gb"] = value
+            target = _dispatch(key.strip().lower())
+            if target is not None:
+                name, setter, unit = target
+                setter(parsed, name, value.strip(), unit)
 
     return parsed
 
+def iter_lines(chunks):
+    """
+    Yield text lines from an iterable of str/bytes chunks (e.g. request.stream),
+    holding at most one partial line in memory between chunks.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        pending += chunk
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+def iter_log_blocks(chunks):
+    """
+    Split an accumulated agent log into one raw text block per boot.
+    Each block is the "=====" / timestamp header plus its key-value lines.
+    """
+    block = []
+    has_header = False
+
+    for line in iter_lines(chunks):
+        if HEADER_RE.match(line.strip()):
+            if has_header:
+                # The separator just above this header opens the next block
+                carried = []
+                while block and block[-1].strip().startswith('='):
+                    carried.insert(0, block.pop())
+                yield '\n'.join(block)
+                block = carried
+            has_header = True
+        block.append(line)
+
+    if has_header or any(line.strip() for line in block):
+        yield '\n'.join(block)
+
+def iter_log_records(chunks):
+    """Yield one parsed record per block of an accumulated agent log"""
+    for block in iter_log_blocks(chunks):
+        yield parse_log_data(block)
+
 def get_unique_identifier(parsed_data):
     """
     Generate unique identifier for user based on:
@@ -107,164 +160,248 @@ def get_unique_identifier(parsed_data):
     2. Serial number (fallback)
     3. Computer name (last resort)
     """
-    if parsed_data.get("username"):
-        return parsed_data["username"]
-    elif parsed_data.get("serial"):
-        return f"serial_{parsed_data['serial']}"
-    elif parsed_data.get("computer_name"):
-        return f"pc_{parsed_data['computer_name']}"
+    if parsed_data.username:
+        return parsed_data.username
+    elif parsed_data.serial:
+        return f"serial_{parsed_data.serial}"
+    elif parsed_data.computer_name:
+        return f"pc_{parsed_data.computer_name}"
     else:
         return f"unknown_{datetime.now().strftime('%Y%m%d%H%M%S')}"
 
-def process_and_store_log(raw_data, client_ip=None):
+def get_device_identity(parsed_data):
+    """Stable identity of the reporting machine: serial, else computer name"""
+    return parsed_data.serial or parsed_data.computer_name
+
+def _iter_parsed_blocks(raw_data, client_ip, received_at):
+    """Yield (block, parsed) for every block of one upload"""
+    if isinstance(raw_data, (str, bytes)):
+        raw_data = [raw_data]
+
+    for block in iter_log_blocks(raw_data):
+        with INGEST_STAGE_SECONDS.time(stage="parse"):
+            parsed_data = parse_log_data(block)
+        parsed_data.client_ip = client_ip
+        parsed_data.received_at = received_at
+        parsed_data.user_id = get_unique_identifier(parsed_data)
+        yield block, parsed_data
+
+def _add_record(block, parsed_data, latest, samples):
+    user_id = parsed_data.user_id
+    # Blocks arrive oldest first, so the last one per user wins
+    latest[user_id] = (block, parsed_data)
+    samples.append(sample_from_record(user_id, parsed_data))
+
+def _collect_records(raw_data, client_ip, received_at, latest, samples):
     """
-    Main function to process incoming log data
-    - Parse the data
-    - Identify user uniquely
-    - Replace existing log file (keep only latest)
-    - Store processed data for analytics
+    Parse one upload into `latest` ({user_id: (block, parsed)}) and
+    `samples` (history rows). Returns (record_count, last user_id).
     """
-    parsed_data = parse_log_data(raw_data)
-    parsed_data["client_ip"] = client_ip
-    parsed_data["received_at"] = datetime.now().isoformat()
+    record_count = 0
+    user_id = None
+
+    for block, parsed_data in _iter_parsed_blocks(raw_data, client_ip, received_at):
+        _add_record(block, parsed_data, latest, samples)
+        user_id = parsed_data.user_id
+        record_count += 1
 
-    user_id = get_unique_identifier(parsed_data)
-    parsed_data["user_id"] = user_id
+    return record_count, user_id
 
-    user_log_file = os.path.join(LOG_DIR, f"{user_id}.log")
-    user_json_file = os.path.join(DATA_DIR, f"{user_id}.json")
+def _persist_records(latest, samples):
+    """Write history samples and the latest record of each user"""
+    with INGEST_STAGE_SECONDS.time(stage="history"):
+        get_history_store().record_samples(samples)
+    INGESTED_RECORDS.inc(len(samples))
+    writer = get_file_writer()
 
-    # REPLACE existing log file with new one (only latest data needed)
-    with open(user_log_file, 'w', encoding='utf-8') as f:
-        f.write(raw_data)
+    for user_id, (block, parsed_data) in latest.items():
+        user_log_file = os.path.join(LOG_DIR, f"{user_id}.log")
+        user_json_file = os.path.join(DATA_DIR, f"{user_id}.json")
 
-    with open(user_json_file, 'w', encoding='utf-8') as f:
-        json.dump(parsed_data, f, indent=2)
+        # REPLACE existing log file with the latest block; the writer
+        # coalesces repeated reports and writes via temp file + rename
+        writer.submit(user_log_file, block)
+        writer.submit(user_json_file, lambda data=parsed_data: serializer.dumps_bytes(data.as_dict()))
 
-    update_analytics(user_id, parsed_data)
-    update_csv_data(user_id, parsed_data)
+        with INGEST_STAGE_SECONDS.time(stage="update_analytics"):
+            record = update_analytics(user_id, parsed_data)
+        with INGEST_STAGE_SECONDS.time(stage="alerts"):
+            get_alert_engine().evaluate(user_id, record)
 
-    print(f"✅ Processed log for user: {user_id}")
-    print(f"   Log file: {user_log_file}")
-    print(f"   Data file: {user_json_file}")
+        sampled(log, logging.INFO, "✅ Processed log for user: %s (%s, %s)",
+                user_id, user_log_file, user_json_file)
 
+    # Dashboard analytics and alerts are stale now
+    invalidate_all()
+
+def _result(user_id, record_count):
     return {
         "status": "success",
         "user_id": user_id,
-        "message": f"Log processed and stored for {user_id}"
+        "records": record_count,
+        "message": f"{record_count} log record(s) processed and stored for {user_id}"
     }
 
-def update_analytics(user_id, parsed_data):
-    """Update the master analytics JSON file"""
-    analytics = {}
-
-    if os.path.exists(ANALYTICS_FILE):
-        with open(ANALYTICS_FILE, 'r') as f:
-            analytics = json.load(f)
-
-    analytics[user_id] = {
-        "last_updated": parsed_data.get("received_at"),
-        "timestamp": parsed_data.get("timestamp"),
-        "computer_name": parsed_data.get("computer_name"),
-        "username": parsed_data.get("username"),
-        "location": {
-            "gps": parsed_data.get("gps_location"),
-            "latitude": parsed_data.get("latitude"),
-            "longitude": parsed_data.get("longitude")
-        },
-        "hardware": {
-            "manufacturer": parsed_data.get("manufacturer"),
-            "model": parsed_data.get("model"),
-            "serial": parsed_data.get("serial")
-        },
-        "cpu": {
-            "name": parsed_data.get("cpu_name"),
-            "cores": parsed_data.get("cpu_cores"),
-            "max_clock_speed": parsed_data.get("max_clock_speed")
-        },
-        "memory": {
-            "total_ram_gb": parsed_data.get("total_ram_gb"),
-            "available_ram_mb": parsed_data.get("available_ram_mb")
-        },
-        "storage": {
-            "total_gb": parsed_data.get("total_storage_gb"),
-            "available_gb": parsed_data.get("available_storage_gb")
-        },
-        "client_ip": parsed_data.get("client_ip")
-    }
+def process_and_store_log(raw_data, client_ip=None):
+    """
+    Main function to process incoming log data
+    - Split the upload into per-boot blocks and parse each one
+    - Identify user uniquely
+    - Replace existing log file with the latest block
+    - Store processed data for analytics
+    - Append every block's RAM/storage sample to the history store
+
+    raw_data may be a string or an iterable of str/bytes chunks
+    (e.g. request.stream), so large accumulated logs are never held
+    in memory as a whole.
+    """
+    latest = {}
+    samples = []
+    record_count, user_id = _collect_records(
+        raw_data, client_ip, datetime.now().isoformat(), latest, samples
+    )
 
-    with open(ANALYTICS_FILE, 'w') as f:
-        json.dump(analytics, f, indent=2)
+    if not latest:
+        raise ValueError("No log records found in payload")
 
-def update_csv_data(user_id, parsed_data):
-    """Update CSV file for tabular analytics"""
-    csv_file = os.path.join(DATA_DIR, "all_users_data.csv")
+    _persist_records(latest, samples)
+    return _result(user_id, record_count)
 
-    fieldnames = [
-        'user_id', 'username', 'computer_name', 'timestamp', 'received_at',
-        'client_ip', 'latitude', 'longitude', 'manufacturer', 'model', 
-        'serial', 'cpu_name', 'cpu_cores', 'max_clock_speed',
-        'total_ram_gb', 'available_ram_mb', 'total_storage_gb', 'available_storage_gb'
+def process_delta_log(raw_data, client_ip=None):
+    """
+    Idempotent variant of process_and_store_log for agents that upload
+    only what they have not sent before.
+
+    Blocks are identified by device (serial, else computer name) and
+    header timestamp; blocks already in the ingest ledger are skipped.
+    The result adds "duplicates" and "high_water_mark", the newest
+    timestamp stored for the device, which the agent sends from next time.
+    Blocks are marked as ingested only after they are persisted, so a
+    failed upload can simply be retried.
+    """
+    received_at = datetime.now().isoformat()
+    blocks = list(_iter_parsed_blocks(raw_data, client_ip, received_at))
+    if not blocks:
+        raise ValueError("No log records found in payload")
+
+    entries = [
+        (get_device_identity(parsed), parsed.timestamp)
+        for _, parsed in blocks
     ]
+    ledger = get_ingest_ledger()
+    new_keys = ledger.unseen(e for e in entries if e[0] and e[1])
+
+    latest = {}
+    samples = []
+    fresh = []
+    for (block, parsed_data), (device, timestamp) in zip(blocks, entries):
+        if device and timestamp:
+            key = block_key(device, timestamp)
+            if key not in new_keys:
+                continue
+            # A block repeated within this upload is a duplicate too
+            new_keys.discard(key)
+            fresh.append((device, timestamp))
+        _add_record(block, parsed_data, latest, samples)
+
+    if latest:
+        _persist_records(latest, samples)
+        ledger.mark(fresh, received_at)
+
+    record_count = len(samples)
+    DUPLICATE_RECORDS.inc(len(blocks) - record_count)
+    user_id = blocks[-1][1].user_id
+    device = entries[-1][0]
+    result = _result(user_id, record_count)
+    result["duplicates"] = len(blocks) - record_count
+    result["high_water_mark"] = ledger.high_water_mark(device) if device else None
+    return result
+
+def process_log_batch(payloads):
+    """
+    Process several queued uploads together.
+    payloads: iterable of (raw_data, client_ip, received_at).
 
-    existing_data = {}
-    if os.path.exists(csv_file):
-        with open(csv_file, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                existing_data[row['user_id']] = row
-
-    existing_data[user_id] = {
-        'user_id': user_id,
-        'username': parsed_data.get('username', ''),
-        'computer_name': parsed_data.get('computer_name', ''),
-        'timestamp': parsed_data.get('timestamp', ''),
-        'received_at': parsed_data.get('received_at', ''),
-        'client_ip': parsed_data.get('client_ip', ''),
-        'latitude': parsed_data.get('latitude', ''),
-        'longitude': parsed_data.get('longitude', ''),
-        'manufacturer': parsed_data.get('manufacturer', ''),
-        'model': parsed_data.get('model', ''),
-        'serial': parsed_data.get('serial', ''),
-        'cpu_name': parsed_data.get('cpu_name', ''),
-        'cpu_cores': parsed_data.get('cpu_cores', ''),
-        'max_clock_speed': parsed_data.get('max_clock_speed', ''),
-        'total_ram_gb': parsed_data.get('total_ram_gb', ''),
-        'available_ram_mb': parsed_data.get('available_ram_mb', ''),
-        'total_storage_gb': parsed_data.get('total_storage_gb', ''),
-        'available_storage_gb': parsed_data.get('available_storage_gb', '')
-    }
+    History samples go in one transaction and each user's files and
+    analytics record are written once, however many uploads it sent.
+    Returns one result dict per payload.
+    """
+    latest = {}
+    samples = []
+    results = []
+
+    for raw_data, client_ip, received_at in payloads:
+        try:
+            record_count, user_id = _collect_records(
+                raw_data, client_ip, received_at, latest, samples
+            )
+        except Exception as e:
+            results.append({"status": "error", "message": str(e)})
+            continue
+        if record_count:
+            results.append(_result(user_id, record_count))
+        else:
+            results.append({"status": "error", "message": "No log records found in payload"})
+
+    if latest:
+        _persist_records(latest, samples)
+    return results
+
+def update_analytics(user_id, parsed_data):
+    """Upsert this user's entry in the per-device analytics store"""
+    get_store().upsert(user_id, parsed_data)
+    return parsed_data
 
-    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in existing_data.values():
-            writer.writerow(row)
+CSV_FIELDNAMES = list(CSV_FIELDS)
+
+def _csv_row(snapshot):
+    """One DeviceSnapshot as a CSV row"""
+    return ['' if v is None else v for v in snapshot.to_row()]
+
+def iter_csv_export():
+    """
+    Generate the all-users CSV on demand from the analytics store.
+    Yields text chunks (header first, then one chunk per device) so the
+    export can be streamed without building the whole file in memory.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    busy = 0.0
+    started = time.perf_counter()
+
+    writer.writerow(CSV_FIELDNAMES)
+    for snapshot in get_store().iter_snapshots():
+        writer.writerow(_csv_row(snapshot))
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        busy += time.perf_counter() - started
+        yield chunk
+        started = time.perf_counter()
+    busy += time.perf_counter() - started
+    CSV_EXPORT_SECONDS.observe(busy)
+    yield buffer.getvalue()
 
 def get_all_analytics():
     """Get analytics for all users"""
-    if os.path.exists(ANALYTICS_FILE):
-        with open(ANALYTICS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    return get_store().all()
 
 def get_user_analytics(username):
     """Get analytics for a specific user"""
-    analytics = get_all_analytics()
-    if username in analytics:
-        return analytics[username]
+    record = get_store().get(username)
+    if record is not None:
+        return record
     return {"error": f"User '{username}' not found"}
 
 def get_all_users():
     """Get list of all tracked users"""
-    analytics = get_all_analytics()
     users = []
-    for user_id, data in analytics.items():
+    for snapshot in get_store().iter_snapshots():
         users.append({
-            "user_id": user_id,
-            "username": data.get("username"),
-            "computer_name": data.get("computer_name"),
-            "last_updated": data.get("last_updated")
+            "user_id": snapshot.user_id,
+            "username": snapshot.username,
+            "computer_name": snapshot.computer_name,
+            "last_updated": snapshot.received_at
         })
     return {"total_users": len(users), "users": users}
 
@@ -0,0 +1,52 @@
+import os
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is used instead
+    orjson = None
+
+# "auto" (orjson when installed), "orjson" or "json" (stdlib)
+JSON_BACKEND = os.environ.get("RT_JSON_BACKEND", "auto")
+
+if JSON_BACKEND not in ("auto", "orjson", "json"):
+    raise ValueError(f"Unknown JSON backend: {JSON_BACKEND}")
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise ImportError("RT_JSON_BACKEND=orjson but orjson is not installed (pip install orjson)")
+
+BACKEND = "orjson" if orjson is not None and JSON_BACKEND != "json" else "json"
+
+
+def _json_dumps(value, sort_keys=False, default=None):
+    return json.dumps(
+        value, separators=(",", ":"), sort_keys=sort_keys, default=default
+    ).encode("utf-8")
+
+
+if BACKEND == "orjson":
+    # Dates go through `default` as with the stdlib, so output does not
+    # depend on the backend; int keys are written as strings like json does
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps_bytes(value, sort_keys=False, default=None):
+        try:
+            return orjson.dumps(
+                value,
+                default=default,
+                option=(_OPTIONS | orjson.OPT_SORT_KEYS) if sort_keys else _OPTIONS,
+            )
+        except TypeError:
+            # Beyond orjson (e.g. integers over 64 bits): let the stdlib decide
+            return _json_dumps(value, sort_keys, default)
+
+    loads = orjson.loads
+else:
+    dumps_bytes = _json_dumps
+    loads = json.loads
+
+dumps_bytes.__doc__ = "Compact UTF-8 JSON of `value`."
+
+
+def dumps(value, sort_keys=False, default=None):
+    """Compact JSON text of `value`."""
+    return dumps_bytes(value, sort_keys, default).decode("utf-8")
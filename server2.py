@@ -1,19 +1,66 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file
+from flask import Flask, Response, g, request, jsonify, render_template, redirect, url_for, send_file
+from flask.json.provider import DefaultJSONProvider
 import os
-import json
 import io         
-import re          
+import zlib
+import time
+import logging
 from datetime import datetime
 
-from processData import process_and_store_log, get_all_analytics, get_user_analytics, get_all_users
+from processData import (
+    process_and_store_log, process_delta_log, get_all_analytics, get_user_analytics,
+    get_all_users, iter_csv_export
+)
+import serializer
+from store import get_store
+from history import get_history_store
+from export import ARROW_FORMATS, content_type, iter_export, plan_export
+from agent_template import agent_filename, check_username, get_agent_template, parse_username_csv
+from alert_engine import get_alert_engine
+from ingest_queue import INGEST_MODE, MAX_PAYLOAD_BYTES, QueueFull, get_ingest_queue
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, SIZE_BUCKETS, counter, histogram
+from logs import get_logger, sampled
 from db_handler import (
-    get_all_users_db, get_user_details, get_user_devices, 
-    get_device_details, get_usage_analytics, get_resource_alerts
+    get_device_details, get_usage_analytics, get_resource_alerts,
+    get_pool_metrics, get_users_page, get_user_count, get_user_overview,
+    USERS_PAGE_SIZE
 )
 
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify() through the serializer module (orjson when installed).
+    Keys are sorted and dates, decimals and dataclasses go through the
+    same default() as Flask's provider; debug responses stay indented.
+    """
+
+    def dumps_bytes(self, obj):
+        return serializer.dumps_bytes(obj, sort_keys=self.sort_keys, default=self.default)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = 'your-secret-key-here'
 
+log = get_logger("server")
+
+HTTP_REQUEST_SECONDS = histogram(
+    "rt_http_request_seconds", "Time to the response (streamed bodies excluded).",
+    ("endpoint", "method"),
+)
+HTTP_REQUESTS = counter(
+    "rt_http_requests_total", "Requests answered, by route and status.",
+    ("endpoint", "method", "status"),
+)
+INGEST_PAYLOAD_BYTES = histogram(
+    "rt_ingest_payload_bytes", "Declared Content-Length of uploads.", ("endpoint",),
+    buckets=SIZE_BUCKETS,
+)
+
 # Directories
 LOG_DIR = "user_logs"
 DATA_DIR = "processed_data"
@@ -25,44 +72,142 @@ os.makedirs(DATA_DIR, exist_ok=True)
 @app.route('/admin/', methods=['POST'])
 def receive_log():
     """Receives log data from clients"""
-    data = request.get_data(as_text=True)
     client_ip = request.remote_addr
+    observe_payload("admin")
+    sampled(log, logging.INFO, "📥 Received log data from %s (Content-Length: %s)",
+            client_ip, request.content_length)
+
+    if INGEST_MODE == "async":
+        return enqueue_log(client_ip)
+
+    try:
+        result = process_and_store_log(iter_request_chunks(request.stream), client_ip)
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        log.error("❌ Error processing log: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def enqueue_log(client_ip):
+    """Async ingest: validate and enqueue the body, then answer 202"""
+    if request.content_length and request.content_length > MAX_PAYLOAD_BYTES:
+        return jsonify({"status": "error", "message": "Payload too large"}), 413
+
+    data = request.stream.read(MAX_PAYLOAD_BYTES + 1)
+    if len(data) > MAX_PAYLOAD_BYTES:
+        return jsonify({"status": "error", "message": "Payload too large"}), 413
+    if not data.strip():
+        return jsonify({"status": "error", "message": "No log records found in payload"}), 400
+
+    ingest_queue = get_ingest_queue()
+    try:
+        ingest_queue.submit(data, client_ip)
+    except QueueFull as e:
+        response = jsonify({"status": "busy", "message": str(e)})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+
+    return jsonify({
+        "status": "accepted",
+        "queue_depth": ingest_queue.depth(),
+    }), 202
 
-    print("\n" + "="*50)
-    print("📥 RECEIVED LOG DATA:")
-    print(f"From IP: {client_ip}")
-    print(data[:500] + "..." if len(data) > 500 else data)
-    print("="*50)
+@app.route('/admin/delta', methods=['POST'])
+def receive_delta_log():
+    """
+    Idempotent ingest: blocks already stored for the same device and
+    timestamp are skipped, and the response carries the device's
+    high_water_mark so the agent only uploads newer blocks next time.
+    Accepts Content-Encoding: gzip; bodies over MAX_PAYLOAD_BYTES
+    (compressed or not) are rejected with 413.
+    """
+    client_ip = request.remote_addr
+    observe_payload("delta")
+    encoding = (request.headers.get("Content-Encoding") or "identity").lower()
+    if encoding not in UPLOAD_ENCODINGS:
+        return jsonify({"status": "error", "message": f"Unsupported Content-Encoding: {encoding}"}), 415
+    if request.content_length and request.content_length > MAX_PAYLOAD_BYTES:
+        return jsonify({"status": "error", "message": "Payload too large"}), 413
 
     try:
-        result = process_and_store_log(data, client_ip)
+        result = process_delta_log(iter_upload_body(request.stream, encoding), client_ip)
+        sampled(log, logging.INFO, "📥 Delta upload from %s: %s new, %s duplicate record(s)",
+                client_ip, result["records"], result["duplicates"])
         return jsonify(result), 200
+    except PayloadTooLarge as e:
+        return jsonify({"status": "error", "message": str(e)}), 413
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
-        print(f"❌ Error processing log: {e}")
+        log.error("❌ Error processing delta log: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/ingest/status')
+def api_ingest_status():
+    """Ingest queue depth, capacity and counters"""
+    return jsonify(get_ingest_queue().status())
+
+# ==================== METRICS ====================
+@app.route('/metrics')
+def prometheus_metrics():
+    """This process's metrics in the Prometheus text format"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, endpoint=endpoint, method=request.method
+        )
+        HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
 # ==================== ADMIN DASHBOARD ====================
 @app.route('/admin/showUsers')
 def show_users():
-    """Admin dashboard showing all users with cards"""
-    users = get_all_users_db()
+    """Admin dashboard showing one page of user cards (see users_page_args)"""
+    try:
+        filters = users_page_args()
+        page = get_users_page(**filters)
+    except ValueError as e:
+        return str(e), 400
     analytics = get_usage_analytics()
     alerts = get_resource_alerts()
-    return render_template('admin_users.html', users=users, analytics=analytics, alerts=alerts)
+    return render_template(
+        'admin_users.html',
+        users=page["users"],
+        next_cursor=page["next_cursor"],
+        filters=filters,
+        total_users=get_user_count(),
+        analytics=analytics,
+        alerts=alerts,
+    )
+
+@app.route('/api/users')
+def api_users():
+    """Keyset-paginated users: ?limit=&cursor=&sort=&order=&role=&has_devices=&active_since="""
+    try:
+        return cached_json_response(get_users_page, **users_page_args())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route('/admin/user/<int:user_id>')
 def user_details_page(user_id):
     """Get detailed user info with assigned devices"""
-    user = get_user_details(user_id)
-    devices = get_user_devices(user_id)
-    return render_template('user_details.html', user=user, devices=devices)
+    overview = get_user_overview(user_id)
+    return render_template('user_details.html', user=overview["user"], devices=overview["devices"])
 
 @app.route('/api/user/<int:user_id>')
 def api_user_details(user_id):
-    """API endpoint for user details"""
-    user = get_user_details(user_id)
-    devices = get_user_devices(user_id)
-    return jsonify({"user": user, "devices": devices})
+    """User details with assigned devices, each carrying its latest telemetry as log_data"""
+    return cached_json_response(get_user_overview, user_id)
 
 @app.route('/api/device/<int:device_id>/logs')
 def api_device_logs(device_id):
@@ -76,27 +221,227 @@ def api_device_logs(device_id):
 @app.route('/api/analytics')
 def api_analytics():
     """API endpoint for analytics data"""
-    return jsonify(get_usage_analytics())
+    return cached_json_response(get_usage_analytics)
 
 @app.route('/api/alerts')
 def api_alerts():
     """API endpoint for resource alerts"""
-    return jsonify(get_resource_alerts())
+    return cached_json_response(get_resource_alerts)
+
+@app.route('/api/alerts/stream')
+def api_alerts_stream():
+    """
+    Server-Sent Events stream of alert open/update/resolve events.
+    Resumes after the Last-Event-ID header (or ?after=) when given.
+
+    Each response ends after ALERT_STREAM_SECONDS, so it holds a request
+    thread for a bounded time and does not block a graceful shutdown;
+    EventSource then reconnects with Last-Event-ID and misses nothing.
+    """
+    engine = get_alert_engine()
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('after', '')
+    start = int(last_id) if last_id.isdigit() else engine.last_seq()
+
+    def stream():
+        seq = start
+        deadline = time.monotonic() + ALERT_STREAM_SECONDS
+        yield f"retry: {ALERT_STREAM_RETRY_MS}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events = engine.events_since(seq, timeout=min(ALERT_STREAM_KEEPALIVE, remaining))
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                seq = event["seq"]
+                yield f"id: {seq}\nevent: alert\ndata: {serializer.dumps(event)}\n\n"
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/api/alerts/events')
+def api_alerts_events():
+    """Long-poll variant: ?after=<seq>&timeout=<seconds, max 30>"""
+    engine = get_alert_engine()
+    after = request.args.get('after', type=int)
+    if after is None:
+        after = engine.last_seq()
+    timeout = min(request.args.get('timeout', default=25, type=float), 30)
+    events = engine.events_since(after, timeout=timeout)
+    last = events[-1]["seq"] if events else after
+    return jsonify({"seq": last, "events": events})
+
+@app.route('/api/db/pool')
+def api_db_pool():
+    """MySQL connection pool usage and counters"""
+    return jsonify(get_pool_metrics())
+
+@app.route('/api/history/<user_id>')
+def api_history(user_id):
+    """
+    RAM/storage time series for one tracked device.
+    Query args: resolution=raw|hour|day, since, until (ISO date or epoch)
+    """
+    try:
+        points = get_history_store().get_history(
+            user_id,
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            resolution=request.args.get('resolution', 'raw'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"user_id": user_id, "points": points})
+
+@app.route('/api/export/users.csv')
+def api_export_users_csv():
+    """Stream the all-users CSV, generated on demand from the analytics store"""
+    return Response(
+        iter_csv_export(),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=all_users_data.csv"},
+    )
+
+@app.route('/api/export')
+def api_export():
+    """
+    Streamed bulk export for BI jobs.
+    Query args: dataset=snapshot|history|rollups, format=ndjson|csv|parquet|arrow
+    (parquet/arrow need pyarrow), fields=a,b,c, since, until (ISO or epoch).
+    Text formats are gzip-compressed when the client accepts gzip.
+    """
+    dataset = request.args.get('dataset', 'snapshot')
+    fmt = request.args.get('format', 'ndjson')
+    try:
+        columns, rows = plan_export(
+            dataset, fmt,
+            fields=request.args.get('fields'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    compress = fmt not in ARROW_FORMATS and 'gzip' in request.accept_encodings
+    extension = "arrows" if fmt == "arrow" else fmt
+    headers = {
+        "Content-Disposition": f"attachment; filename={dataset}.{extension}",
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        iter_export(dataset, fmt, columns, rows, compress=compress),
+        mimetype=content_type(fmt),
+        headers=headers,
+    )
 
 # ==================== HELPER FUNCTIONS ====================
+def users_page_args():
+    """get_users_page keyword arguments from the query string"""
+    has_devices = (request.args.get('has_devices') or '').lower()
+    if has_devices in ('1', 'true', 'yes'):
+        has_devices = True
+    elif has_devices in ('0', 'false', 'no'):
+        has_devices = False
+    elif has_devices:
+        raise ValueError("has_devices must be true or false")
+    else:
+        has_devices = None
+
+    return {
+        "limit": request.args.get('limit', default=USERS_PAGE_SIZE, type=int),
+        "after": request.args.get('cursor') or None,
+        "sort": request.args.get('sort', 'name'),
+        "order": request.args.get('order', 'asc'),
+        "role": request.args.get('role') or None,
+        "has_devices": has_devices,
+        "active_since": request.args.get('active_since') or None,
+    }
+
+def iter_upload_body(stream, encoding="identity", limit=MAX_PAYLOAD_BYTES):
+    """
+    Upload body chunks, gunzipped for Content-Encoding: gzip. Raises
+    PayloadTooLarge as soon as more than `limit` bytes are received or
+    decoded, so a small compressed body cannot expand without bound.
+    """
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if encoding == "gzip" else None
+    received = decoded = 0
+
+    for chunk in iter_request_chunks(stream):
+        received += len(chunk)
+        if received > limit:
+            raise PayloadTooLarge("Payload too large")
+        if inflater is None:
+            yield chunk
+            continue
+        try:
+            data = inflater.decompress(chunk, UPLOAD_CHUNK_SIZE)
+            while True:
+                decoded += len(data)
+                if decoded > limit:
+                    raise PayloadTooLarge("Decompressed payload too large")
+                yield data
+                if not inflater.unconsumed_tail:
+                    break
+                data = inflater.decompress(inflater.unconsumed_tail, UPLOAD_CHUNK_SIZE)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip body: {e}")
+
+    if inflater is not None and not inflater.eof:
+        raise ValueError("Truncated gzip body")
+
+def json_body(value):
+    """The bytes jsonify(value) sends, kept by the response caches"""
+    return app.json.response(value).get_data()
+
+def cached_json_response(cached_fn, *args, **kwargs):
+    """
+    JSON response for a ttl_cache'd function with an ETag, serialized
+    once per cache entry; answers 304 when the client's If-None-Match
+    is still current.
+    """
+    body, etag = cached_fn.cached_body(json_body, *args, **kwargs)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype=app.json.mimetype)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ALERT_STREAM_KEEPALIVE = 15
+# Lifetime of one /api/alerts/stream response and the client's reconnect delay
+ALERT_STREAM_SECONDS = float(os.environ.get("RT_ALERT_STREAM_SECONDS", "60"))
+ALERT_STREAM_RETRY_MS = 1000
+UPLOAD_ENCODINGS = ("identity", "gzip")
+
+class PayloadTooLarge(ValueError):
+    """Upload body exceeds MAX_PAYLOAD_BYTES (on the wire or decompressed)"""
+
+def observe_payload(endpoint):
+    """Record the upload's declared size (chunked uploads declare none)"""
+    if request.content_length is not None:
+        INGEST_PAYLOAD_BYTES.observe(request.content_length, endpoint=endpoint)
+
+def iter_request_chunks(stream, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Read an upload body in fixed-size chunks"""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
 def get_device_log_data(serial):
     """Get processed log data for a device by serial"""
-    analytics_file = os.path.join(DATA_DIR, "analytics.json")
-    if os.path.exists(analytics_file):
-        with open(analytics_file, 'r') as f:
-            all_data = json.load(f)
-            for user_id, data in all_data.items():
-                if data.get('hardware', {}).get('serial') == serial:
-                    return data
-    return None
-
+    return get_store().find_by_serial(serial)
 
-TEMPLATE_BAT_PATH = "ResourceTracker.bat"  # base BAT in project root
 
 @app.route("/user/setUpUsage", methods=["GET", "POST"])
 def user_setup_usage():
@@ -131,40 +476,45 @@ def download_bat():
     Generate BAT file with USERNAME=<username> patched in.
     Expects ?username=... (already trimmed).
     """
-    username = (request.args.get("username") or "").strip()
-    if not username:
-        return "Username is required", 400
-
-    if not os.path.exists(TEMPLATE_BAT_PATH):
+    try:
+        username = check_username(request.args.get("username"))
+        content = get_agent_template().render(username)
+    except ValueError as e:
+        return str(e), 400
+    except OSError:
         return "Base BAT file not found on server", 500
 
-    # Read original BAT template
-    with open(TEMPLATE_BAT_PATH, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    # Replace the USERNAME line (assumes exact pattern exists once)
-    # Example in BAT:  SET "USERNAME=user001"
-    content, count = re.subn(
-        r'SET\s+"USERNAME=.*?"',
-        f'SET "USERNAME={username}"',
-        content,
-        count=1,
-    )
-
-    # Fallback: if pattern not found, prepend a line
-    if count == 0:
-        content = f'SET "USERNAME={username}"\n' + content
-
     # Serve as downloadable file (in‑memory, no temp files)
-    file_stream = io.BytesIO(content.encode("utf-8"))
-    filename = (f"ResourceTracker_{username}.bat")
     return send_file(
-        file_stream,
+        io.BytesIO(content),
         as_attachment=True,
-        download_name=filename,
+        download_name=agent_filename(username),
         mimetype="application/octet-stream",
     )
 
+@app.route("/user/downloadBats", methods=["POST"])
+def download_bats():
+    """
+    Zip of personalised agents for a CSV of usernames (first column,
+    optional "username" header), uploaded as the `usernames` file field
+    or as the request body. Streamed as it is built.
+    """
+    upload = request.files.get("usernames")
+    text = upload.read().decode("utf-8-sig") if upload else request.get_data(as_text=True)
+    try:
+        usernames = parse_username_csv(text)
+        get_agent_template().render(usernames[0])
+    except ValueError as e:
+        return str(e), 400
+    except OSError:
+        return "Base BAT file not found on server", 500
+
+    return Response(
+        get_agent_template().iter_zip(usernames),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=ResourceTracker_agents.zip"},
+    )
+
 
 
 
@@ -172,7 +522,11 @@ if __name__ == '__main__':
     print("🚀 Device Management Server running on http://localhost:8000")
     print("📊 Endpoints:")
     print("   POST /admin - Receive log data")
+    print("   POST /admin/delta - Receive only unsent log records (gzip ok)")
     print("   GET /admin/showUsers - Admin dashboard")
     print("   GET /admin/user/<id> - User details")
     print("   GET /api/analytics - Analytics data")
+    print("   GET /api/export/users.csv - All-users CSV export")
+    print("   GET /api/export - Bulk snapshot/history export (ndjson, csv, parquet, arrow)")
+    print("   GET /metrics - Prometheus metrics")
     app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
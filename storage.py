@@ -0,0 +1,30 @@
+import os
+import sqlite3
+import threading
+
+# Directory of the server's data files and embedded databases
+DATA_DIR = "processed_data"
+
+os.makedirs(DATA_DIR, exist_ok=True)
+
+
+class ThreadLocalSQLite:
+    """
+    One SQLite connection per thread to `path`, opened on first use.
+    Connections are in autocommit mode (callers run BEGIN IMMEDIATE /
+    COMMIT themselves) with WAL journaling, so readers run while
+    another thread or process is writing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
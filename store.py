@@ -0,0 +1,806 @@
+import os
+import time
+import logging
+import threading
+from operator import attrgetter
+from contextlib import nullcontext
+
+import serializer
+from storage import DATA_DIR, ThreadLocalSQLite
+from file_writer import DURABILITY, atomic_write
+from locking import SHARED_PROCESSES, file_lock
+from device_snapshot import SNAPSHOT_FIELDS, DeviceSnapshot, coerce_numbers
+from logs import get_logger
+from metrics import gauge, histogram
+
+log = get_logger("store")
+
+ANALYTICS_FILE = os.path.join(DATA_DIR, "analytics.json")
+SQLITE_FILE = os.path.join(DATA_DIR, "analytics.db")
+FLEET_SNAPSHOT_FILE = os.path.join(DATA_DIR, "fleet.snapshot")
+FLEET_WAL_FILE = os.path.join(DATA_DIR, "fleet.wal")
+
+# "memory" (default), "sqlite" or "json" (legacy single-document analytics.json)
+STORE_BACKEND = os.environ.get("RT_STORE_BACKEND", "memory")
+
+# Memory backend: WAL size that triggers a compacted snapshot, and the
+# longest time (seconds, 0 = never) WAL records wait for one
+FLEET_WAL_MAX_BYTES = int(os.environ.get("RT_FLEET_WAL_MAX_BYTES", str(32 * 1024 * 1024)))
+FLEET_SNAPSHOT_INTERVAL = float(os.environ.get("RT_FLEET_SNAPSHOT_INTERVAL", "300"))
+
+# Snapshots per chunk written to the snapshot file
+SNAPSHOT_CHUNK = 1000
+
+
+def _document(record):
+    """Store document of a DeviceSnapshot (documents pass through)."""
+    return record.to_document() if isinstance(record, DeviceSnapshot) else record
+
+
+class RecordStore:
+    """
+    Per-device record store used by processData.update_analytics
+    and get_all_analytics. One record per user_id, kept as the nested
+    DeviceSnapshot document.
+    """
+
+    def upsert(self, user_id, record):
+        """Store `record` (a DeviceSnapshot or its document) for user_id."""
+        raise NotImplementedError
+
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def iter_records(self):
+        """Yield (user_id, record) pairs."""
+        raise NotImplementedError
+
+    def iter_updated_since(self, since):
+        """Yield (user_id, record) for records whose last_updated (ISO) is >= since."""
+        for user_id, record in self.iter_records():
+            if (record.get("last_updated") or "") >= since:
+                yield user_id, record
+
+    def iter_snapshots(self, since=None):
+        """
+        Yield a DeviceSnapshot per record (only those with last_updated
+        >= since when given); cheaper to hold than the documents.
+        """
+        rows = self.iter_records() if since is None else self.iter_updated_since(since)
+        from_document = DeviceSnapshot.from_document
+        for user_id, record in rows:
+            yield from_document(record, user_id)
+
+    def count(self):
+        raise NotImplementedError
+
+    def all(self):
+        """Return {user_id: record} for the whole fleet."""
+        return dict(self.iter_records())
+
+    def find_user_id(self, serial=None, computer_name=None):
+        """user_id of the device with this serial (or computer name), if any."""
+        for user_id, record in self.iter_records():
+            if serial is not None and (record.get("hardware") or {}).get("serial") == serial:
+                return user_id
+            if computer_name is not None and record.get("computer_name") == computer_name:
+                return user_id
+        return None
+
+    def find_by_serial(self, serial):
+        """Record of the device with this hardware serial, if any."""
+        user_id = self.find_user_id(serial=serial)
+        return self.get(user_id) if user_id is not None else None
+
+    def find_many_by_serial(self, serials):
+        """{serial: record} for every given serial that has a record (one pass)."""
+        wanted = set(serials)
+        found = {}
+        for _, record in self.iter_records():
+            serial = (record.get("hardware") or {}).get("serial")
+            if serial in wanted and (
+                serial not in found
+                or record.get("last_updated", "") > found[serial].get("last_updated", "")
+            ):
+                found[serial] = record
+        return found
+
+
+class SQLiteRecordStore(RecordStore):
+    """
+    One row per device in an embedded SQLite table.
+    Upserts touch a single row and are atomic; WAL mode lets
+    readers run while an ingest is writing.
+    """
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        self._conn = ThreadLocalSQLite(path)
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS devices (
+                user_id       TEXT PRIMARY KEY,
+                last_updated  TEXT,
+                doc           TEXT NOT NULL,
+                serial        TEXT,
+                computer_name TEXT
+            )
+            """
+        )
+        self._migrate_lookup_columns(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_devices_serial ON devices (serial)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_devices_computer_name ON devices (computer_name)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_devices_last_updated ON devices (last_updated)"
+        )
+        if self.count() == 0 and os.path.exists(ANALYTICS_FILE):
+            self._import_legacy_json(ANALYTICS_FILE)
+
+    def _migrate_lookup_columns(self, conn):
+        """Add and backfill the serial / computer_name columns on older databases."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(devices)")}
+        if {"serial", "computer_name"} <= columns:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for column in ("serial", "computer_name"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE devices ADD COLUMN {column} TEXT")
+            conn.execute(
+                """
+                UPDATE devices SET
+                    serial        = json_extract(doc, '$.hardware.serial'),
+                    computer_name = json_extract(doc, '$.computer_name')
+                """
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _import_legacy_json(self, path):
+        """One-time migration of an existing analytics.json."""
+        try:
+            with open(path, "rb") as f:
+                legacy = serializer.loads(f.read())
+        except (OSError, ValueError) as e:
+            log.error("Error importing %s: %s", path, e)
+            return
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id, record in legacy.items():
+                self._upsert_row(conn, user_id, record)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        log.info("Imported %d device records from %s", len(legacy), path)
+
+    def _upsert_row(self, conn, user_id, record):
+        conn.execute(
+            """
+            INSERT INTO devices (user_id, last_updated, doc, serial, computer_name)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                last_updated  = excluded.last_updated,
+                doc           = excluded.doc,
+                serial        = excluded.serial,
+                computer_name = excluded.computer_name
+            """,
+            (
+                user_id,
+                record.get("last_updated"),
+                serializer.dumps(record),
+                (record.get("hardware") or {}).get("serial"),
+                record.get("computer_name"),
+            ),
+        )
+
+    def upsert(self, user_id, record):
+        self._upsert_row(self._conn(), user_id, _document(record))
+
+    def get(self, user_id):
+        row = self._conn().execute(
+            "SELECT doc FROM devices WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return serializer.loads(row[0]) if row else None
+
+    def iter_records(self):
+        cursor = self._conn().execute("SELECT user_id, doc FROM devices")
+        for user_id, doc in cursor:
+            yield user_id, serializer.loads(doc)
+
+    def iter_updated_since(self, since):
+        cursor = self._conn().execute(
+            "SELECT user_id, doc FROM devices WHERE last_updated >= ? ORDER BY last_updated",
+            (since,),
+        )
+        for user_id, doc in cursor:
+            yield user_id, serializer.loads(doc)
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+
+    def find_user_id(self, serial=None, computer_name=None):
+        conn = self._conn()
+        if serial is not None:
+            row = conn.execute(
+                "SELECT user_id FROM devices WHERE serial = ? "
+                "ORDER BY last_updated DESC LIMIT 1",
+                (serial,),
+            ).fetchone()
+            if row:
+                return row[0]
+        if computer_name is not None:
+            row = conn.execute(
+                "SELECT user_id FROM devices WHERE computer_name = ? "
+                "ORDER BY last_updated DESC LIMIT 1",
+                (computer_name,),
+            ).fetchone()
+            if row:
+                return row[0]
+        return None
+
+    def find_by_serial(self, serial):
+        row = self._conn().execute(
+            "SELECT doc FROM devices WHERE serial = ? ORDER BY last_updated DESC LIMIT 1",
+            (serial,),
+        ).fetchone()
+        return serializer.loads(row[0]) if row else None
+
+    def find_many_by_serial(self, serials):
+        serials = list(set(serials))
+        if not serials:
+            return {}
+        rows = self._conn().execute(
+            "SELECT serial, doc FROM devices WHERE serial IN ("
+            + ", ".join("?" * len(serials))
+            + ") ORDER BY last_updated",
+            serials,
+        )
+        # Ascending order: the most recently updated record per serial wins
+        return {serial: serializer.loads(doc) for serial, doc in rows}
+
+
+class JsonRecordStore(RecordStore):
+    """
+    Legacy backend: the whole fleet in one analytics.json document.
+    Kept for deployments that read the file directly.
+
+    Upserts read-modify-write the document under an flock shared by all
+    threads and processes, and replace it atomically; the previous
+    version is kept as analytics.json.bak. An unreadable document is
+    moved aside and restored from that backup.
+    """
+
+    def __init__(self, path=ANALYTICS_FILE):
+        self.path = path
+        self.backup_path = path + ".bak"
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            return serializer.loads(f.read())
+
+    def _load(self, locked=False):
+        try:
+            return self._read(self.path)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            return self._recover(e, locked)
+
+    def _recover(self, error, locked):
+        with nullcontext() if locked else file_lock(self.path):
+            # Another process may have recovered it while we waited for the lock
+            try:
+                return self._read(self.path)
+            except FileNotFoundError:
+                return {}
+            except (OSError, ValueError):
+                pass
+
+            corrupt_path = f"{self.path}.corrupt-{int(time.time())}"
+            log.warning("%s is unreadable (%s); moved to %s, restoring backup", self.path, error, corrupt_path)
+            os.replace(self.path, corrupt_path)
+            try:
+                analytics = self._read(self.backup_path)
+            except (OSError, ValueError):
+                analytics = {}
+            atomic_write(self.path, serializer.dumps_bytes(analytics), fsync=True)
+            return analytics
+
+    def _save(self, analytics):
+        if os.path.exists(self.path):
+            # Hard-link the current (known good) version as the backup
+            link_path = f"{self.backup_path}.{os.getpid()}.tmp"
+            try:
+                os.link(self.path, link_path)
+                os.replace(link_path, self.backup_path)
+            except OSError:
+                if os.path.exists(link_path):
+                    os.remove(link_path)
+        atomic_write(self.path, serializer.dumps_bytes(analytics), fsync=DURABILITY != "buffered")
+
+    def upsert(self, user_id, record):
+        with file_lock(self.path):
+            analytics = self._load(locked=True)
+            analytics[user_id] = _document(record)
+            self._save(analytics)
+
+    def get(self, user_id):
+        return self._load().get(user_id)
+
+    def iter_records(self):
+        return iter(self._load().items())
+
+    def count(self):
+        return len(self._load())
+
+
+def _header(**values):
+    """
+    First line of a WAL or snapshot file; its records are arrays in
+    `fields` order. typed_numbers marks files whose numeric fields were
+    written as numbers (earlier versions could write text such as "2995 MHz").
+    """
+    return serializer.dumps_bytes(
+        {**values, "fields": SNAPSHOT_FIELDS, "typed_numbers": True}
+    ) + b"\n"
+
+
+def _encode(snapshot, _get=attrgetter(*SNAPSHOT_FIELDS)):
+    return serializer.dumps_bytes(_get(snapshot)) + b"\n"
+
+
+def _decoder(header):
+    """Line -> DeviceSnapshot for a file whose header is `header`."""
+    fields = tuple(header["fields"])
+    if fields == SNAPSHOT_FIELDS and header.get("typed_numbers"):
+        loads = serializer.loads
+        return lambda line: DeviceSnapshot(*loads(line))
+
+    # Written by an earlier version: keep the known fields, convert the numbers
+    known = [(i, field) for i, field in enumerate(fields) if field in SNAPSHOT_FIELDS]
+
+    def decode(line):
+        row = serializer.loads(line)
+        return coerce_numbers(DeviceSnapshot(**{field: row[i] for i, field in known}))
+    return decode
+
+
+def _snapshot(user_id, record):
+    """DeviceSnapshot of `record` (a snapshot or its document) stored under user_id."""
+    if not isinstance(record, DeviceSnapshot):
+        return DeviceSnapshot.from_document(record, user_id)
+    if record.user_id != user_id:
+        return DeviceSnapshot(**{**record.as_dict(), "user_id": user_id})
+    return record
+
+
+class _FleetState:
+    """Latest DeviceSnapshot per user_id, with serial / computer name lookups."""
+
+    def __init__(self):
+        self.snapshots = {}
+        self.by_serial = {}
+        self.by_name = {}
+
+    def apply(self, snapshot):
+        self.snapshots[snapshot.user_id] = snapshot
+        if snapshot.serial is not None:
+            self.by_serial[snapshot.serial] = snapshot.user_id
+        if snapshot.computer_name is not None:
+            self.by_name[snapshot.computer_name] = snapshot.user_id
+
+    def lookup(self, index, field, value):
+        """user_id of the most recently updated device whose `field` is `value`."""
+        user_id = index.get(value)
+        if user_id is None:
+            return None
+        snapshot = self.snapshots.get(user_id)
+        if snapshot is not None and getattr(snapshot, field) == value:
+            return user_id
+        # That device has since reported another value: look for the next holder
+        matches = [s for s in list(self.snapshots.values()) if getattr(s, field) == value]
+        if not matches:
+            index.pop(value, None)
+            return None
+        user_id = max(matches, key=lambda s: s.received_at or "").user_id
+        index[value] = user_id
+        return user_id
+
+
+class MemoryRecordStore(RecordStore):
+    """
+    The whole fleet held in memory as one DeviceSnapshot per device, so
+    reads cost no disk I/O.
+
+    Durability comes from an append-only write-ahead log (fleet.wal, one
+    JSON line per upsert, fsynced unless RT_WRITE_DURABILITY is buffered)
+    and a compacted snapshot (fleet.snapshot) written in the background
+    once the WAL reaches RT_FLEET_WAL_MAX_BYTES or every
+    RT_FLEET_SNAPSHOT_INTERVAL seconds. Startup loads the snapshot and
+    replays the WAL written since, so restart time is bounded by the
+    fleet size plus the WAL limit.
+
+    Compaction renames the WAL to fleet.wal.<generation> and starts the
+    next generation; the snapshot header records the first generation it
+    does not contain, and older WAL files are removed once it is in
+    place. Appends and renames happen under an flock on fleet.wal.lock.
+    With several server processes, each process tails the WAL (or
+    reloads after another process compacted) before answering a read.
+    """
+
+    def __init__(self, path=FLEET_SNAPSHOT_FILE, wal_path=FLEET_WAL_FILE,
+                 wal_max_bytes=FLEET_WAL_MAX_BYTES, snapshot_interval=FLEET_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.wal_path = wal_path
+        self.wal_max_bytes = wal_max_bytes
+        self.snapshot_interval = snapshot_interval
+        self._state = _FleetState()
+        self._lock = threading.Lock()
+        # Held while the WAL position below is read or advanced
+        self._sync_lock = threading.Lock()
+        self._wal_ino = None
+        self._wal_generation = None
+        self._wal_header = 0
+        self._wal_offset = 0
+        self._wal_decode = _decoder({"fields": SNAPSHOT_FIELDS})
+        self.stats = {
+            "devices": 0,
+            "wal_bytes": 0,
+            "replay_seconds": 0.0,
+            "replayed_wal_records": 0,
+            "compactions": 0,
+        }
+        self._compaction_due = threading.Event()
+
+        with file_lock(self.wal_path):
+            self._open()
+        threading.Thread(target=self._compact_loop, name="fleet-compactor", daemon=True).start()
+
+    # ---------- files ----------
+
+    def _archived_wals(self):
+        """[(generation, path)] of the WAL files rotated out by compactions, oldest first."""
+        return self._numbered(self.wal_path, "")
+
+    def _staged_path(self, generation):
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{generation}{ext}"
+
+    def _numbered(self, base, ext):
+        directory, prefix = os.path.split(base + ".")
+        found = []
+        for name in os.listdir(directory or "."):
+            if name.startswith(prefix) and name.endswith(ext):
+                generation = name[len(prefix):len(name) - len(ext)]
+                if generation.isdigit():
+                    found.append((int(generation), os.path.join(directory, name)))
+        return sorted(found)
+
+    def _snapshot_generation(self):
+        """First WAL generation not contained in the snapshot (1 without a snapshot)."""
+        try:
+            with open(self.path, "rb") as f:
+                return serializer.loads(f.readline())["wal"]
+        except FileNotFoundError:
+            return 1
+
+    def _create_wal(self, generation):
+        header = _header(generation=generation)
+        atomic_write(self.wal_path, header, fsync=DURABILITY != "buffered")
+        self._wal_ino = os.stat(self.wal_path).st_ino
+        self._wal_generation = generation
+        self._wal_decode = _decoder({"fields": SNAPSHOT_FIELDS})
+        self._wal_header = self._wal_offset = len(header)
+
+    def _write_snapshot(self, path, snapshots, wal_generation):
+        def chunks():
+            yield _header(
+                wal=wal_generation,
+                devices=len(snapshots),
+                taken_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            )
+            for start in range(0, len(snapshots), SNAPSHOT_CHUNK):
+                yield b"".join(_encode(s) for s in snapshots[start:start + SNAPSHOT_CHUNK])
+
+        atomic_write(path, chunks(), fsync=DURABILITY != "buffered")
+
+    def _remove_obsolete(self, wal_generation):
+        """Delete WAL files and staged snapshots covered by the snapshot in place."""
+        for generation, path in self._archived_wals():
+            if generation < wal_generation:
+                os.remove(path)
+        root, ext = os.path.splitext(self.path)
+        for generation, path in self._numbered(root, ext):
+            if generation <= wal_generation:
+                os.remove(path)
+
+    # ---------- loading (all under the WAL flock) ----------
+
+    def _open(self):
+        """Create the files on first start, then load them."""
+        if not os.path.exists(self.wal_path):
+            if os.path.exists(self.path) or self._archived_wals():
+                # Crashed between rotating the WAL and starting the next one
+                generation = max(
+                    [self._snapshot_generation()] + [g + 1 for g, _ in self._archived_wals()]
+                )
+                self._create_wal(generation)
+            else:
+                self._write_snapshot(self.path, self._import_existing(), 1)
+                self._create_wal(1)
+        self._load()
+        self._remove_obsolete(self._snapshot_generation())
+
+    def _import_existing(self):
+        """Snapshots of the records kept by the sqlite or json backend, if any."""
+        if os.path.exists(SQLITE_FILE):
+            source, records = SQLITE_FILE, SQLiteRecordStore(SQLITE_FILE).iter_records()
+        elif os.path.exists(ANALYTICS_FILE):
+            source, records = ANALYTICS_FILE, JsonRecordStore(ANALYTICS_FILE).iter_records()
+        else:
+            return []
+        snapshots = [_snapshot(user_id, record) for user_id, record in records]
+        log.info("Imported %d device records from %s", len(snapshots), source)
+        return snapshots
+
+    def _replay(self, f, state, offset, decode):
+        """
+        Apply the complete lines of `f` after `offset` to `state`.
+        Returns (offset after the last complete line, records applied);
+        a torn last line (crash mid-append) is left for the next writer
+        to truncate.
+        """
+        f.seek(offset)
+        applied = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            try:
+                snapshot = decode(line)
+            except (ValueError, TypeError) as e:
+                log.warning("Skipping unreadable line in %s: %s", f.name, e)
+                continue
+            state.apply(snapshot)
+            applied += 1
+        return offset, applied
+
+    def _load(self, level=logging.INFO):
+        """Rebuild the state from the snapshot and the WAL files written since."""
+        started = time.perf_counter()
+        state = _FleetState()
+        wal_from = 1
+        try:
+            with open(self.path, "rb") as f:
+                header = f.readline()
+                values = serializer.loads(header)
+                wal_from = values["wal"]
+                self._replay(f, state, len(header), _decoder(values))
+        except FileNotFoundError:
+            pass
+        snapshot_devices = len(state.snapshots)
+
+        replayed = 0
+        for generation, path in self._archived_wals():
+            if generation >= wal_from:
+                with open(path, "rb") as f:
+                    header = f.readline()
+                    replayed += self._replay(f, state, len(header), _decoder(serializer.loads(header)))[1]
+
+        with open(self.wal_path, "rb") as f:
+            header = f.readline()
+            values = serializer.loads(header)
+            self._wal_generation = values["generation"]
+            self._wal_decode = _decoder(values)
+            self._wal_ino = os.fstat(f.fileno()).st_ino
+            self._wal_header = len(header)
+            self._wal_offset, applied = self._replay(f, state, self._wal_header, self._wal_decode)
+        replayed += applied
+
+        with self._lock:
+            self._state = state
+        elapsed = time.perf_counter() - started
+        self.stats.update(
+            devices=len(state.snapshots),
+            wal_bytes=self._wal_offset - self._wal_header,
+            replay_seconds=elapsed,
+            replayed_wal_records=replayed,
+        )
+        log.log(
+            level, "Loaded %d devices (%d from snapshot, %d WAL records) in %.3fs",
+            len(state.snapshots), snapshot_devices, replayed, elapsed,
+        )
+
+    def _catch_up(self, st):
+        """Bring the state up to the WAL `st` (an os.stat of it) written by other processes."""
+        if st.st_ino != self._wal_ino:
+            # Another process compacted: its snapshot holds what we missed
+            self._load(logging.DEBUG)
+            return
+        if st.st_size == self._wal_offset:
+            return
+        with open(self.wal_path, "rb") as f, self._lock:
+            self._wal_offset = self._replay(f, self._state, self._wal_offset, self._wal_decode)[0]
+        self.stats.update(devices=len(self._state.snapshots), wal_bytes=self._wal_offset - self._wal_header)
+
+    def _refresh(self):
+        """With several server processes, apply what the others appended before a read."""
+        if not SHARED_PROCESSES:
+            return
+        try:
+            st = os.stat(self.wal_path)
+        except FileNotFoundError:
+            st = None  # mid-rotation; re-checked under the lock
+        if st is not None and st.st_ino == self._wal_ino and st.st_size == self._wal_offset:
+            return
+        with file_lock(self.wal_path, shared=True), self._sync_lock:
+            self._catch_up(os.stat(self.wal_path))
+
+    # ---------- writes ----------
+
+    def upsert(self, user_id, record):
+        snapshot = _snapshot(user_id, record)
+        line = _encode(snapshot)
+        with file_lock(self.wal_path), self._sync_lock:
+            fd = os.open(self.wal_path, os.O_WRONLY | os.O_APPEND)
+            try:
+                self._catch_up(os.fstat(fd))
+                if os.fstat(fd).st_size != self._wal_offset:
+                    # Torn line left by a crash mid-append
+                    os.ftruncate(fd, self._wal_offset)
+                os.write(fd, line)
+                if DURABILITY != "buffered":
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._wal_offset += len(line)
+            with self._lock:
+                self._state.apply(snapshot)
+            wal_bytes = self._wal_offset - self._wal_header
+            self.stats.update(devices=len(self._state.snapshots), wal_bytes=wal_bytes)
+        if wal_bytes >= self.wal_max_bytes:
+            self._compaction_due.set()
+
+    # ---------- compaction ----------
+
+    def compact(self, min_bytes=1):
+        """
+        Write a snapshot of the current state and drop the WAL it covers,
+        if the WAL holds at least `min_bytes` of records. Returns True if
+        a snapshot was installed.
+        """
+        started = time.perf_counter()
+        with file_lock(self.wal_path), self._sync_lock:
+            self._catch_up(os.stat(self.wal_path))
+            if self._wal_offset - self._wal_header < min_bytes:
+                return False
+            generation = self._wal_generation
+            os.replace(self.wal_path, f"{self.wal_path}.{generation}")
+            self._create_wal(generation + 1)
+            with self._lock:
+                snapshots = list(self._state.snapshots.values())
+            self.stats["wal_bytes"] = 0
+
+        # Written outside the lock so ingest keeps appending meanwhile
+        staged = self._staged_path(generation + 1)
+        self._write_snapshot(staged, snapshots, generation + 1)
+
+        with file_lock(self.wal_path):
+            if self._snapshot_generation() > generation + 1:
+                # Another process installed a newer snapshot meanwhile
+                os.remove(staged)
+                return False
+            os.replace(staged, self.path)
+            self._remove_obsolete(generation + 1)
+        COMPACTION_SECONDS.observe(time.perf_counter() - started)
+        self.stats["compactions"] += 1
+        return True
+
+    def _compact_loop(self):
+        while True:
+            by_size = self._compaction_due.wait(self.snapshot_interval or None)
+            self._compaction_due.clear()
+            try:
+                self.compact(self.wal_max_bytes if by_size else 1)
+            except Exception as e:
+                log.error("Fleet snapshot failed: %s", e)
+
+    # ---------- reads (memory only) ----------
+
+    def get(self, user_id):
+        self._refresh()
+        snapshot = self._state.snapshots.get(user_id)
+        return snapshot.to_document() if snapshot is not None else None
+
+    def iter_snapshots(self, since=None):
+        """
+        Yield the stored DeviceSnapshots (shared with the store: do not
+        modify them), ordered by last_updated when `since` is given.
+        """
+        self._refresh()
+        with self._lock:
+            snapshots = list(self._state.snapshots.values())
+        if since is not None:
+            snapshots = sorted(
+                (s for s in snapshots if (s.received_at or "") >= since),
+                key=lambda s: s.received_at or "",
+            )
+        return iter(snapshots)
+
+    def iter_records(self):
+        for snapshot in self.iter_snapshots():
+            yield snapshot.user_id, snapshot.to_document()
+
+    def iter_updated_since(self, since):
+        for snapshot in self.iter_snapshots(since):
+            yield snapshot.user_id, snapshot.to_document()
+
+    def count(self):
+        self._refresh()
+        return len(self._state.snapshots)
+
+    def find_user_id(self, serial=None, computer_name=None):
+        self._refresh()
+        state = self._state
+        user_id = None
+        if serial is not None:
+            user_id = state.lookup(state.by_serial, "serial", serial)
+        if user_id is None and computer_name is not None:
+            user_id = state.lookup(state.by_name, "computer_name", computer_name)
+        return user_id
+
+    def find_many_by_serial(self, serials):
+        found = {}
+        for serial in set(serials):
+            record = self.find_by_serial(serial)
+            if record is not None:
+                found[serial] = record
+        return found
+
+
+BACKENDS = {
+    "memory": MemoryRecordStore,
+    "sqlite": SQLiteRecordStore,
+    "json": JsonRecordStore,
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the process-wide record store for STORE_BACKEND."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STORE_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown store backend: {STORE_BACKEND}")
+                _store = BACKENDS[STORE_BACKEND]()
+    return _store
+
+
+def _fleet_stats():
+    return dict(_store.stats) if isinstance(_store, MemoryRecordStore) else {}
+
+
+COMPACTION_SECONDS = histogram(
+    "rt_fleet_compaction_seconds", "Time to write a compacted fleet snapshot."
+)
+gauge(
+    "rt_fleet_store",
+    "In-memory fleet store: devices, WAL bytes since the last snapshot, startup replay time.",
+    ("stat",), callback=_fleet_stats,
+)
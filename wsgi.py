@@ -0,0 +1,123 @@
+"""
+Production entry point: python wsgi.py
+
+Serves the Flask app with gunicorn (RT_SERVER_WORKERS processes x
+RT_SERVER_THREADS threads) when it is installed, otherwise with waitress
+(one process, RT_SERVER_THREADS threads), otherwise with the threaded
+Werkzeug server. On SIGTERM/SIGINT each process stops accepting requests,
+finishes the ones in flight, drains its ingest queue and flushes pending
+file writes before exiting.
+"""
+import os
+import signal
+
+try:
+    import gunicorn.app.base
+except ImportError:  # gunicorn is optional (and unavailable on Windows)
+    gunicorn = None
+
+try:
+    import waitress
+except ImportError:  # waitress is optional
+    waitress = None
+
+BIND = os.environ.get("RT_SERVER_BIND", "0.0.0.0:8000")
+THREADS = int(os.environ.get("RT_SERVER_THREADS", "4"))
+
+# Seconds a stopping process waits for in-flight requests, then for its ingest queue
+SHUTDOWN_TIMEOUT = float(os.environ.get("RT_SHUTDOWN_TIMEOUT", "30"))
+
+# One worker process per core by default; only gunicorn can run several
+WORKERS = int(os.environ.get("RT_SERVER_WORKERS", str(os.cpu_count() or 1))) if gunicorn else 1
+
+# Must be set before the app modules are imported (see locking.SHARED_PROCESSES)
+os.environ["RT_SERVER_WORKERS"] = str(WORKERS)
+
+from server2 import app  # noqa: E402
+from ingest_queue import close_ingest_queue  # noqa: E402
+from file_writer import get_file_writer  # noqa: E402
+from logs import get_logger  # noqa: E402
+
+log = get_logger("server")
+
+
+def shutdown(timeout=SHUTDOWN_TIMEOUT):
+    """Drain queued uploads and flush pending file writes; True if nothing was left behind."""
+    drained = close_ingest_queue(timeout)
+    if not drained:
+        log.warning("Ingest queue not drained within %ss", timeout)
+    get_file_writer().flush()
+    return drained
+
+
+def _worker_exit(server, worker):
+    shutdown()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+if gunicorn is not None:
+    class GunicornApplication(gunicorn.app.base.BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+def run_gunicorn():
+    options = {
+        "bind": BIND,
+        "workers": WORKERS,
+        "threads": THREADS,
+        "worker_class": "gthread",
+        "graceful_timeout": SHUTDOWN_TIMEOUT * 2,
+        "worker_exit": _worker_exit,
+    }
+    GunicornApplication(app, options).run()
+
+
+def run_waitress():
+    host, _, port = BIND.rpartition(":")
+    server = waitress.create_server(app, host=host or "0.0.0.0", port=int(port), threads=THREADS)
+    # Closing the listener ends the loop once in-flight requests complete
+    signal.signal(signal.SIGTERM, lambda *_: server.close())
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown()
+
+
+def run_werkzeug():
+    from werkzeug.serving import run_simple
+
+    host, _, port = BIND.rpartition(":")
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        run_simple(host or "0.0.0.0", int(port), app, threaded=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown()
+
+
+if __name__ == "__main__":
+    if gunicorn is not None:
+        log.info("gunicorn on %s: %d workers x %d threads", BIND, WORKERS, THREADS)
+        run_gunicorn()
+    elif waitress is not None:
+        log.info("waitress on %s: 1 process x %d threads (install gunicorn for multiple workers)", BIND, THREADS)
+        run_waitress()
+    else:
+        log.warning("Neither gunicorn nor waitress is installed; using the threaded Werkzeug server on %s", BIND)
+        run_werkzeug()